@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+PatchFox Monitor Benchmark
+Times every patchfox_monitor collector against a synthetic database
+
+Builds a scratch database from schema.sql, fills it with synthetic
+datasource_event / package / package_finding / dataset_metrics rows at the
+requested scale, serves data-service and orchestrate from a local stub, then
+times each collector and records the EXPLAIN plan of every query it ran.
+
+    python3 monitor_benchmark.py --scale 1m --jobs 1000
+    python3 monitor_benchmark.py --scale 1m --jobs 1000 --skip-build --baseline bench-results/1m.json
+
+Before timing, every DB-backed source runs at once, as on the monitor's first
+refresh, to check the connection pool can serve them all together.
+
+Results are written as JSON; with --baseline any collector whose median grew
+past the threshold is reported and the exit status is 1.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import psycopg2
+from rich.console import Console
+from rich.table import Table
+from rich import box
+
+import patchfox_monitor as monitor
+
+console = Console()
+
+# Configuration
+BENCH_DB = "patchfox_bench"
+ADMIN_DB = "postgres"
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+RESULTS_DIR = "bench-results"
+SCALES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+DEFAULT_JOBS = 100
+DEFAULT_REPEAT = 5
+REGRESSION_THRESHOLD = 0.20  # fractional growth of the median that counts as a regression
+REGRESSION_FLOOR_MS = 5.0  # ignore differences smaller than this - timer and cache noise
+
+# Share of datasource_events per status - most of a long-lived dataset has already been processed
+EVENT_STATUS_MIX = [
+    ('PROCESSED', 70),
+    ('READY_FOR_PROCESSING', 10),
+    ('PROCESSING', 8),
+    ('READY_FOR_NEXT_PROCESSING', 7),
+    ('PROCESSING_ERROR', 5)
+]
+PACKAGE_TYPES = ['npm', 'maven', 'pypi', 'golang', 'nuget']
+SEVERITIES = ['CRITICAL', 'HIGH', 'MEDIUM', 'LOW']
+
+
+def admin_connect(args, dbname):
+    """Autocommit connection to the benchmark server"""
+    conn = psycopg2.connect(host=args.host, port=args.port, dbname=dbname, user=args.user, password=args.password)
+    conn.autocommit = True
+    return conn
+
+
+def timed(label, conn, sql):
+    """Run one build statement and print how long it took"""
+    start_time = time.time()
+    with conn.cursor() as cur:
+        cur.execute(sql)
+    console.print(f"  {label:<28} [dim]{time.time() - start_time:8.1f}s[/]")
+
+
+def build_database(args):
+    """Recreate the benchmark database from schema.sql"""
+    console.print(f"[bold]Creating {args.dbname} from {SCHEMA_FILE}[/bold]")
+    conn = admin_connect(args, ADMIN_DB)
+    with conn.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{args.dbname}"')
+        cur.execute(f'CREATE DATABASE "{args.dbname}"')
+        cur.execute("SHOW server_version_num")
+        server_version = int(cur.fetchone()[0])
+    conn.close()
+
+    # pg_dump 18 wraps the dump in \restrict / \unrestrict, which older psql clients reject,
+    # and sets transaction_timeout, which servers before 17 don't know
+    skipped = ('\\restrict', '\\unrestrict') + (('SET transaction_timeout',) if server_version < 170000 else ())
+    with open(SCHEMA_FILE) as f:
+        schema = ''.join(line for line in f if not line.startswith(skipped))
+    subprocess.run(
+        [args.psql, '-h', args.host, '-p', str(args.port), '-U', args.user, '-d', args.dbname,
+         '-q', '-v', 'ON_ERROR_STOP=1'],
+        input=schema, text=True, check=True, stdout=subprocess.DEVNULL,
+        env={**os.environ, 'PGPASSWORD': args.password}
+    )
+
+
+def populate_database(args):
+    """Fill the benchmark database with synthetic rows, set-based so 10M events load in minutes"""
+    events = args.events
+    datasources = args.datasources or max(min(events // 1000, 10_000), 10)
+    packages = args.packages or max(events // 10, 1000)
+    findings = max(packages // 20, 50)
+
+    console.print(f"[bold]Populating {events:,} events, {args.jobs:,} jobs, {datasources:,} datasources, "
+                  f"{packages:,} packages[/bold]")
+    conn = admin_connect(args, args.dbname)
+
+    # Sizes come from argparse ints, so the statements are formatted rather than parameterized (% is modulo here)
+    status_case = "CASE " + " ".join(
+        f"WHEN g % 100 < {sum(share for _, share in EVENT_STATUS_MIX[:idx + 1])} THEN '{status}'"
+        for idx, (status, _) in enumerate(EVENT_STATUS_MIX)
+    ) + " END"
+
+    timed("dataset", conn, """
+        INSERT INTO dataset (name, status, updated_at) VALUES ('bench', 'PROCESSING', now() - interval '2 hours')
+    """)
+    timed("datasource", conn, f"""
+        INSERT INTO datasource (domain, first_event_received_at, last_event_received_at, last_event_received_status,
+                                name, number_event_processing_errors, number_events_received, purl, status, type)
+        SELECT 'bench', now(), now(), 'PROCESSED', 'datasource-' || g, 0, 0, 'pkg:bench/datasource-' || g,
+               (ARRAY['IDLE', 'PROCESSING', 'READY_FOR_PROCESSING', 'READY_FOR_NEXT_PROCESSING'])[1 + g % 4], 'git'
+        FROM generate_series(1, {datasources}) g
+    """)
+    timed("datasource_dataset", conn, "INSERT INTO datasource_dataset SELECT id, 1 FROM datasource")
+    timed("datasource_event", conn, f"""
+        INSERT INTO datasource_event (event_date_time, job_id, payload, purl, status, txid, datasource_id,
+                                      oss_enriched, package_index_enriched, analyzed, forecasted, recommended)
+        SELECT now() - (g || ' seconds')::interval,
+               md5('job-' || (g % {args.jobs}))::uuid,
+               '\\x00'::bytea,
+               'pkg:bench/event-' || g,
+               {status_case},
+               md5('txid-' || g)::uuid,
+               1 + g % {datasources},
+               g % 100 < 70 OR g % 3 <> 0,
+               g % 100 < 70 OR g % 4 <> 0,
+               g % 100 < 70 OR g % 5 <> 0,
+               g % 100 < 70 OR g % 6 <> 0,
+               g % 100 < 70 OR g % 7 <> 0
+        FROM generate_series(1, {events}) g
+    """)
+    package_types = ', '.join(f"'{pkg_type}'" for pkg_type in PACKAGE_TYPES)
+    severities = ', '.join(f"'{severity}'" for severity in SEVERITIES)
+    timed("package", conn, f"""
+        INSERT INTO package (name, purl, type, updated_at, version)
+        SELECT 'package-' || g, 'pkg:bench/package-' || g, (ARRAY[{package_types}])[1 + g % {len(PACKAGE_TYPES)}],
+               now(), '1.0.' || (g % 10)
+        FROM generate_series(1, {packages}) g
+    """)
+    timed("finding", conn, f"INSERT INTO finding (identifier) SELECT 'CVE-BENCH-' || g FROM generate_series(1, {findings}) g")
+    timed("finding_data", conn, f"""
+        INSERT INTO finding_data (cpes, description, identifier, reported_at, severity, finding_id)
+        SELECT '{{}}', 'synthetic', 'CVE-BENCH-' || g, now(), (ARRAY[{severities}])[1 + g % {len(SEVERITIES)}], g
+        FROM generate_series(1, {findings}) g
+    """)
+    timed("package_finding", conn, f"""
+        INSERT INTO package_finding
+        SELECT DISTINCT p, 1 + (p * k) % {findings}
+        FROM generate_series(1, {packages}, 3) p, generate_series(1, 2) k
+    """)
+    timed("dataset_metrics", conn, f"""
+        INSERT INTO dataset_metrics (commit_date_time, datasource_count, datasource_event_count, event_date_time,
+                                     is_current, is_forecast_recommendations_taken, is_forecast_same_course,
+                                     job_id, txid, dataset_id, package_indexes)
+        SELECT now() - ((30 - g) || ' days')::interval, {datasources}, {events}, now(), g = 30, false, false,
+               md5('job-' || g)::uuid, md5('metrics-' || g)::uuid, 1,
+               (SELECT array_agg(p::bigint) FROM generate_series(1, {packages}) p)
+        FROM generate_series(1, 30) g
+    """)
+    timed("analyze", conn, "ANALYZE")
+    conn.close()
+
+
+class StubServiceHandler(BaseHTTPRequestHandler):
+    """Answers the data-service DQ and orchestrate calls the monitor makes, straight from the benchmark database"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def query(self, sql, params=None):
+        with self.server.conn_lock:
+            with self.server.conn.cursor() as cur:
+                cur.execute(sql, params)
+                return cur.fetchall()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == '/api/v1/peristalsis':
+            body = {'data': {'activated': True}}
+        else:
+            table_name = url.path.split('/')[-2]
+            content, total = [], 0
+            if table_name == 'dataset':
+                content = [{'id': row[0], 'name': row[1], 'status': row[2], 'updatedAt': row[3].isoformat()}
+                           for row in self.query("SELECT id, name, status, updated_at FROM dataset ORDER BY id")]
+                total = len(content)
+            elif table_name == 'datasource':
+                total = self.query("SELECT COUNT(*) FROM datasource")[0][0]
+            elif table_name == 'datasetMetrics':
+                content = [{'id': row[0], 'commitDateTime': row[1].isoformat(), 'packages': row[2]}
+                           for row in self.query("""
+                               SELECT id, commit_date_time, cardinality(package_indexes)
+                               FROM dataset_metrics WHERE is_current ORDER BY commit_date_time DESC LIMIT 1
+                           """)]
+                total = len(content)
+            elif table_name == 'datasourceEvent':
+                where = ["status = ANY(%s)"]
+                for param, column in [('ossEnriched', 'oss_enriched'), ('packageIndexEnriched', 'package_index_enriched'),
+                                      ('analyzed', 'analyzed'), ('forecasted', 'forecasted'), ('recommended', 'recommended')]:
+                    if param in params:
+                        where.append(f"{column} = true")
+                total = self.query("SELECT COUNT(*) FROM datasource_event WHERE " + " AND ".join(where),
+                                   (params.get('status', '').split(','),))[0][0]
+            body = {'data': {'titlePage': {'content': content, 'totalElements': total}}}
+
+        raw = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+
+def start_stub_service(args):
+    """Serve the stub on an ephemeral local port, returning its base URL"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubServiceHandler)
+    server.conn = admin_connect(args, args.dbname)
+    server.conn_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name="stub-service", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def configure_monitor(args, stub_url):
+    """Point the monitor module at the benchmark database and stub service"""
+    monitor.POSTGRES_HOST = args.host
+    monitor.POSTGRES_PORT = args.port
+    monitor.POSTGRES_DB = args.dbname
+    monitor.POSTGRES_USER = args.user
+    monitor.POSTGRES_PASSWORD = args.password
+    monitor.DATA_SERVICE_URL = stub_url
+    monitor.ORCHESTRATE_URL = stub_url
+
+
+def reset_monitor_caches():
+    """Drop the monitor's response and snapshot caches so every run pays the full cost"""
+    with monitor.http_cache_lock:
+        monitor.http_cache.clear()
+    monitor.snapshot_aggregate_cache.update(key=None, package_types={}, finding_instances=None)
+
+
+# name -> zero-argument call of each collector
+BENCH_COLLECTORS = [
+    ('query_job_info', monitor.query_job_info),
+    ('get_event_aggregates', monitor.get_event_aggregates),
+    ('get_event_aggregates_from_dq', monitor.get_event_aggregates_from_dq),
+    ('get_package_types', lambda: monitor.get_package_types(None)),
+    ('get_finding_instances', lambda: monitor.get_finding_instances(None)),
+    ('get_dataset_info', monitor.get_dataset_info),
+    ('get_postgres_stats', monitor.get_postgres_stats),
+    ('get_peristalsis_state', monitor.get_peristalsis_state)
+]
+
+
+def capture_queries(collector):
+    """Run a collector once, returning the (sql, params) of every db_fetch it made"""
+    queries = []
+    db_fetch = monitor.db_fetch
+
+    def recording_db_fetch(sql, params=None, one=False, *, name):
+        queries.append((sql, params))
+        return db_fetch(sql, params, one, name=name)
+
+    monitor.db_fetch = recording_db_fetch
+    try:
+        collector()
+    finally:
+        monitor.db_fetch = db_fetch
+    return queries
+
+
+def explain_queries(args, queries):
+    """EXPLAIN ANALYZE each distinct query, keeping the JSON plan and its headline numbers"""
+    conn = admin_connect(args, args.dbname)
+    plans = []
+    seen = set()
+    try:
+        with conn.cursor() as cur:
+            for sql, params in queries:
+                if sql in seen:
+                    continue
+                seen.add(sql)
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+                plan = cur.fetchone()[0][0]
+                plans.append({
+                    'sql': ' '.join(sql.split()),
+                    'execution_ms': plan.get('Execution Time'),
+                    'top_node': plan['Plan']['Node Type'],
+                    'plan': plan
+                })
+    finally:
+        conn.close()
+    return plans
+
+
+def check_pool_capacity():
+    """Run every DB source at once, as the monitor's first collection does - returns the errors they hit"""
+    sources = {name: source for name, source in monitor.create_collector().sources.items() if name in monitor.DB_SOURCES}
+    errors_before = {key: stats['errors'] for key, stats in monitor.diagnostics.summary().items()}
+    barrier = threading.Barrier(len(sources))
+
+    def run(source):
+        barrier.wait()
+        return source()
+
+    with ThreadPoolExecutor(len(sources)) as executor:
+        values = dict(zip(sources, executor.map(run, sources.values())))
+
+    # Sources that swallow their errors still count them in diagnostics
+    errors = [f"{key}: {stats['last_error']}" for key, stats in monitor.diagnostics.summary().items()
+              if stats['errors'] > errors_before.get(key, 0)]
+    errors += [f"{name}: {value['error']}" for name, value in values.items()
+               if isinstance(value, dict) and 'error' in value]
+    return errors
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+def benchmark_collectors(args):
+    """Time every collector (after one warm-up run) and attach its query plans"""
+    results = {}
+    for name, collector in BENCH_COLLECTORS:
+        reset_monitor_caches()
+        queries = capture_queries(collector)
+
+        samples = []
+        for _ in range(args.repeat):
+            reset_monitor_caches()
+            start_time = time.perf_counter()
+            collector()
+            samples.append((time.perf_counter() - start_time) * 1000)
+
+        results[name] = {
+            'min_ms': min(samples),
+            'median_ms': statistics.median(samples),
+            'p95_ms': percentile(samples, 95),
+            'max_ms': max(samples),
+            'samples_ms': samples,
+            'queries': explain_queries(args, queries)
+        }
+        console.print(f"  {name:<28} [cyan]{results[name]['median_ms']:10.1f}ms[/] median")
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Rows of (collector, median, baseline median, delta fraction, regressed)"""
+    rows = []
+    for name, result in results.items():
+        base = baseline.get('collectors', {}).get(name)
+        if base is None:
+            rows.append((name, result['median_ms'], None, None, False))
+            continue
+        delta = (result['median_ms'] - base['median_ms']) / base['median_ms'] if base['median_ms'] else 0.0
+        regressed = delta > threshold and result['median_ms'] - base['median_ms'] > REGRESSION_FLOOR_MS
+        rows.append((name, result['median_ms'], base['median_ms'], delta, regressed))
+    return rows
+
+
+def print_report(results, comparison=None):
+    """Print the timing table, with baseline deltas when given"""
+    table = Table(title="Collector timings", box=box.SIMPLE, header_style="bold cyan")
+    table.add_column("Collector", style="cyan", no_wrap=True)
+    table.add_column("Median", justify="right", no_wrap=True)
+    table.add_column("p95", justify="right", no_wrap=True)
+    table.add_column("Queries", justify="right")
+    table.add_column("Plan", style="dim")
+    if comparison:
+        table.add_column("Baseline", justify="right", no_wrap=True)
+        table.add_column("Δ", justify="right", no_wrap=True)
+
+    deltas = {row[0]: row for row in comparison or []}
+    for name, result in results.items():
+        plans = ', '.join(sorted({query['top_node'] for query in result['queries']}))
+        row = [name, f"{result['median_ms']:,.1f}ms", f"{result['p95_ms']:,.1f}ms", str(len(result['queries'])), plans]
+        if comparison:
+            _, _, base, delta, regressed = deltas[name]
+            if base is None:
+                row += ["[dim]-[/]", "[dim]new[/]"]
+            else:
+                color = "red" if regressed else "green" if delta < 0 else "white"
+                row += [f"{base:,.1f}ms", f"[{color}]{delta:+.0%}[/]"]
+        table.add_row(*row)
+    console.print(table)
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    arg_parser = argparse.ArgumentParser(description="Benchmark patchfox_monitor collectors on synthetic data")
+    arg_parser.add_argument('--scale', choices=SCALES, default='10k', help="number of datasource_events")
+    arg_parser.add_argument('--events', type=int, help="exact number of datasource_events (overrides --scale)")
+    arg_parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS, help="distinct job_ids across the events")
+    arg_parser.add_argument('--datasources', type=int, help="number of datasources (default events / 1000)")
+    arg_parser.add_argument('--packages', type=int, help="number of packages (default events / 10)")
+    arg_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="timed runs per collector")
+    arg_parser.add_argument('--host', default=monitor.POSTGRES_HOST)
+    arg_parser.add_argument('--port', type=int, default=monitor.POSTGRES_PORT)
+    arg_parser.add_argument('--user', default=monitor.POSTGRES_USER)
+    arg_parser.add_argument('--password', default=monitor.POSTGRES_PASSWORD)
+    arg_parser.add_argument('--dbname', default=BENCH_DB, help="scratch database - dropped and recreated")
+    arg_parser.add_argument('--psql', default='psql', help="psql binary used to load schema.sql")
+    arg_parser.add_argument('--skip-build', action='store_true', help="reuse the existing benchmark database")
+    arg_parser.add_argument('--output', help="results file (default bench-results/<events>-<jobs>.json)")
+    arg_parser.add_argument('--baseline', help="earlier results file to check for regressions")
+    arg_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                            help="median growth that counts as a regression, e.g. 0.2 for 20%%")
+    args = arg_parser.parse_args(argv)
+    args.events = args.events or SCALES[args.scale]
+    return args
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+
+    if not args.skip_build:
+        build_database(args)
+        populate_database(args)
+
+    configure_monitor(args, start_stub_service(args))
+    try:
+        console.print(f"[bold]Running all {len(monitor.DB_SOURCES)} DB sources at once "
+                      f"on a pool of {monitor.POSTGRES_POOL_SIZE}[/bold]")
+        pool_errors = check_pool_capacity()
+        if pool_errors:
+            for error in pool_errors:
+                console.print(f"  [red]{error}[/red]")
+            sys.exit(1)
+        console.print("[bold]Timing collectors[/bold]")
+        results = benchmark_collectors(args)
+    finally:
+        monitor.close_db_pool()
+
+    conn = admin_connect(args, args.dbname)
+    with conn.cursor() as cur:
+        cur.execute("SHOW server_version")
+        server_version = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(*), COUNT(DISTINCT job_id) FROM datasource_event")
+        event_count, job_count = cur.fetchone()
+    conn.close()
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(),
+            'server_version': server_version,
+            'events': event_count,
+            'jobs': job_count,
+            'repeat': args.repeat
+        },
+        'collectors': results
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{event_count}-{job_count}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+
+    comparison = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if (baseline['meta']['events'], baseline['meta']['jobs']) != (event_count, job_count):
+            console.print(f"[yellow]Baseline was taken at {baseline['meta']['events']:,} events / "
+                          f"{baseline['meta']['jobs']:,} jobs - deltas include the change in scale[/yellow]")
+        comparison = compare_to_baseline(results, baseline, args.threshold)
+    print_report(results, comparison)
+    console.print(f"[dim]Results written to {output}[/dim]")
+
+    regressions = [row[0] for row in comparison or [] if row[4]]
+    if regressions:
+        console.print(f"[red]Regressions: {', '.join(regressions)}[/red]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+-- ============================================================
+-- monitor_notify_triggers.sql
+--
+-- Purpose:
+--   Push pipeline progress to patchfox_monitor.py (run with --push)
+--   over LISTEN/NOTIFY instead of having it re-count datasource_event.
+--
+--   - datasource_event: statement-level triggers aggregate every
+--     INSERT / UPDATE / DELETE into per (job_id, status) deltas of the
+--     row count and enrichment flags, so a bulk status transition
+--     (e.g. update_datasource_events_processing_status) sends one
+--     notification rather than one per row.
+--   - dataset: row-level trigger on status changes.
+--
+-- Channel: patchfox_monitor
+--   {"t":"dse","x":<txid>,"d":[{"j":<job_id>,"s":<status>,"n":..,"o":..,"p":..,"a":..,"f":..,"r":..}]}
+--   {"t":"dataset","x":<txid>,"id":<dataset id>,"s":<status>}
+--   {"t":"resync"}  -- delta too large for one payload, monitor recounts
+--
+--   x is the writing transaction's txid, so the monitor can skip deltas
+--   its last recount's snapshot already includes.
+--
+-- Apply after schema.sql:
+--   psql -U mr_data mrs_db -v ON_ERROR_STOP=on -f monitor_notify_triggers.sql
+-- ============================================================
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION public.monitor_notify_datasource_event_deltas() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+  added   text := 'SELECT job_id, status, 1 AS n,
+                      (oss_enriched IS TRUE)::int AS o, (package_index_enriched IS TRUE)::int AS p,
+                      (analyzed IS TRUE)::int AS a, (forecasted IS TRUE)::int AS f,
+                      (recommended IS TRUE)::int AS r
+                  FROM new_rows';
+  removed text := 'SELECT job_id, status, -1 AS n,
+                      -(oss_enriched IS TRUE)::int AS o, -(package_index_enriched IS TRUE)::int AS p,
+                      -(analyzed IS TRUE)::int AS a, -(forecasted IS TRUE)::int AS f,
+                      -(recommended IS TRUE)::int AS r
+                  FROM old_rows';
+  changes text;
+  deltas json;
+  payload text;
+BEGIN
+  -- Only the transition tables of the firing event exist, so the row source is picked per TG_OP
+  changes := CASE TG_OP
+               WHEN 'INSERT' THEN added
+               WHEN 'DELETE' THEN removed
+               ELSE added || ' UNION ALL ' || removed
+             END;
+
+  EXECUTE format($q$
+    SELECT json_agg(grouped)
+    FROM (
+      SELECT job_id AS j, status AS s, SUM(n) AS n, SUM(o) AS o, SUM(p) AS p,
+             SUM(a) AS a, SUM(f) AS f, SUM(r) AS r
+      FROM (%s) changes
+      GROUP BY job_id, status
+    ) grouped
+    WHERE n <> 0 OR o <> 0 OR p <> 0 OR a <> 0 OR f <> 0 OR r <> 0
+  $q$, changes) INTO deltas;
+
+  IF deltas IS NULL THEN
+    RETURN NULL;
+  END IF;
+
+  payload := json_build_object('t', 'dse', 'x', txid_current(), 'd', deltas)::text;
+  -- NOTIFY payloads are capped just under 8000 bytes
+  IF octet_length(payload) > 7900 THEN
+    payload := '{"t":"resync"}';
+  END IF;
+  PERFORM pg_notify('patchfox_monitor', payload);
+  RETURN NULL;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION public.monitor_notify_dataset_status() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+  PERFORM pg_notify('patchfox_monitor',
+                    json_build_object('t', 'dataset', 'x', txid_current(), 'id', NEW.id, 's', NEW.status)::text);
+  RETURN NULL;
+END;
+$$;
+
+
+-- Transition tables are only allowed on single-event triggers, hence three of them
+DROP TRIGGER IF EXISTS monitor_notify_datasource_event_insert ON public.datasource_event;
+CREATE TRIGGER monitor_notify_datasource_event_insert
+  AFTER INSERT ON public.datasource_event
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.monitor_notify_datasource_event_deltas();
+
+DROP TRIGGER IF EXISTS monitor_notify_datasource_event_update ON public.datasource_event;
+CREATE TRIGGER monitor_notify_datasource_event_update
+  AFTER UPDATE ON public.datasource_event
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.monitor_notify_datasource_event_deltas();
+
+DROP TRIGGER IF EXISTS monitor_notify_datasource_event_delete ON public.datasource_event;
+CREATE TRIGGER monitor_notify_datasource_event_delete
+  AFTER DELETE ON public.datasource_event
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION public.monitor_notify_datasource_event_deltas();
+
+DROP TRIGGER IF EXISTS monitor_notify_dataset_status ON public.dataset;
+CREATE TRIGGER monitor_notify_dataset_status
+  AFTER INSERT OR UPDATE OF status ON public.dataset
+  FOR EACH ROW EXECUTE FUNCTION public.monitor_notify_dataset_status();
+
+COMMIT;
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+PatchFox Offset Benchmark
+Checks that patchfox_offset.py shifts every id exactly once, also when it is interrupted and resumed
+
+Builds a scratch database with monitor_benchmark's synthetic rows, plus
+package_indexes arrays, edits, join rows and NULL references, then shifts two
+copies of it:
+
+    straight      one uninterrupted run of patchfox_offset.py
+    interrupted   stopped after every --stop-every committed batches, --interruptions
+                  times, then finished by re-running patchfox_offset.py
+
+Every table of each copy, with the offset taken back off every shifted value,
+must fingerprint the same as the original - a value shifted twice, or not at
+all, shows up as a different table.
+
+    python3 offset_benchmark.py
+    python3 offset_benchmark.py --events 200000 --batch-rows 2000 --interruptions 10
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import psycopg2
+from rich.console import Console
+from rich.table import Table
+from rich import box
+
+import patchfox_common as common
+import patchfox_offset
+import monitor_benchmark
+from patchfox_merge import CHILD_TABLES, SEQUENCE_TABLES
+
+console = Console()
+
+# Configuration
+BENCH_DB = "patchfox_offset_bench"
+ADMIN_DB = "postgres"
+OFFSET_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "patchfox_offset.py")
+DEFAULT_EVENTS = 20_000
+DEFAULT_JOBS = 10
+DEFAULT_BATCH_ROWS = 500  # small batches, so every interruption lands inside a table
+DEFAULT_STOP_EVERY = 7
+DEFAULT_INTERRUPTIONS = 5
+FINGERPRINT_TABLES = sorted(set(SEQUENCE_TABLES) | set(CHILD_TABLES))
+
+
+class Interrupted(Exception):
+    """Raised between two committed batches to stop a run"""
+
+
+def connect(args, dbname):
+    """Connection to one of the benchmark databases"""
+    return psycopg2.connect(host=args.host, port=args.port, dbname=dbname, user=args.user, password=args.password,
+                            application_name=patchfox_offset.OFFSET_APPLICATION_NAME)
+
+
+def build_database(args):
+    """monitor_benchmark's synthetic database, plus the references it leaves out"""
+    monitor_benchmark.build_database(args)
+    monitor_benchmark.populate_database(args)
+
+    conn = monitor_benchmark.admin_connect(args, args.dbname)
+    # NOT NULL is the schema's promise, not the offset tool's - NULL references must survive a run unchanged
+    monitor_benchmark.timed("package_family", conn, """
+        ALTER TABLE package_family ALTER COLUMN dataset_metrics_id DROP NOT NULL;
+        INSERT INTO package_family (dataset_metrics_id, package_family)
+        SELECT id, 'family-' || id FROM dataset_metrics
+        UNION ALL
+        SELECT NULL, 'family-without-metrics'
+    """)
+    monitor_benchmark.timed("datasource.package_indexes", conn, """
+        UPDATE datasource d
+        SET package_indexes = ARRAY(SELECT 1 + (d.id * k) % (SELECT max(id) FROM package)
+                                    FROM generate_series(1, 20) k ORDER BY k)
+        WHERE d.id % 5 <> 0
+    """)
+    monitor_benchmark.timed("datasource_event_package", conn, """
+        INSERT INTO datasource_event_package (datasource_event_id, package_id)
+        SELECT e.id, 1 + e.id % (SELECT max(id) FROM package)
+        FROM datasource_event e
+        WHERE e.id % 4 = 0
+    """)
+    monitor_benchmark.timed("finding_to_reporter", conn, """
+        INSERT INTO finding_reporter (name) SELECT 'reporter-' || g FROM generate_series(1, 3) g;
+        INSERT INTO finding_to_reporter (finding_id, reporter_id)
+        SELECT f.id, r.id FROM finding f JOIN finding_reporter r ON r.id = 1 + f.id % 3
+    """)
+    monitor_benchmark.timed("edit", conn, """
+        INSERT INTO edit (after, before, commit_date_time, edit_type, event_date_time, dataset_metrics_id, datasource_id)
+        SELECT 'pkg:bench/package-' || g || '@2', 'pkg:bench/package-' || g || '@1', now(), 'UPDATE', now(),
+               CASE WHEN g % 3 = 0 THEN NULL ELSE (SELECT min(id) FROM dataset_metrics) + g % 30 END,
+               (SELECT min(id) FROM datasource) + g % 10
+        FROM generate_series(1, 500) g
+    """)
+    monitor_benchmark.timed("analyze", conn, "ANALYZE")
+    conn.close()
+
+
+def copy_database(args, name):
+    """Fresh copy of the benchmark database"""
+    conn = monitor_benchmark.admin_connect(args, ADMIN_DB)
+    with conn.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        cur.execute(f'CREATE DATABASE "{name}" TEMPLATE "{args.dbname}"')
+    conn.close()
+    return name
+
+
+def drop_database(args, name):
+    """Remove one copy"""
+    conn = monitor_benchmark.admin_connect(args, ADMIN_DB)
+    with conn.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    conn.close()
+
+
+def fingerprint(args, dbname, offset):
+    """table -> (rows, md5 over every row) with offset taken back off each shifted value"""
+    rewrites = {plan.table: plan.rewrites for plan in patchfox_offset.plan_tables()}
+    conn = connect(args, dbname)
+    result = {}
+    try:
+        with conn, conn.cursor() as cur:
+            for table in FINGERPRINT_TABLES:
+                cur.execute("""
+                    SELECT attname FROM pg_attribute
+                    WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+                    ORDER BY attnum
+                """, (f"public.{table}",))
+                values = []
+                for (column,) in cur.fetchall():
+                    if column not in rewrites.get(table, ()):
+                        values.append(f't."{column}"')
+                    elif column == 'package_indexes':
+                        values.append("""CASE WHEN t.package_indexes IS NULL THEN NULL ELSE ARRAY(
+                            SELECT u.x - %(offset)s FROM unnest(t.package_indexes) WITH ORDINALITY AS u(x, ord)
+                            ORDER BY u.ord) END""")
+                    else:
+                        values.append(f't."{column}" - %(offset)s')
+                row = f"ROW({', '.join(values)})::text"
+                cur.execute(f"""
+                    SELECT count(*), md5(COALESCE(string_agg({row}, '|' ORDER BY {row}), ''))
+                    FROM public.{table} t
+                """, {'offset': offset})
+                result[table] = cur.fetchone()
+    finally:
+        conn.close()
+    return result
+
+
+def run_offset_script(args, dbname, *options):
+    """patchfox_offset.py as the operator runs it - returns its runtime in seconds"""
+    command = [sys.executable, OFFSET_SCRIPT, '--host', args.host, '--port', str(args.port), '--user', args.user,
+               '--password', args.password, '--dbname', dbname, '--workers', str(args.workers), *options]
+    start_time = time.time()
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        console.print(completed.stdout + completed.stderr)
+        raise RuntimeError(f"patchfox_offset.py exited with {completed.returncode} on {dbname}")
+    return time.time() - start_time
+
+
+def run_interrupted(args, dbname, offset):
+    """Shift in rounds that each stop after stop_every committed batches, then finish with the script
+
+    Returns (seconds, [(batches, rows) per interrupted round]).
+    """
+    patchfox_offset.BATCH_ROWS = args.batch_rows
+    conn = connect(args, dbname)
+    with conn, conn.cursor() as cur:
+        patchfox_offset.save_state(cur, offset)
+    conn.close()
+
+    start_time = time.time()
+    rounds = []
+    for _ in range(args.interruptions):
+        shifted = {'batches': 0, 'rows': 0}
+        seen = {}
+
+        def on_batch(plan):
+            # Batches over pages shifted by an earlier round move nothing and are not counted
+            rows = plan.done - seen.get(plan.table, 0)
+            seen[plan.table] = plan.done
+            if rows:
+                shifted['batches'] += 1
+                shifted['rows'] += rows
+                if shifted['batches'] >= args.stop_every:
+                    raise Interrupted()
+
+        plans = patchfox_offset.plan_tables()
+        conn = connect(args, dbname)
+        with conn, conn.cursor() as cur:
+            for plan in plans:
+                patchfox_offset.measure_table(cur, plan)
+        conn.close()
+        try:
+            for plan in plans:
+                patchfox_offset.offset_table(lambda: connect(args, dbname), plan, offset, on_batch)
+        except Interrupted:
+            pass
+        rounds.append((shifted['batches'], shifted['rows']))
+        if shifted['batches'] < args.stop_every:
+            break
+
+    # The script picks the offset up from the state table, as after a real interruption
+    run_offset_script(args, dbname)
+    return time.time() - start_time, rounds
+
+
+def print_report(args, offset, original, results):
+    """One row per run, its tables compared with the original"""
+    table = Table(title=f"patchfox_offset +{offset:,} - {sum(rows for rows, _ in original.values()):,} rows "
+                        f"in {len(original)} tables", box=box.SIMPLE)
+    table.add_column("Run")
+    table.add_column("Seconds", justify="right")
+    table.add_column("Interrupted", justify="right")
+    table.add_column("Result")
+    for name, (seconds, rounds, fingerprints) in results.items():
+        different = [t for t in FINGERPRINT_TABLES if fingerprints[t] != original[t]]
+        table.add_row(name, f"{seconds:.2f}",
+                      f"{len(rounds)}x, {sum(rows for _, rows in rounds):,} rows before" if rounds else "[dim]-[/]",
+                      f"[red]DIFFERENT: {', '.join(different)}[/]" if different else "[green]same[/]")
+    console.print(table)
+    return all(fingerprints == original for _, _, fingerprints in results.values())
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    arg_parser = argparse.ArgumentParser(description="Check patchfox_offset.py shifts every id exactly once across interruptions")
+    arg_parser.add_argument('--events', type=int, default=DEFAULT_EVENTS, help="synthetic datasource_events")
+    arg_parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS, help="distinct job_ids across the events")
+    arg_parser.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS,
+                            help="rows per batch for the interrupted rounds")
+    arg_parser.add_argument('--stop-every', type=int, default=DEFAULT_STOP_EVERY,
+                            help="committed batches after which a round is interrupted")
+    arg_parser.add_argument('--interruptions', type=int, default=DEFAULT_INTERRUPTIONS, help="interrupted rounds")
+    arg_parser.add_argument('--workers', type=int, default=patchfox_offset.DEFAULT_WORKERS)
+    arg_parser.add_argument('--host', default=common.POSTGRES_HOST)
+    arg_parser.add_argument('--port', type=int, default=common.POSTGRES_PORT)
+    arg_parser.add_argument('--user', default=common.POSTGRES_USER)
+    arg_parser.add_argument('--password', default=common.POSTGRES_PASSWORD)
+    arg_parser.add_argument('--dbname', default=BENCH_DB, help="scratch database - dropped and recreated, as are its copies")
+    arg_parser.add_argument('--psql', default='psql', help="psql binary used to load schema.sql")
+    args = arg_parser.parse_args(argv)
+    # monitor_benchmark sizes these from the events when unset
+    args.datasources = args.packages = None
+    return args
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+    build_database(args)
+
+    conn = connect(args, args.dbname)
+    with conn, conn.cursor() as cur:
+        offset = patchfox_offset.compute_offset(patchfox_offset.largest_ids(cur))
+    conn.close()
+    with console.status("Fingerprinting the original..."):
+        original = fingerprint(args, args.dbname, 0)
+
+    results = {}
+    straight = copy_database(args, f"{args.dbname}_straight")
+    interrupted = copy_database(args, f"{args.dbname}_interrupted")
+    try:
+        with console.status("straight..."):
+            seconds = run_offset_script(args, straight, '--offset', str(offset))
+            results['straight'] = (seconds, [], fingerprint(args, straight, offset))
+        with console.status("interrupted..."):
+            seconds, rounds = run_interrupted(args, interrupted, offset)
+            results['interrupted'] = (seconds, rounds, fingerprint(args, interrupted, offset))
+    except RuntimeError as e:
+        console.print(f"[red]Offset failed:[/] {e}")
+        sys.exit(1)
+    finally:
+        drop_database(args, straight)
+        drop_database(args, interrupted)
+
+    if not print_report(args, offset, original, results):
+        console.print("[red]A run changed more than the ids - some values were shifted twice or not at all[/]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
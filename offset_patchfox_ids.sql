@@ -10,6 +10,10 @@
 --   2. Import your dump: psql dbname < dump.sql
 --   3. Run this script: psql dbname < offset_patchfox_ids.sql
 --   4. Export: pg_dump dbname > dump_offset.sql
+--
+-- On large databases prefer patchfox_offset.py: it picks the offset from the
+-- sequences, works in resumable committed batches and also shifts the
+-- package_indexes arrays, which this script leaves untouched.
 
 -- ============================================================================
 -- CONFIGURATION
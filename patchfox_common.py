@@ -0,0 +1,42 @@
+"""
+PatchFox Common
+Connection defaults and formatting helpers shared by the monitor and the merge tools
+
+Kept free of the monitor's dependencies (docker, psutil, the terminal) so the
+command-line tools can import it on any host that can reach the database.
+"""
+
+# Configuration
+POSTGRES_HOST = "localhost"
+POSTGRES_PORT = 54321
+POSTGRES_DB = "mrs_db"
+POSTGRES_USER = "mr_data"
+POSTGRES_PASSWORD = "omnomdata"
+
+
+def format_duration(total_seconds):
+    """Format seconds as e.g. 2h 5m 3s"""
+    total_seconds = int(total_seconds)
+    hours = total_seconds // 3600
+    minutes = (total_seconds % 3600) // 60
+    seconds = total_seconds % 60
+
+    if hours > 0:
+        return f"{hours}h {minutes}m {seconds}s"
+    elif minutes > 0:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+
+def format_compact(value, units=('', 'K', 'M', 'G', 'T'), base=1000):
+    """Format a count in at most four characters plus a unit, e.g. 12.3M"""
+    for unit in units[:-1]:
+        if round(abs(value)) < base:
+            return f"{value:.0f}{unit}" if unit == units[0] or value >= 10 else f"{value:.1f}{unit}"
+        value /= base
+    return f"{value:.1f}{units[-1]}"
+
+
+def format_bytes(size):
+    """Format a byte count, e.g. 824K or 1.8G"""
+    return format_compact(size, units=('B', 'K', 'M', 'G', 'T'), base=1024)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+PatchFox Load
+Loads a data-only pg_dump into another schema, several tables at once
+
+Replaces `sed 's/COPY public\\./COPY staging\\./g' dump | psql`: the dump is
+memory-mapped and split into its per-table COPY sections without reading it
+into memory, then each section is streamed into <schema>.<table> over its own
+connection with COPY, largest tables first. Indexes and primary / unique keys
+of the loaded tables are dropped before their COPY and rebuilt straight after
+it, while other tables are still loading.
+
+Each table is truncated and loaded in one transaction, so a failed load is
+simply re-run. Dropped index definitions are kept in <schema>.load_deferred_indexes
+until rebuilt, so a re-run after a crash still restores them.
+
+The dump must be plain-format COPY (pg_dump --data-only, without --inserts /
+--column-inserts).
+
+    python3 patchfox_load.py dump2_data_only.sql
+    python3 patchfox_load.py dump2_data_only.sql --schema staging --workers 8
+"""
+
+import argparse
+import mmap
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import psycopg2
+from psycopg2.extensions import quote_ident
+from rich.console import Console
+from rich.progress import BarColumn, Progress, TaskProgressColumn, TextColumn, TimeElapsedColumn
+from rich.table import Table
+from rich import box
+
+import patchfox_common as common
+
+console = Console()
+
+# Configuration
+LOAD_APPLICATION_NAME = "patchfox-load"
+DEFAULT_SCHEMA = "staging"
+DEFAULT_SOURCE_SCHEMA = "public"
+DEFAULT_WORKERS = 4
+COPY_CHUNK_BYTES = 1024 * 1024  # bytes handed to COPY per read
+LOAD_MAINTENANCE_WORK_MEM = "512MB"  # per connection, for the index rebuilds
+
+COPY_HEADER = re.compile(rb'^COPY ("?[^". ]+"?)\.("?[^". ]+"?) (\(.*\)) FROM stdin;$')
+COPY_END = b'\n\\.\n'
+
+
+@dataclass
+class Section:
+    """One table's COPY block - byte offsets of its data rows within the dump"""
+    table: str
+    columns: str
+    start: int
+    end: int
+    rows: int = 0
+    load_seconds: float = 0.0
+    index_seconds: float = 0.0
+    indexes: list = field(default_factory=list)
+
+    @property
+    def size(self):
+        return self.end - self.start
+
+
+class SectionReader:
+    """File-like view of one section for copy_expert, counting rows as they are handed over"""
+
+    def __init__(self, dump, section, on_read=None):
+        self.dump = dump
+        self.position = section.start
+        self.end = section.end
+        self.section = section
+        self.on_read = on_read
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.end - self.position
+        chunk = self.dump[self.position:min(self.position + size, self.end)]
+        self.position += len(chunk)
+        # COPY text format escapes embedded newlines, so every newline ends a row
+        self.section.rows += chunk.count(b'\n')
+        if self.on_read:
+            self.on_read(self.section, self.position - self.section.start)
+        return chunk
+
+
+def scan_sections(dump, source_schema=DEFAULT_SOURCE_SCHEMA):
+    """Find every COPY section of source_schema - only headers and terminators are searched for, rows are never parsed"""
+    sections = []
+    position = 0
+    while True:
+        if position == 0 and dump[:5] == b'COPY ':
+            header_start = 0
+        else:
+            header_start = dump.find(b'\nCOPY ', position) + 1
+            if header_start == 0:
+                break
+        if dump.find(b'\nINSERT INTO ', position, header_start) >= 0:
+            raise ValueError("dump uses INSERT statements - re-dump with --data-only and without --inserts / --column-inserts")
+
+        header_end = dump.find(b'\n', header_start)
+        match = COPY_HEADER.match(dump[header_start:header_end])
+        if not match:
+            raise ValueError(f"unrecognised COPY header at byte {header_start}")
+        terminator = dump.find(COPY_END, header_end)
+        if terminator < 0:
+            raise ValueError(f"COPY section at byte {header_start} is not terminated - truncated dump?")
+        # Continue from the terminator's last newline, where the next statement's line starts
+        position = terminator + len(COPY_END) - 1
+
+        schema, table, columns = (part.decode() for part in match.groups())
+        if schema.strip('"') == source_schema:
+            sections.append(Section(table, columns, header_end + 1, terminator + 1))
+
+    if not sections and dump.find(b'INSERT INTO ') >= 0:
+        raise ValueError("dump uses INSERT statements - re-dump with --data-only and without --inserts / --column-inserts")
+    return sections
+
+
+def defer_indexes(conn, schema, tables):
+    """Record, then drop, the indexes and primary / unique / exclusion keys of the tables about to be loaded"""
+    with conn, conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.load_deferred_indexes (
+                table_name text NOT NULL,
+                name text NOT NULL,
+                definition text NOT NULL,
+                PRIMARY KEY (table_name, name)
+            )
+        """)
+        for table in tables:
+            # Constraint-backed indexes are dropped through their constraint and re-added with ALTER TABLE
+            cur.execute("""
+                SELECT c.conname,
+                       format('ALTER TABLE %%s ADD CONSTRAINT %%I %%s', c.conrelid::regclass, c.conname, pg_get_constraintdef(c.oid)),
+                       format('ALTER TABLE %%s DROP CONSTRAINT %%I', c.conrelid::regclass, c.conname)
+                FROM pg_constraint c
+                WHERE c.conrelid = %(table)s::regclass
+                  AND c.contype IN ('p', 'u', 'x')
+                UNION ALL
+                SELECT i.indexrelid::regclass::text,
+                       pg_get_indexdef(i.indexrelid),
+                       format('DROP INDEX %%s', i.indexrelid::regclass)
+                FROM pg_index i
+                WHERE i.indrelid = %(table)s::regclass
+                  AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+            """, {'table': f"{schema}.{table}"})
+            for name, definition, drop in cur.fetchall():
+                cur.execute(f"INSERT INTO {schema}.load_deferred_indexes VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+                            (table, name, definition))
+                cur.execute(drop)
+
+
+def deferred_indexes(conn, schema):
+    """Index definitions still waiting to be rebuilt - table -> [(name, definition)], constraints first"""
+    with conn, conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT table_name, name, definition
+            FROM {schema}.load_deferred_indexes
+            ORDER BY table_name, definition LIKE 'ALTER TABLE%' DESC, name
+        """)
+        pending = {}
+        for table, name, definition in cur.fetchall():
+            pending.setdefault(table, []).append((name, definition))
+        return pending
+
+
+def load_section(connect, dump, section, schema, indexes, on_read=None):
+    """Truncate and COPY one table in a single transaction, then rebuild its deferred indexes"""
+    conn = connect()
+    try:
+        start_time = time.time()
+        with conn, conn.cursor() as cur:
+            cur.execute("SET LOCAL synchronous_commit = off")
+            # TRUNCATE in the loading transaction also lets wal_level = minimal skip WAL for the COPY
+            cur.execute(f"TRUNCATE {schema}.{section.table}")
+            cur.copy_expert(f"COPY {schema}.{section.table} {section.columns} FROM STDIN",
+                            SectionReader(dump, section, on_read), size=COPY_CHUNK_BYTES)
+        section.load_seconds = time.time() - start_time
+
+        start_time = time.time()
+        with conn, conn.cursor() as cur:
+            cur.execute(f"SET maintenance_work_mem = '{LOAD_MAINTENANCE_WORK_MEM}'")
+        for name, definition in indexes:
+            # Each rebuild commits with the removal of its definition, so a crash never loses one
+            with conn, conn.cursor() as cur:
+                cur.execute(definition)
+                cur.execute(f"DELETE FROM {schema}.load_deferred_indexes WHERE table_name = %s AND name = %s",
+                            (section.table, name))
+            section.indexes.append(name)
+        with conn, conn.cursor() as cur:
+            cur.execute(f"ANALYZE {schema}.{section.table}")
+        section.index_seconds = time.time() - start_time
+        return section
+    finally:
+        conn.close()
+
+
+def load_dump(connect, path, schema=DEFAULT_SCHEMA, source_schema=DEFAULT_SOURCE_SCHEMA, workers=DEFAULT_WORKERS,
+              tables=None, on_read=None, on_table=None):
+    """Load every source_schema COPY section of the dump at path into schema - returns the loaded Sections"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as dump:
+        sections = [section for section in scan_sections(dump, source_schema) if not tables or section.table in tables]
+        # Largest first, so the biggest table is not the one left running alone at the end
+        sections.sort(key=lambda section: section.size, reverse=True)
+
+        conn = connect()
+        try:
+            schema_name = quote_ident(schema, conn)
+            defer_indexes(conn, schema_name, [section.table for section in sections])
+            pending = deferred_indexes(conn, schema_name)
+        finally:
+            conn.close()
+
+        def run(section):
+            loaded = load_section(connect, dump, section, schema_name, pending.get(section.table, []), on_read)
+            if on_table:
+                on_table(loaded)
+            return loaded
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(run, sections))
+
+
+def print_report(sections, wall_seconds):
+    """Per-table rows, rows/sec and index rebuild time"""
+    table = Table(title="Loaded tables", box=box.SIMPLE, header_style="bold cyan")
+    table.add_column("Table", style="cyan", no_wrap=True)
+    table.add_column("Rows", justify="right")
+    table.add_column("Size", justify="right")
+    table.add_column("COPY", justify="right")
+    table.add_column("Rows/sec", justify="right")
+    table.add_column("Indexes", justify="right")
+    for section in sorted(sections, key=lambda section: section.load_seconds, reverse=True):
+        rate = section.rows / section.load_seconds if section.load_seconds else 0
+        table.add_row(section.table, f"{section.rows:,}", common.format_bytes(section.size),
+                      f"{section.load_seconds:.1f}s", f"{rate:,.0f}",
+                      f"{len(section.indexes)} in {section.index_seconds:.1f}s" if section.indexes else "[dim]-[/]")
+    console.print(table)
+
+    rows = sum(section.rows for section in sections)
+    console.print(f"[bold]{rows:,} rows[/] in {common.format_duration(wall_seconds) if wall_seconds >= 60 else f'{wall_seconds:.1f}s'} "
+                  f"({rows / wall_seconds if wall_seconds else 0:,.0f} rows/sec overall)")
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    arg_parser = argparse.ArgumentParser(description="Load a data-only dump into another schema with parallel COPY")
+    arg_parser.add_argument('dump', help="plain-format data-only dump (COPY, not INSERT)")
+    arg_parser.add_argument('--schema', default=DEFAULT_SCHEMA, help="schema the tables are loaded into")
+    arg_parser.add_argument('--source-schema', default=DEFAULT_SOURCE_SCHEMA, help="schema the dump was taken from")
+    arg_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="tables loaded at once")
+    arg_parser.add_argument('--tables', help="comma-separated tables to load (default all in the dump)")
+    arg_parser.add_argument('--host', default=common.POSTGRES_HOST)
+    arg_parser.add_argument('--port', type=int, default=common.POSTGRES_PORT)
+    arg_parser.add_argument('--user', default=common.POSTGRES_USER)
+    arg_parser.add_argument('--password', default=common.POSTGRES_PASSWORD)
+    arg_parser.add_argument('--dbname', default=common.POSTGRES_DB)
+    return arg_parser.parse_args(argv)
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+
+    def connect():
+        return psycopg2.connect(host=args.host, port=args.port, dbname=args.dbname, user=args.user,
+                                password=args.password, application_name=LOAD_APPLICATION_NAME)
+
+    progress = Progress(
+        TextColumn("{task.description:<28}"), BarColumn(), TaskProgressColumn(),
+        TextColumn("{task.fields[rows]:>12,} rows {task.fields[rate]:>10,.0f}/s"), TimeElapsedColumn(),
+        console=console, transient=True
+    )
+    tasks = {}
+    tasks_lock = threading.Lock()
+
+    def on_read(section, loaded_bytes):
+        with tasks_lock:
+            if section.table not in tasks:
+                tasks[section.table] = (progress.add_task(section.table, total=section.size, rows=0, rate=0), time.time())
+            task, started = tasks[section.table]
+        elapsed = time.time() - started
+        progress.update(task, completed=loaded_bytes, rows=section.rows, rate=section.rows / elapsed if elapsed else 0)
+
+    def on_table(section):
+        with tasks_lock:
+            task = tasks.pop(section.table, (None,))[0]
+        if task is not None:
+            progress.remove_task(task)
+        rate = section.rows / section.load_seconds if section.load_seconds else 0
+        progress.console.print(f"[green]✓[/] {section.table:<28} {section.rows:>12,} rows {rate:>10,.0f}/s "
+                               f"[dim]indexes {section.index_seconds:.1f}s[/]")
+
+    start_time = time.time()
+    try:
+        with progress:
+            sections = load_dump(connect, args.dump, args.schema, args.source_schema, args.workers,
+                                 set(args.tables.split(',')) if args.tables else None, on_read, on_table)
+    except (ValueError, psycopg2.Error) as e:
+        console.print(f"[red]Load failed:[/] {' '.join(str(e).split())}")
+        sys.exit(1)
+    print_report(sections, time.time() - start_time)
+
+
+if __name__ == "__main__":
+    main()
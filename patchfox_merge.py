@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+PatchFox Merge
+Merges a second dump into the database as a dependency graph of committed phases
+
+Runs the merge_two_dumps_playbook_v2.md workflow - create staging, load the
+data-only dump into it, merge staging into public, repair package_indexes,
+verify - with every table as its own phase. Independent parent tables merge
+concurrently on separate connections and each child table follows as soon as
+the id maps of the tables it references exist.
+
+Every phase commits on its own and records itself in staging.merge_progress
+in the same transaction, so re-running the same command resumes after the
+last completed phase. Drop the staging schema to start the next merge.
+
+    python3 patchfox_merge.py --dump dump2_data_only.sql
+    python3 patchfox_merge.py --plan
+    python3 patchfox_merge.py --workers 8
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+import psycopg2
+from psycopg2.extensions import quote_ident
+from rich.console import Console
+from rich.progress import Progress, SpinnerColumn, TextColumn, TimeElapsedColumn
+from rich.table import Table
+from rich import box
+
+import patchfox_load
+import patchfox_remap
+import patchfox_verify
+import patchfox_common as common
+
+console = Console()
+
+# Configuration
+MERGE_APPLICATION_NAME = "patchfox-merge"
+DEFAULT_WORKERS = 4
+CREATE_STAGING_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "create_staging.sql")
+
+# True parents - merged by natural key, an existing public row wins
+PARENT_TABLES = {
+    'dataset': 'name',
+    'datasource': 'purl',
+    'package': 'purl',
+    'finding': 'identifier',
+    'finding_reporter': 'name'
+}
+
+# Children - foreign key columns rewritten through the map of the table they reference.
+# map_key builds a map for tables that are themselves referenced; fresh_ids marks append-only
+# history whose staging ids mean nothing in public, so rows take new ids and are never skipped
+CHILD_TABLES = {
+    'datasource_event': {'remap': {'datasource_id': 'datasource'}, 'map_key': ['txid']},
+    'datasource_event_package': {'remap': {'datasource_event_id': 'datasource_event', 'package_id': 'package'}},
+    'dataset_metrics': {'remap': {'dataset_id': 'dataset'}, 'map_key': ['dataset_id', 'commit_date_time', 'txid'],
+                        'fresh_ids': True},
+    'datasource_metrics': {'fresh_ids': True},
+    'edit': {'remap': {'dataset_metrics_id': 'dataset_metrics', 'datasource_id': 'datasource'}, 'fresh_ids': True},
+    'package_family': {'remap': {'dataset_metrics_id': 'dataset_metrics'}},
+    'finding_data': {'remap': {'finding_id': 'finding'}},
+    'datasource_dataset': {'remap': {'datasource_id': 'datasource', 'dataset_id': 'dataset'}},
+    'package_finding': {'remap': {'package_id': 'package', 'finding_id': 'finding'}},
+    'package_critical_finding': {'remap': {'package_id': 'package', 'finding_id': 'finding'}},
+    'package_high_finding': {'remap': {'package_id': 'package', 'finding_id': 'finding'}},
+    'package_medium_finding': {'remap': {'package_id': 'package', 'finding_id': 'finding'}},
+    'package_low_finding': {'remap': {'package_id': 'package', 'finding_id': 'finding'}},
+    'finding_to_reporter': {'remap': {'finding_id': 'finding', 'reporter_id': 'finding_reporter'}}
+}
+
+# Tables with an identity id whose sequence is reset once everything is merged
+SEQUENCE_TABLES = ['dataset', 'datasource', 'datasource_event', 'package', 'finding', 'finding_data',
+                   'finding_reporter', 'dataset_metrics', 'datasource_metrics', 'datasource_metrics_current', 'edit']
+
+
+@dataclass(frozen=True)
+class Phase:
+    """One committed step of the merge - run(cursor, args) returns the number of rows it wrote"""
+    name: str
+    run: callable
+    depends_on: tuple = ()
+    replica: bool = True  # run with session_replication_role = replica, as merge_staging_into_public.sql does
+
+
+def connect(args):
+    """New connection for one phase - phases never share a session"""
+    return psycopg2.connect(host=args.host, port=args.port, dbname=args.dbname, user=args.user,
+                            password=args.password, application_name=MERGE_APPLICATION_NAME)
+
+
+def table_columns(cur, table):
+    """Column names of a public table, id excluded - staging clones have the same columns"""
+    cur.execute("""
+        SELECT attname
+        FROM pg_attribute
+        WHERE attrelid = %s::regclass
+          AND attnum > 0
+          AND NOT attisdropped
+          AND attname <> 'id'
+        ORDER BY attnum
+    """, (f'public.{table}',))
+    return [row[0] for row in cur.fetchall()]
+
+
+def bump_sequence(cur, table):
+    """Move the id sequence past the largest public id so new rows never collide"""
+    cur.execute(f"""
+        SELECT setval(pg_get_serial_sequence('public.{table}', 'id'),
+                      COALESCE((SELECT MAX(id) FROM public.{table}), 0) + 1, false)
+    """)
+
+
+def build_map(cur, table, join_on, joins=''):
+    """(Re)create staging.map_<table>: staging id -> public id, indexed for the children that join it"""
+    cur.execute(f"DROP TABLE IF EXISTS staging.map_{table}")
+    # DISTINCT ON keeps one public row per staging row should the key match several - the newest
+    cur.execute(f"""
+        CREATE TABLE staging.map_{table} AS
+        SELECT DISTINCT ON (s.id) s.id AS staging_id, p.id AS public_id
+        FROM staging.{table} s {joins}
+        JOIN public.{table} p ON {join_on}
+        ORDER BY s.id, p.id DESC
+    """)
+    cur.execute(f"ALTER TABLE staging.map_{table} ADD PRIMARY KEY (staging_id)")
+    cur.execute(f"ANALYZE staging.map_{table}")
+
+
+def merge_parent(table, natural_key):
+    """Phase body inserting a parent table by natural key and mapping its ids"""
+    def run(cur, args):
+        columns = ', '.join(quote_ident(column, cur) for column in table_columns(cur, table))
+        bump_sequence(cur, table)
+        cur.execute(f"""
+            INSERT INTO public.{table} ({columns})
+            SELECT {columns} FROM staging.{table}
+            ON CONFLICT DO NOTHING
+        """)
+        rows = cur.rowcount
+        build_map(cur, table, f"p.{natural_key} = s.{natural_key}")
+        return rows
+    return run
+
+
+def merge_child(table, remap=None, map_key=None, fresh_ids=False):
+    """Phase body inserting a child table with its foreign keys rewritten through the parent maps on the way in"""
+    remap = remap or {}
+
+    def run(cur, args):
+        columns = table_columns(cur, table)
+        # Ids with no map entry are kept as they are, like the UPDATE ... FROM map rewrites did
+        values = {column: f"COALESCE(m_{column}.public_id, s.{quote_ident(column, cur)})" if column in remap
+                  else f"s.{quote_ident(column, cur)}" for column in columns}
+        joins = ' '.join(f"LEFT JOIN staging.map_{target} m_{column} ON m_{column}.staging_id = s.{column}"
+                         for column, target in remap.items())
+
+        if fresh_ids:
+            bump_sequence(cur, table)
+        cur.execute(f"""
+            INSERT INTO public.{table} ({', '.join(quote_ident(column, cur) for column in columns)})
+            SELECT {', '.join(values.values())}
+            FROM staging.{table} s {joins}
+            {'' if fresh_ids else 'ON CONFLICT DO NOTHING'}
+        """)
+        rows = cur.rowcount
+
+        if map_key:
+            map_joins = ' '.join(f"LEFT JOIN staging.map_{remap[column]} m_{column} ON m_{column}.staging_id = s.{column}"
+                                 for column in map_key if column in remap)
+            join_on = ' AND '.join(f"p.{column} = {values[column]}" for column in map_key)
+            build_map(cur, table, join_on, map_joins)
+        return rows
+    return run
+
+
+def merge_datasource_metrics_current(cur, args):
+    """Rebuild datasource_metrics_current as the newest datasource_metrics row per purl"""
+    columns = ', '.join(quote_ident(column, cur) for column in table_columns(cur, 'datasource_metrics_current'))
+    cur.execute("TRUNCATE public.datasource_metrics_current")
+    cur.execute(f"""
+        INSERT INTO public.datasource_metrics_current ({columns})
+        SELECT DISTINCT ON (purl) {columns}
+        FROM public.datasource_metrics
+        ORDER BY purl, commit_date_time DESC
+    """)
+    return cur.rowcount
+
+
+def reset_sequences(cur, args):
+    """Final sanity - every id sequence continues after the largest merged id"""
+    for table in SEQUENCE_TABLES:
+        cur.execute(f"""
+            SELECT setval(pg_get_serial_sequence('public.{table}', 'id'),
+                          COALESCE((SELECT MAX(id) FROM public.{table}), 1), true)
+        """)
+    return 0
+
+
+def remap_dataset_metrics_package_indexes(cur, args):
+    """Rewrite package_indexes of the dataset_metrics rows imported from staging - exactly those in its map"""
+    result = patchfox_remap.remap_package_indexes(
+        lambda: connect(args), 'dataset_metrics', where="t.id IN (SELECT public_id FROM staging.map_dataset_metrics)")
+    return result['rows_updated']
+
+
+def remap_datasource_package_indexes(cur, args):
+    """Rewrite datasource.package_indexes wherever staging package ids are still present"""
+    result = patchfox_remap.remap_package_indexes(lambda: connect(args), 'datasource')
+    return result['rows_updated']
+
+
+def verify_package_indexes(cur, args):
+    """The verify_package_indexes.sql checks with patchfox_verify over parallel id ranges - any offending row fails the phase"""
+    results = patchfox_verify.verify(lambda: connect(args), workers=args.workers, first=1)
+    failures = [f"{result.check.name}: {result.offending:,} (first: {result.rows[0][1]} - {result.rows[0][2]})"
+                for result in results.values() if result.offending]
+    if failures:
+        raise RuntimeError('; '.join(failures) + " - run patchfox_verify.py for details")
+    return sum(result.checked for result in results.values())
+
+
+def create_staging(cur, args):
+    """Empty staging clones of every public table (create_staging.sql)"""
+    with open(CREATE_STAGING_FILE) as f:
+        cur.execute(f.read())
+    return 0
+
+
+def load_staging(cur, args):
+    """Load the data-only dump into staging with patchfox_load - tables COPY in parallel, each truncated first"""
+    def on_table(section):
+        rate = section.rows / section.load_seconds if section.load_seconds else 0
+        console.print(f"  [dim]load {section.table:<30} {section.rows:>12,} rows {rate:>10,.0f}/s[/]")
+
+    sections = patchfox_load.load_dump(lambda: connect(args), args.dump, 'staging', workers=args.workers, on_table=on_table)
+    return sum(section.rows for section in sections)
+
+
+def build_phases(args):
+    """The merge as a dependency graph - phase name -> Phase"""
+    phases = {}
+    loaded = ()
+    if args.dump:
+        phases['staging'] = Phase('staging', create_staging, replica=False)
+        phases['load'] = Phase('load', load_staging, ('staging',), replica=False)
+        loaded = ('load',)
+
+    for table, natural_key in PARENT_TABLES.items():
+        phases[f'merge:{table}'] = Phase(f'merge:{table}', merge_parent(table, natural_key), loaded)
+    for table, spec in CHILD_TABLES.items():
+        depends_on = loaded + tuple(sorted({f'merge:{target}' for target in spec.get('remap', {}).values()}))
+        phases[f'merge:{table}'] = Phase(f'merge:{table}', merge_child(table, **spec), depends_on)
+    phases['merge:datasource_metrics_current'] = Phase(
+        'merge:datasource_metrics_current', merge_datasource_metrics_current, ('merge:datasource_metrics',))
+
+    merged = tuple(name for name in phases if name.startswith('merge:'))
+    phases['sequences'] = Phase('sequences', reset_sequences, merged)
+    phases['package_indexes:dataset_metrics'] = Phase(
+        'package_indexes:dataset_metrics', remap_dataset_metrics_package_indexes, ('merge:dataset_metrics', 'merge:package'),
+        replica=False)
+    phases['package_indexes:datasource'] = Phase(
+        'package_indexes:datasource', remap_datasource_package_indexes, ('merge:datasource', 'merge:package'),
+        replica=False)
+    phases['verify'] = Phase(
+        'verify', verify_package_indexes, ('sequences', 'package_indexes:dataset_metrics', 'package_indexes:datasource'),
+        replica=False)
+    return phases
+
+
+def load_progress(args):
+    """Phases completed by earlier runs - phase name -> {'seconds', 'rows'}"""
+    conn = connect(args)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("CREATE SCHEMA IF NOT EXISTS staging")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS staging.merge_progress (
+                    phase text PRIMARY KEY,
+                    finished_at timestamptz NOT NULL DEFAULT now(),
+                    seconds float8 NOT NULL,
+                    rows bigint NOT NULL
+                )
+            """)
+            cur.execute("SELECT phase, seconds, rows FROM staging.merge_progress")
+            return {phase: {'seconds': seconds, 'rows': rows} for phase, seconds, rows in cur.fetchall()}
+    finally:
+        conn.close()
+
+
+def run_phase(args, phase):
+    """Run one phase in its own transaction, committing it together with its progress row"""
+    conn = connect(args)
+    try:
+        start_time = time.time()
+        with conn, conn.cursor() as cur:
+            if phase.replica:
+                cur.execute("SET LOCAL session_replication_role = 'replica'")
+            rows = phase.run(cur, args) or 0
+            seconds = time.time() - start_time
+            cur.execute("INSERT INTO staging.merge_progress (phase, seconds, rows) VALUES (%s, %s, %s)",
+                        (phase.name, seconds, rows))
+        return {'seconds': seconds, 'rows': rows}
+    finally:
+        conn.close()
+
+
+def run_phases(args, phases, done):
+    """Run every phase whose dependencies are done, up to args.workers at once - returns the failed phase names"""
+    pending = {name: phase for name, phase in phases.items() if name not in done}
+    running = {}
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool, Progress(
+        SpinnerColumn(), TextColumn("{task.description}"), TimeElapsedColumn(), console=console, transient=True
+    ) as progress:
+        while pending or running:
+            # Nothing new starts after a failure - the phases already running are allowed to finish
+            if not failed:
+                for name, phase in list(pending.items()):
+                    if len(running) >= args.workers:
+                        break
+                    if all(dep in done for dep in phase.depends_on):
+                        task = progress.add_task(name, total=None)
+                        running[pool.submit(run_phase, args, phase)] = (phase, task)
+                        del pending[name]
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                phase, task = running.pop(future)
+                progress.remove_task(task)
+                try:
+                    done[phase.name] = future.result()
+                except Exception as e:
+                    failed.append(phase.name)
+                    progress.console.print(f"[red]✗ {phase.name:<36}[/] {' '.join(str(e).split())}")
+                    continue
+                result = done[phase.name]
+                progress.console.print(f"[green]✓[/] {phase.name:<36} {result['seconds']:8.1f}s "
+                                       f"{result['rows']:>12,} rows  [dim]({len(done)}/{len(phases)})[/]")
+    return failed
+
+
+def describe_dependencies(depends_on):
+    """Dependency list for the plan, long runs of one phase kind folded into e.g. merge:* (20)"""
+    kinds = {}
+    for name in depends_on:
+        kinds.setdefault(name.split(':')[0], []).append(name)
+    parts = []
+    for kind, names in kinds.items():
+        parts += [f"{kind}:* ({len(names)})"] if len(names) > 3 else names
+    return ', '.join(parts) or "[dim]-[/]"
+
+
+def print_plan(phases, done):
+    """Print the phases, what each waits for and whether it already ran"""
+    table = Table(title="Merge plan", box=box.SIMPLE, header_style="bold cyan")
+    table.add_column("Phase", style="cyan", no_wrap=True)
+    table.add_column("After")
+    table.add_column("State", no_wrap=True)
+    for name, phase in phases.items():
+        state = f"[green]done ({done[name]['seconds']:.1f}s)[/]" if name in done else "[dim]pending[/]"
+        table.add_row(name, describe_dependencies(phase.depends_on), state)
+    console.print(table)
+
+
+def format_seconds(seconds):
+    """Short phases to a tenth of a second, long ones as e.g. 2h 5m 3s"""
+    return f"{seconds:.1f}s" if seconds < 60 else common.format_duration(seconds)
+
+
+def print_report(phases, done, resumed, wall_seconds):
+    """Per-phase timings, with the wall-clock time against the time the phases add up to"""
+    table = Table(title="Merge phases", box=box.SIMPLE, header_style="bold cyan")
+    table.add_column("Phase", style="cyan", no_wrap=True)
+    table.add_column("Time", justify="right", no_wrap=True)
+    table.add_column("Rows", justify="right")
+    for name in phases:
+        if name not in done:
+            table.add_row(name, "[dim]-[/]", "[dim]-[/]")
+            continue
+        note = " [dim](earlier run)[/]" if name in resumed else ""
+        table.add_row(name, f"{format_seconds(done[name]['seconds'])}{note}", f"{done[name]['rows']:,}")
+    console.print(table)
+
+    phase_seconds = sum(done[name]['seconds'] for name in done if name not in resumed)
+    if wall_seconds > 0 and phase_seconds:
+        console.print(f"[bold]This run:[/] {format_seconds(wall_seconds)} wall clock for "
+                      f"{format_seconds(phase_seconds)} of phases ({phase_seconds / wall_seconds:.1f}x)")
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    arg_parser = argparse.ArgumentParser(description="Merge a second PatchFox dump through staging, resumably")
+    arg_parser.add_argument('--dump', help="data-only COPY dump to load into staging first (omit if staging is loaded)")
+    arg_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="phases run at once")
+    arg_parser.add_argument('--plan', action='store_true', help="print the phases and their state, then exit")
+    arg_parser.add_argument('--host', default=common.POSTGRES_HOST)
+    arg_parser.add_argument('--port', type=int, default=common.POSTGRES_PORT)
+    arg_parser.add_argument('--user', default=common.POSTGRES_USER)
+    arg_parser.add_argument('--password', default=common.POSTGRES_PASSWORD)
+    arg_parser.add_argument('--dbname', default=common.POSTGRES_DB)
+    return arg_parser.parse_args(argv)
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+    phases = build_phases(args)
+    done = load_progress(args)
+    resumed = set(done) & set(phases)
+
+    if args.plan:
+        print_plan(phases, done)
+        return
+    if resumed:
+        console.print(f"[bold]Resuming[/bold] - {len(resumed)}/{len(phases)} phases completed by an earlier run")
+
+    start_time = time.time()
+    failed = run_phases(args, phases, done)
+    print_report(phases, done, resumed, time.time() - start_time)
+
+    if failed:
+        console.print(f"[red]Failed: {', '.join(failed)}[/] - fix the cause and re-run to resume")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
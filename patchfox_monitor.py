@@ -2,12 +2,32 @@
 """
 PatchFox Pipeline Monitor
 A rich TUI dashboard for monitoring PatchFox job progress
+
+Run with --export to skip the TUI and serve the collected metrics in
+Prometheus text format instead, so many viewers can share one collection loop.
 """
 
+import argparse
+import asyncio
+import glob
+import json
+import os
+import math
+import select
+import sys
+import termios
 import time
+import tty
+import threading
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, fields
 import psycopg2
+import psycopg2.pool
 import docker
 import requests
+import requests.adapters
 from datetime import datetime, timedelta
 from dateutil import parser
 from rich.live import Live
@@ -20,29 +40,168 @@ from rich.text import Text
 from rich import box
 from rich.columns import Columns
 from rich.align import Align
+from rich.segment import Segment
 import psutil
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from patchfox_common import (POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD,
+                             format_duration, format_compact, format_bytes)
 
 console = Console()
 
 # Configuration
 DATA_SERVICE_URL = "http://localhost:1702"
 ORCHESTRATE_URL = "http://localhost:1707"
-POSTGRES_HOST = "localhost"
-POSTGRES_PORT = 54321
-POSTGRES_DB = "mrs_db"
-POSTGRES_USER = "mr_data"
-POSTGRES_PASSWORD = "omnomdata"
+POSTGRES_POOL_HEADROOM = 2  # pooled connections beyond one per DB source (POSTGRES_POOL_SIZE follows DB_SOURCES)
+POSTGRES_POOL_WAIT = 5.0  # seconds a query waits for a free pooled connection before failing
+POSTGRES_POOL_HEALTHCHECK_AFTER = 30.0  # seconds idle before a pooled connection is pinged
+MONITOR_APPLICATION_NAME = "patchfox-monitor"
+
+# Push mode - counters fed by monitor_notify_triggers.sql over LISTEN/NOTIFY
+NOTIFY_CHANNEL = "patchfox_monitor"
+NOTIFY_RECONCILE_INTERVAL = 300.0  # seconds between full recounts that correct any drift
+NOTIFY_DATASET_REFRESH_INTERVAL = 2.0  # seconds between re-reads of the dataset fields no trigger reports
+PUSH_SOURCE_INTERVALS = {'jobs': 0.5}  # job panels read memory in push mode, so they can refresh quickly
+
+# Snapshot recording (--record) and replay (--replay)
+RECORD_DIR = "monitor-recordings"
+RECORD_INTERVAL = 1.0  # seconds - minimum gap between recorded snapshots
+RECORD_SEGMENT_BYTES = 16 * 1024 * 1024  # rotate to a new segment file past this size
+RECORD_MAX_BYTES = 256 * 1024 * 1024  # oldest segments are deleted past this total
+REPLAY_SPEED = 10.0
+EXPORTER_HOST = "0.0.0.0"
+EXPORTER_PORT = 9464
+
+# Shared HTTP session and response cache for data-service / orchestrate calls
+HTTP_POOL_SIZE = 10
+HTTP_CACHE_MAX_ENTRIES = 64
+DQ_CACHE_TTLS = {  # seconds a DQ response is reused before revalidating - tables not listed are never cached
+    'dataset': 5.0,
+    'datasource': 30.0,
+    'datasetMetrics': 10.0
+}
+
+# Per-source collection deadlines (seconds) - a source that misses it keeps its last good value
+SOURCE_DEADLINES = {
+    'dataset_info': 8.0,
+    'jobs': 8.0,
+    'containers': 5.0,
+    'postgres': 3.0,
+    'host': 1.0,
+    'peristalsis': 3.0,
+    'procedures': 3.0,
+    'pg_activity': 3.0,
+    'table_health': 5.0
+}
+
+# Base polling interval (seconds) per source - cheap sources poll often, expensive ones rarely
+SOURCE_INTERVALS = {
+    'host': 1.0,
+    'postgres': 2.0,
+    'jobs': 2.0,
+    'peristalsis': 5.0,
+    'dataset_info': 5.0,
+    'containers': 2.0,
+    'procedures': 5.0,
+    'pg_activity': 5.0,
+    'table_health': 60.0
+}
+
+# Adaptive polling: back off sources that are slow or hit a busy database, speed up while jobs run
+SLOW_SOURCE_RATIO = 0.25  # back off when a call takes longer than this fraction of its interval
+MAX_BACKOFF = 8.0
+DB_SOURCES = {'dataset_info', 'jobs', 'postgres', 'procedures', 'pg_activity', 'table_health'}
+# Every DB source is due at once on the first pass, and one that overran its deadline still holds its connection
+POSTGRES_POOL_SIZE = len(DB_SOURCES) + POSTGRES_POOL_HEADROOM
+DB_BUSY_ACTIVE_QUERIES = 20  # active (non-monitor) queries above which DB sources poll at half rate
+PIPELINE_SOURCES = {'dataset_info', 'jobs'}
+PROCESSING_SPEEDUP = 0.5
+IDLE_SLOWDOWN = 3.0
+
+# Throughput / ETA - stage name and its key in job enrichment dicts
+THROUGHPUT_STAGES = [
+    ('oss_enriched', 'oss_done'),
+    ('package_index_enriched', 'pkg_done'),
+    ('analyzed', 'analyzed_done'),
+    ('forecasted', 'forecasted_done'),
+    ('recommended', 'recommended_done')
+]
+THROUGHPUT_HISTORY = 360  # samples kept per job / dataset for rate computation
+RATE_EWMA_TAU = 120.0  # seconds - smoothing time constant for per-stage rates
+
+# Metric history - a raw ring buffer plus rollups (period seconds, buckets kept) per metric
+HISTORY_RAW_SAMPLES = 3600  # an hour of 1s samples
+HISTORY_ROLLUPS = {'1m': (60, 1440), '15m': (900, 672)}  # a day of minutes, a week of quarter hours
+SPARKLINE_RESOLUTION = 'raw'  # which buffer sparklines draw from (--history-resolution)
+
+# procedure_timing analyzer - rows are read incrementally past a high-water id
+PROCEDURE_TIMING_BACKFILL = 50000  # rows read back from the newest on startup
+PROCEDURE_TIMING_BATCH = 20000  # most rows read per poll - a backlog is worked off over several polls
+PROCEDURE_CALL_TIMEOUT = 600.0  # seconds after its last step an unfinished call is treated as finished
+PROCEDURE_RECENT_CALLS = 200  # finished calls kept for the slowest-calls list
+PROCEDURE_STEP_EXPIRY = 3600.0  # seconds without a row after which a step, and its history, is dropped
+PROCEDURE_TIMING_GAP_MAX = 1000  # widest id gap re-read for late commits - wider ones are sequence jumps
+PROCEDURE_TIMING_GAP_EXPIRY = 3600.0  # seconds an id gap is re-read before it is taken as rolled back
+
+# pg_stat_activity wait sampling and pg_stat_statements diffing
+PG_TOP_STATEMENTS = 8  # statements listed by ms/sec
+PG_QUERY_TEXT_CACHE = 512  # statement texts kept by queryid, so each is read from pg_stat_statements once
+PG_STATEMENTS_RECHECK = 300.0  # seconds between checks for a newly installed pg_stat_statements
+
+# Table / index health from pg_stat_user_tables and pg_stat_user_indexes
+TABLE_HEALTH_HOT_TABLES = ['datasource_event', 'edit', 'package_finding', 'dataset_metrics']  # always listed - status-transition churn
+TABLE_HEALTH_PANEL_ROWS = 8
+SEQ_SCAN_MIN_ROWS = 10000  # smaller tables are cheaper to scan than to index, so their seq scans are not flagged
+SEQ_SCAN_DOMINANT_RATIO = 0.5  # fraction of a table's scans that are sequential above which it is flagged
+DEAD_TUPLE_WARN_RATIO = 0.2  # dead / (live + dead) shown as a warning
+UNUSED_INDEX_MIN_BYTES = 8 * 1024 * 1024  # never-scanned indexes smaller than this are not listed
+
+# Self-diagnostics - latency samples kept per collector / SQL / HTTP call for percentiles
+DIAGNOSTICS_SAMPLES = 512
+DIAGNOSTICS_RECENT_ERROR = 300.0  # seconds a failure keeps its call at the top of the panel
 
 # Status enums from db-entities
 DATASET_STATUSES = ['INITIALIZING', 'INGESTING', 'READY_FOR_PROCESSING', 'PROCESSING', 'PROCESSING_ERROR', 'IDLE']
 DATASOURCE_STATUSES = ['INITIALIZING', 'INGESTING', 'READY_FOR_PROCESSING', 'READY_FOR_NEXT_PROCESSING', 'PROCESSING', 'PROCESSING_ERROR', 'IDLE']
 DATASOURCE_EVENT_STATUSES = ['INGESTING', 'READY_FOR_PROCESSING', 'READY_FOR_NEXT_PROCESSING', 'PROCESSING', 'PROCESSED', 'PROCESSING_ERROR']
 
-# History tracking for sparklines
-cpu_history = []
-mem_history = []
-events_history = []
+# History tracking for sparklines (see metric_history)
+metric_histories = {}
+metric_histories_lock = threading.Lock()
+
+# True while a Live screen owns the terminal - errors then only go to the diagnostics panel
+live_display = False
+
+# Shared Postgres connection pool (see get_db_pool)
+db_pool = None
+db_pool_lock = threading.Lock()
+db_pool_slots = threading.BoundedSemaphore(POSTGRES_POOL_SIZE)  # getconn fails rather than waits when the pool is empty
+db_conn_last_used = {}
+
+# Shared HTTP session and response cache (see get_http_session / http_get_json)
+http_session = None
+http_session_lock = threading.Lock()
+http_cache = OrderedDict()
+http_cache_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class MonitorSnapshot:
+    """Immutable result of one collection pass - panels render only from this"""
+    dataset_info: dict
+    jobs: tuple = ()
+    container_stats: list = field(default_factory=list)
+    pg_stats: dict = field(default_factory=dict)
+    host_stats: dict = field(default_factory=dict)
+    peristalsis_state: bool = None
+    collected_at: datetime = field(default_factory=datetime.now)
+    source_ages: dict = field(default_factory=dict)
+    stale_sources: frozenset = frozenset()
+    throughput: dict = field(default_factory=dict)
+    diagnostics: dict = field(default_factory=dict)
+    procedure_timing: dict = field(default_factory=dict)
+    pg_activity: dict = field(default_factory=dict)
+    table_health: dict = field(default_factory=dict)
 
 
 def get_db_connection():
@@ -52,28 +211,165 @@ def get_db_connection():
         port=POSTGRES_PORT,
         database=POSTGRES_DB,
         user=POSTGRES_USER,
-        password=POSTGRES_PASSWORD
+        password=POSTGRES_PASSWORD,
+        application_name=MONITOR_APPLICATION_NAME,
+        connect_timeout=5
     )
 
 
-def dq_query(table_name, params=None):
+def get_db_pool():
+    """Get (lazily creating) the shared monitor connection pool"""
+    global db_pool
+    with db_pool_lock:
+        if db_pool is None or db_pool.closed:
+            db_pool = psycopg2.pool.ThreadedConnectionPool(
+                1, POSTGRES_POOL_SIZE,
+                host=POSTGRES_HOST,
+                port=POSTGRES_PORT,
+                database=POSTGRES_DB,
+                user=POSTGRES_USER,
+                password=POSTGRES_PASSWORD,
+                application_name=MONITOR_APPLICATION_NAME,
+                connect_timeout=5
+            )
+        return db_pool
+
+
+def close_db_pool():
+    """Close every pooled connection"""
+    global db_pool
+    with db_pool_lock:
+        if db_pool is not None and not db_pool.closed:
+            db_pool.closeall()
+        db_pool = None
+
+
+def checkout_db_connection(pool):
+    """Take a connection from the pool, replacing it if it failed its health check"""
+    conn = pool.getconn()
+    if conn.closed:
+        db_conn_last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    conn.autocommit = True
+
+    # Connections that sat idle may have been dropped server side - ping before reuse
+    idle_for = time.time() - db_conn_last_used.get(id(conn), 0)
+    if idle_for > POSTGRES_POOL_HEALTHCHECK_AFTER:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+        except psycopg2.Error:
+            db_conn_last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+            conn.autocommit = True
+
+    return conn
+
+
+def db_fetch(sql, params=None, one=False, *, name):
+    """Run a read-only query on a pooled connection, reconnecting once if the connection broke - timed under name"""
+    pool = get_db_pool()
+    # ThreadedConnectionPool raises at once when every connection is out - wait for one instead
+    if not db_pool_slots.acquire(timeout=POSTGRES_POOL_WAIT):
+        error = f"no pooled connection free within {POSTGRES_POOL_WAIT:g}s"
+        diagnostics.record_error('sql', name, error)
+        raise psycopg2.pool.PoolError(error)
+    try:
+        for attempt in range(2):
+            conn = checkout_db_connection(pool)
+            start_time = time.time()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    result = cur.fetchone() if one else cur.fetchall()
+                diagnostics.record('sql', name, time.time() - start_time)
+                return result
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                diagnostics.record('sql', name, time.time() - start_time, str(e))
+                # Only a dead connection is worth a retry - timeouts and bad SQL are not
+                if not conn.closed or attempt == 1:
+                    raise
+            except Exception as e:
+                diagnostics.record('sql', name, time.time() - start_time, str(e))
+                raise
+            finally:
+                if conn.closed:
+                    db_conn_last_used.pop(id(conn), None)
+                else:
+                    db_conn_last_used[id(conn)] = time.time()
+                pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        db_pool_slots.release()
+
+
+def get_http_session():
+    """Get (lazily creating) the shared keep-alive HTTP session for data-service and orchestrate"""
+    global http_session
+    with http_session_lock:
+        if http_session is None:
+            http_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE, pool_block=True)
+            http_session.mount('http://', adapter)
+            http_session.mount('https://', adapter)
+        return http_session
+
+
+def http_get_json(url, params=None, ttl=0, timeout=5):
+    """GET a JSON document over the shared session, serving it from cache for ttl seconds and revalidating by ETag"""
+    key = (url, tuple(sorted((params or {}).items())))
+    with http_cache_lock:
+        cached = http_cache.get(key)
+    if cached and time.time() - cached['fetched_at'] < ttl:
+        return cached['data']
+
+    headers = {}
+    if cached and cached['etag']:
+        headers['If-None-Match'] = cached['etag']
+    name = url.split('://', 1)[-1].split('/', 1)[-1]
+    start_time = time.time()
+    try:
+        response = get_http_session().get(url, params=params, headers=headers, timeout=timeout)
+
+        if response.status_code == 304 and cached:
+            # Unchanged - reuse the already parsed body
+            data = cached['data']
+        else:
+            response.raise_for_status()
+            data = response.json()
+    except Exception as e:
+        diagnostics.record('http', name, time.time() - start_time, str(e))
+        raise
+    diagnostics.record('http', name, time.time() - start_time)
+
+    if ttl > 0:
+        with http_cache_lock:
+            http_cache[key] = {'fetched_at': time.time(), 'etag': response.headers.get('ETag'), 'data': data}
+            http_cache.move_to_end(key)
+            while len(http_cache) > HTTP_CACHE_MAX_ENTRIES:
+                http_cache.popitem(last=False)
+    return data
+
+
+def dq_query(table_name, params=None, count_only=False):
     """Query data-service DQ API - returns (content, total_elements)"""
     try:
         url = f"{DATA_SERVICE_URL}/api/v1/db/{table_name}/query"
+        params = dict(params or {})
         # For datasourceEvent queries, exclude payload to avoid decompression overhead
         if table_name == 'datasourceEvent':
-            if params is None:
-                params = {}
             params['excludePayload'] = 'true'
-        response = requests.get(url, params=params, timeout=5)
-        response.raise_for_status()
-        data = response.json()
+        # When only totalElements is needed, a one-row page keeps the body small
+        if count_only:
+            params['size'] = '1'
+        data = http_get_json(url, params, ttl=DQ_CACHE_TTLS.get(table_name, 0))
         title_page = data.get('data', {}).get('titlePage', {})
         content = title_page.get('content', [])
         total_elements = title_page.get('totalElements', len(content))
         return content, total_elements
     except Exception as e:
-        console.print(f"[red]DQ API Error ({table_name}): {e}[/red]")
+        report_error(f"DQ API ({table_name})", e)
         return [], 0
 
 
@@ -82,188 +378,718 @@ def create_sparkline(data, width=20, height=5):
     if not data or len(data) < 2:
         return "─" * width
 
-    max_val = max(data) if max(data) > 0 else 1
+    data = data[-width:]
+    max_val = max(data)
     min_val = min(data)
     range_val = max_val - min_val if max_val > min_val else 1
 
     # Unicode block characters for sparklines
     bars = [" ", "▁", "▂", "▃", "▄", "▅", "▆", "▇", "█"]
+    scale = (len(bars) - 1) / range_val
+
+    return "".join(bars[int((val - min_val) * scale)] for val in data)
+
+
+class RingBuffer:
+    """Fixed-capacity float buffer backed by one array - appends overwrite the oldest value in O(1)"""
+
+    __slots__ = ('data', 'capacity', 'start', 'size')
+
+    def __init__(self, capacity):
+        self.data = array('d', bytes(8 * capacity))
+        self.capacity = capacity
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, value):
+        if self.size < self.capacity:
+            self.data[(self.start + self.size) % self.capacity] = value
+            self.size += 1
+        else:
+            self.data[self.start] = value
+            self.start = (self.start + 1) % self.capacity
+
+    def tail(self, count):
+        """The newest count values, oldest first"""
+        count = min(count, self.size)
+        begin = (self.start + self.size - count) % self.capacity
+        if begin + count <= self.capacity:
+            return self.data[begin:begin + count].tolist()
+        return (self.data[begin:] + self.data[:begin + count - self.capacity]).tolist()
+
+
+class MetricHistory:
+    """Raw samples plus time-bucketed mean rollups of one metric, with memoized sparklines"""
+
+    def __init__(self, raw_samples=HISTORY_RAW_SAMPLES, rollups=None):
+        rollups = rollups or HISTORY_ROLLUPS
+        self.buffers = {'raw': RingBuffer(raw_samples)}
+        self.periods = {}
+        self.pending = {}  # resolution -> [bucket, sum, count] of the bucket still filling
+        for resolution, (period, buckets) in rollups.items():
+            self.buffers[resolution] = RingBuffer(buckets)
+            self.periods[resolution] = period
+            self.pending[resolution] = [None, 0.0, 0]
+        self.version = 0
+        self.sparklines = {}
+        self.lock = threading.Lock()
+
+    def add(self, value, now=None):
+        """Record one sample, closing any rollup bucket it moves past"""
+        now = now or time.time()
+        with self.lock:
+            self.buffers['raw'].append(value)
+            for resolution, period in self.periods.items():
+                pending = self.pending[resolution]
+                bucket = int(now // period)
+                if pending[0] != bucket:
+                    if pending[2]:
+                        self.buffers[resolution].append(pending[1] / pending[2])
+                    pending[:] = [bucket, 0.0, 0]
+                pending[1] += value
+                pending[2] += 1
+            self.version += 1
+
+    def values(self, count, resolution='raw'):
+        """The newest count values of one resolution"""
+        with self.lock:
+            return self.buffers[resolution].tail(count)
+
+    def sparkline(self, width=20, resolution=None):
+        """Sparkline of the newest width values, rebuilt only after new samples arrive"""
+        resolution = resolution or SPARKLINE_RESOLUTION
+        with self.lock:
+            cached = self.sparklines.get((resolution, width))
+            if cached and cached[0] == self.version:
+                return cached[1]
+            sparkline = create_sparkline(self.buffers[resolution].tail(width), width)
+            self.sparklines[(resolution, width)] = (self.version, sparkline)
+            return sparkline
+
+
+def percentile(ordered, pct):
+    """The pct percentile of already sorted values - None when there are none"""
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] if ordered else None
+
+
+class LatencyStats:
+    """Call count, error count, last error and a ring of recent latencies for one instrumented call"""
+
+    __slots__ = ('samples', 'calls', 'errors', 'max', 'last_error', 'last_error_at')
+
+    def __init__(self, capacity=DIAGNOSTICS_SAMPLES):
+        self.samples = RingBuffer(capacity)
+        self.calls = 0
+        self.errors = 0
+        self.max = 0.0
+        self.last_error = None
+        self.last_error_at = None
+
+    def summary(self, now):
+        """Percentiles over the recent samples (ms), with lifetime counts"""
+        samples = [sample * 1000 for sample in sorted(self.samples.tail(self.samples.capacity))]
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'p50_ms': percentile(samples, 50),
+            'p95_ms': percentile(samples, 95),
+            'max_ms': self.max * 1000,
+            'last_error': self.last_error,
+            'last_error_age': now - self.last_error_at if self.last_error_at else None
+        }
+
+
+class Diagnostics:
+    """Latency and error tracking for the monitor's own collectors, SQL queries and HTTP calls"""
+
+    def __init__(self):
+        self.stats = {}  # (kind, name) -> LatencyStats
+        self.lock = threading.Lock()
+
+    def get(self, kind, name):
+        key = (kind, name)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = LatencyStats()
+        return stats
+
+    def record(self, kind, name, elapsed, error=None):
+        """Record one timed call - elapsed in seconds, error text if it failed"""
+        with self.lock:
+            stats = self.get(kind, name)
+            stats.calls += 1
+            stats.samples.append(elapsed)
+            stats.max = max(stats.max, elapsed)
+            if error is not None:
+                stats.errors += 1
+                stats.last_error = str(error)
+                stats.last_error_at = time.time()
+
+    def record_error(self, kind, name, error):
+        """Record a failure that has no latency, e.g. a fallback that swallowed an exception"""
+        with self.lock:
+            stats = self.get(kind, name)
+            stats.errors += 1
+            stats.last_error = str(error)
+            stats.last_error_at = time.time()
+
+    def call(self, kind, name, func):
+        """Run func timed, counting exceptions and error placeholders as failures"""
+        start_time = time.time()
+        try:
+            value = func()
+        except Exception as e:
+            self.record(kind, name, time.time() - start_time, str(e))
+            raise
+        error = None
+        if source_failed(value):
+            error = (value[0] if isinstance(value, list) else value or {}).get('error', 'no data')
+        self.record(kind, name, time.time() - start_time, error)
+        return value
 
-    # Normalize and create sparkline
-    sparkline = ""
-    for val in data[-width:]:
-        normalized = (val - min_val) / range_val
-        bar_index = int(normalized * (len(bars) - 1))
-        sparkline += bars[bar_index]
+    def summary(self):
+        """{'kind:name': stats} for every instrumented call"""
+        now = time.time()
+        with self.lock:
+            return {f"{kind}:{name}": stats.summary(now) for (kind, name), stats in sorted(self.stats.items())}
 
-    return sparkline
+
+diagnostics = Diagnostics()
+
+
+def report_error(name, error):
+    """Count a swallowed error in diagnostics, also printing it unless the Live screen would hide it"""
+    diagnostics.record_error('error', name, error)
+    if not live_display:
+        console.print(f"[red]{name} error: {error}[/red]")
+
+
+def metric_history(name):
+    """Get (creating on first use) the history of a named metric"""
+    with metric_histories_lock:
+        history = metric_histories.get(name)
+        if history is None:
+            history = metric_histories[name] = MetricHistory()
+        return history
+
+
+def prune_metric_histories(prefix, keep):
+    """Drop the histories of prefix<key> metrics whose key is not in keep - containers or steps that went away"""
+    with metric_histories_lock:
+        for name in [name for name in metric_histories if name.startswith(prefix) and name[len(prefix):] not in keep]:
+            del metric_histories[name]
+
+
+def derive_job_status(dataset_status, event_counts):
+    """Determine job status based on dataset status and event statuses"""
+    if dataset_status == 'IDLE':
+        return 'DONE'
+    # Job is PROCESSING if any events are processing/ready
+    if any(event_counts.get(s) for s in ['PROCESSING', 'READY_FOR_PROCESSING', 'READY_FOR_NEXT_PROCESSING']):
+        return 'PROCESSING'
+    if event_counts.get('PROCESSING_ERROR'):
+        return 'ERROR'
+    return 'DONE'
 
 
 def get_job_info():
-    """Get all active job_ids from datasource_events with their metadata"""
+    """Get every job with its event status histogram, enrichment and datasource counts"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Get all job_ids with their event counts and dataset updated_at for duration
-        cur.execute("""
-            SELECT 
-                de.job_id,
-                COUNT(*) as event_count,
-                d.updated_at as last_updated,
-                d.status as dataset_status
-            FROM datasource_event de
-            JOIN datasource ds ON ds.id = de.datasource_id
-            JOIN datasource_dataset dd ON dd.datasource_id = ds.id
-            JOIN dataset d ON d.id = dd.dataset_id
-            WHERE de.job_id IS NOT NULL
-            GROUP BY de.job_id, d.updated_at, d.status
-            ORDER BY 
-                CASE 
-                    WHEN MIN(de.status) IN ('PROCESSING', 'READY_FOR_PROCESSING', 'READY_FOR_NEXT_PROCESSING') THEN 0
-                    ELSE 1
-                END,
-                d.updated_at DESC
-        """)
-        
-        jobs = []
-        for row in cur.fetchall():
-            job_id, event_count, last_updated, dataset_status = row
-            
-            # Determine job status based on dataset status and event statuses
-            if dataset_status == 'IDLE':
-                job_status = 'DONE'
-            else:
-                # Check event statuses
-                cur.execute("""
-                    SELECT status, COUNT(*) 
-                    FROM datasource_event 
-                    WHERE job_id = %s 
-                    GROUP BY status
-                """, (job_id,))
-                
-                status_counts = dict(cur.fetchall())
-                
-                # Job is PROCESSING if any events are processing/ready
-                if any(s in status_counts for s in ['PROCESSING', 'READY_FOR_PROCESSING', 'READY_FOR_NEXT_PROCESSING']):
-                    job_status = 'PROCESSING'
-                elif 'PROCESSING_ERROR' in status_counts:
-                    job_status = 'ERROR'
-                else:
-                    job_status = 'DONE'
-            
-            jobs.append({
-                'id': job_id,
-                'status': job_status,
-                'updated_at': last_updated,
-                'event_count': event_count,
-                'dataset_status': dataset_status
-            })
-        
-        cur.close()
-        conn.close()
-        
-        return jobs
+        # In push mode the counters kept current by LISTEN/NOTIFY answer without touching the database
+        if event_counter.ready:
+            return event_counter.jobs()
+        return query_job_info()
     except Exception as e:
-        console.print(f"[red]Error fetching jobs: {e}[/red]")
-        return []
+        report_error("jobs", e)
+        return ()
+
+
+def query_job_info(fetch=None):
+    """Query every job with its event status histogram, enrichment and datasource counts in one pass"""
+    # One pass over datasource_event feeds everything - cost no longer grows with the number of jobs
+    rows = (fetch or db_fetch)("""
+        WITH per_datasource AS (
+            SELECT
+                job_id,
+                datasource_id,
+                status,
+                COUNT(*) AS events,
+                COUNT(*) FILTER (WHERE oss_enriched = true) AS oss_done,
+                COUNT(*) FILTER (WHERE package_index_enriched = true) AS pkg_done,
+                COUNT(*) FILTER (WHERE analyzed = true) AS analyzed_done,
+                COUNT(*) FILTER (WHERE forecasted = true) AS forecasted_done,
+                COUNT(*) FILTER (WHERE recommended = true) AS recommended_done
+            FROM datasource_event
+            WHERE job_id IS NOT NULL
+            GROUP BY job_id, datasource_id, status
+        ),
+        per_status AS (
+            SELECT
+                job_id,
+                status,
+                SUM(events) AS events,
+                SUM(oss_done) AS oss_done,
+                SUM(pkg_done) AS pkg_done,
+                SUM(analyzed_done) AS analyzed_done,
+                SUM(forecasted_done) AS forecasted_done,
+                SUM(recommended_done) AS recommended_done,
+                status IN ('PROCESSING', 'READY_FOR_PROCESSING', 'READY_FOR_NEXT_PROCESSING') AS is_active
+            FROM per_datasource
+            GROUP BY job_id, status
+        ),
+        job_events AS (
+            SELECT
+                job_id,
+                jsonb_object_agg(status, events) AS status_counts,
+                bool_or(is_active) AS has_active,
+                COALESCE(SUM(events) FILTER (WHERE is_active), 0)::bigint AS total,
+                COALESCE(SUM(oss_done) FILTER (WHERE is_active), 0)::bigint AS oss_done,
+                COALESCE(SUM(pkg_done) FILTER (WHERE is_active), 0)::bigint AS pkg_done,
+                COALESCE(SUM(analyzed_done) FILTER (WHERE is_active), 0)::bigint AS analyzed_done,
+                COALESCE(SUM(forecasted_done) FILTER (WHERE is_active), 0)::bigint AS forecasted_done,
+                COALESCE(SUM(recommended_done) FILTER (WHERE is_active), 0)::bigint AS recommended_done
+            FROM per_status
+            GROUP BY job_id
+        ),
+        job_datasets AS (
+            SELECT p.job_id, dd.dataset_id, SUM(p.events)::bigint AS event_count
+            FROM per_datasource p
+            JOIN datasource_dataset dd ON dd.datasource_id = p.datasource_id
+            GROUP BY p.job_id, dd.dataset_id
+        ),
+        dataset_datasources AS (
+            SELECT dataset_id, jsonb_object_agg(status, datasources) AS datasource_counts
+            FROM (
+                SELECT dd.dataset_id, ds.status, COUNT(*) AS datasources
+                FROM datasource ds
+                JOIN datasource_dataset dd ON dd.datasource_id = ds.id
+                GROUP BY dd.dataset_id, ds.status
+            ) s
+            GROUP BY dataset_id
+        )
+        SELECT
+            jd.job_id,
+            jd.dataset_id,
+            jd.event_count,
+            d.updated_at,
+            d.status,
+            je.status_counts,
+            dsd.datasource_counts,
+            je.total,
+            je.oss_done,
+            je.pkg_done,
+            je.analyzed_done,
+            je.forecasted_done,
+            je.recommended_done
+        FROM job_datasets jd
+        JOIN dataset d ON d.id = jd.dataset_id
+        JOIN job_events je ON je.job_id = jd.job_id
+        LEFT JOIN dataset_datasources dsd ON dsd.dataset_id = jd.dataset_id
+        ORDER BY je.has_active DESC, d.updated_at DESC
+    """, name="job_info")
+
+    jobs = []
+    for row in rows:
+        (job_id, dataset_id, event_count, last_updated, dataset_status, status_counts, datasource_counts,
+         total, oss_done, pkg_done, analyzed_done, forecasted_done, recommended_done) = row
+
+        event_counts = {status: 0 for status in DATASOURCE_EVENT_STATUSES}
+        event_counts.update(status_counts or {})
+        ds_counts = {status: 0 for status in DATASOURCE_STATUSES}
+        ds_counts.update(datasource_counts or {})
+
+        jobs.append({
+            'id': job_id,
+            'status': derive_job_status(dataset_status, event_counts),
+            'updated_at': last_updated,
+            'event_count': event_count,
+            'dataset_id': dataset_id,
+            'dataset_status': dataset_status,
+            'datasource_counts': ds_counts,
+            'event_counts': event_counts,
+            'enrichment': {
+                'total': total,
+                'oss_done': oss_done,
+                'pkg_done': pkg_done,
+                'analyzed_done': analyzed_done,
+                'forecasted_done': forecasted_done,
+                'recommended_done': recommended_done
+            }
+        })
+
+    return tuple(jobs)
+
+
+# Package type / finding instance aggregates of one dataset_metrics snapshot (see get_snapshot_aggregates)
+snapshot_aggregate_cache = {'key': None, 'package_types': {}, 'finding_instances': None}
+
+# Selects the dataset_metrics row to unnest: the given id, or the latest current row when no id is known
+METRICS_SNAPSHOT_CTE = """
+    WITH latest_metrics AS (
+        SELECT package_indexes
+        FROM dataset_metrics 
+        WHERE (%(metrics_id)s::bigint IS NULL AND is_current = true)
+           OR id = %(metrics_id)s::bigint
+        ORDER BY commit_date_time DESC 
+        LIMIT 1
+    )
+"""
 
 
-def get_job_datasource_counts(job_id):
-    """Get datasource status counts for a specific job's dataset"""
+def get_package_types(metrics_id=None):
+    """Get package counts by type for a dataset_metrics snapshot - None on error"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Get the dataset_id for this job
-        cur.execute("""
-            SELECT DISTINCT dd.dataset_id
-            FROM datasource_event de
-            JOIN datasource ds ON ds.id = de.datasource_id
-            JOIN datasource_dataset dd ON dd.datasource_id = ds.id
-            WHERE de.job_id = %s
-            LIMIT 1
-        """, (job_id,))
-        
-        result = cur.fetchone()
-        if not result:
-            cur.close()
-            conn.close()
-            return {status: 0 for status in DATASOURCE_STATUSES}
-        
-        dataset_id = result[0]
-        
-        # Get all datasources in this dataset with their statuses
-        cur.execute("""
-            SELECT ds.status, COUNT(*) 
-            FROM datasource ds
-            JOIN datasource_dataset dd ON dd.datasource_id = ds.id
-            WHERE dd.dataset_id = %s
-            GROUP BY ds.status
-        """, (dataset_id,))
-        
-        counts = {status: 0 for status in DATASOURCE_STATUSES}
-        for status, count in cur.fetchall():
-            counts[status] = count
-        
-        cur.close()
-        conn.close()
-        
-        return counts
+        package_type_rows = db_fetch(METRICS_SNAPSHOT_CTE + """
+            SELECT p.type, COUNT(*) as count
+            FROM latest_metrics,
+                 unnest(package_indexes) AS package_id
+            JOIN package p ON p.id = package_id
+            GROUP BY p.type
+            ORDER BY count DESC
+        """, {'metrics_id': metrics_id}, name="package_types")
+        return {row[0]: row[1] for row in package_type_rows}
     except Exception as e:
-        console.print(f"[red]Error fetching datasource counts: {e}[/red]")
-        return {status: 0 for status in DATASOURCE_STATUSES}
+        report_error("package types", e)
+        return None
 
 
-def get_job_datasource_event_counts(job_id):
-    """Get datasource_event status counts and enrichment flags for a specific job"""
+def get_finding_instances(metrics_id=None):
+    """Get finding instances (not just types) by severity for a dataset_metrics snapshot - None on error"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Status counts
-        cur.execute("""
-            SELECT status, COUNT(*) 
-            FROM datasource_event 
-            WHERE job_id = %s
-            GROUP BY status
-        """, (job_id,))
-        
-        status_counts = {status: 0 for status in DATASOURCE_EVENT_STATUSES}
-        for status, count in cur.fetchall():
-            status_counts[status] = count
-        
-        # Enrichment flag counts
-        cur.execute("""
+        instance_row = db_fetch(METRICS_SNAPSHOT_CTE + """
             SELECT 
-                COUNT(*) as total,
-                COUNT(*) FILTER (WHERE oss_enriched = true) as oss_done,
-                COUNT(*) FILTER (WHERE package_index_enriched = true) as pkg_done,
-                COUNT(*) FILTER (WHERE analyzed = true) as analyzed_done,
-                COUNT(*) FILTER (WHERE forecasted = true) as forecasted_done,
-                COUNT(*) FILTER (WHERE recommended = true) as recommended_done
-            FROM datasource_event 
-            WHERE job_id = %s
-              AND status IN ('PROCESSING', 'READY_FOR_PROCESSING', 'READY_FOR_NEXT_PROCESSING')
-        """, (job_id,))
-        
-        enrichment_row = cur.fetchone()
-        enrichment = {
-            'total': enrichment_row[0] if enrichment_row else 0,
-            'oss_done': enrichment_row[1] if enrichment_row else 0,
-            'pkg_done': enrichment_row[2] if enrichment_row else 0,
-            'analyzed_done': enrichment_row[3] if enrichment_row else 0,
-            'forecasted_done': enrichment_row[4] if enrichment_row else 0,
-            'recommended_done': enrichment_row[5] if enrichment_row else 0
+                COUNT(f.id) as total,
+                COUNT(f.id) FILTER (WHERE fd.severity = 'CRITICAL') as critical,
+                COUNT(f.id) FILTER (WHERE fd.severity = 'HIGH') as high,
+                COUNT(f.id) FILTER (WHERE fd.severity = 'MEDIUM') as medium,
+                COUNT(f.id) FILTER (WHERE fd.severity = 'LOW') as low
+            FROM latest_metrics,
+                 unnest(package_indexes) AS package_id
+            JOIN package p ON p.id = package_id
+            JOIN package_finding pf ON pf.package_id = p.id
+            JOIN finding f ON f.id = pf.finding_id
+            JOIN finding_data fd ON fd.finding_id = f.id
+        """, {'metrics_id': metrics_id}, one=True, name="finding_instances")
+
+        if not instance_row:
+            return {'total': 0, 'critical': 0, 'high': 0, 'medium': 0, 'low': 0}
+        return {
+            'total': instance_row[0] or 0,
+            'critical': instance_row[1] or 0,
+            'high': instance_row[2] or 0,
+            'medium': instance_row[3] or 0,
+            'low': instance_row[4] or 0
         }
-        
-        cur.close()
-        conn.close()
-        
-        return status_counts, enrichment
     except Exception as e:
-        console.print(f"[red]Error fetching datasource_event counts: {e}[/red]")
-        return {status: 0 for status in DATASOURCE_EVENT_STATUSES}, {'total': 0, 'oss_done': 0, 'pkg_done': 0, 'analyzed_done': 0, 'forecasted_done': 0, 'recommended_done': 0}
+        report_error("finding instances", e)
+        return None
+
+
+def get_snapshot_aggregates(metrics_id, commit_date_time):
+    """Get (package_types, finding_instances) for a dataset_metrics snapshot, recomputing only when it changes"""
+    key = (metrics_id, commit_date_time)
+    if snapshot_aggregate_cache['key'] == key:
+        return snapshot_aggregate_cache['package_types'], snapshot_aggregate_cache['finding_instances']
+
+    package_types = get_package_types(metrics_id)
+    finding_instances = get_finding_instances(metrics_id)
+
+    # Only a complete result is cached so a failed query is retried on the next refresh
+    if package_types is not None and finding_instances is not None:
+        snapshot_aggregate_cache.update(key=key, package_types=package_types, finding_instances=finding_instances)
+    return (package_types or {},
+            finding_instances or {'total': 0, 'critical': 0, 'high': 0, 'medium': 0, 'low': 0})
+
+
+# Keys of the datasourceEvent aggregates and the DQ filters that compute each one on the fallback path
+EVENT_AGGREGATE_QUERIES = [
+    ('processing', {'status': 'PROCESSING'}),
+    ('ready', {'status': 'READY_FOR_PROCESSING'}),
+    ('ready_next', {'status': 'READY_FOR_NEXT_PROCESSING'}),
+    ('processed', {'status': 'PROCESSED'}),
+    ('error', {'status': 'PROCESSING_ERROR'}),
+    ('oss_done', {'status': 'PROCESSING,READY_FOR_PROCESSING,READY_FOR_NEXT_PROCESSING', 'ossEnriched': 'true'}),
+    ('pkg_done', {'status': 'PROCESSING,READY_FOR_PROCESSING,READY_FOR_NEXT_PROCESSING', 'packageIndexEnriched': 'true'}),
+    ('analyzed_done', {'status': 'PROCESSING,READY_FOR_PROCESSING,READY_FOR_NEXT_PROCESSING', 'analyzed': 'true'}),
+    ('forecasted_done', {'status': 'PROCESSING,READY_FOR_PROCESSING,READY_FOR_NEXT_PROCESSING', 'forecasted': 'true'}),
+    ('recommended_done', {'status': 'PROCESSING,READY_FOR_PROCESSING,READY_FOR_NEXT_PROCESSING', 'recommended': 'true'}),
+]
+EVENT_STATUS_KEYS = {
+    'PROCESSING': 'processing',
+    'READY_FOR_PROCESSING': 'ready',
+    'READY_FOR_NEXT_PROCESSING': 'ready_next',
+    'PROCESSED': 'processed',
+    'PROCESSING_ERROR': 'error'
+}
+
+
+def get_event_aggregates():
+    """Get every datasourceEvent count the dataset view needs with one grouped query - None if unavailable"""
+    if event_counter.ready:
+        return event_counter.event_aggregates()
+
+    try:
+        rows = db_fetch("""
+            SELECT
+                status,
+                CASE WHEN status IN ('PROCESSING', 'READY_FOR_PROCESSING', 'READY_FOR_NEXT_PROCESSING')
+                     THEN job_id END AS active_job_id,
+                COUNT(*),
+                COUNT(*) FILTER (WHERE oss_enriched = true),
+                COUNT(*) FILTER (WHERE package_index_enriched = true),
+                COUNT(*) FILTER (WHERE analyzed = true),
+                COUNT(*) FILTER (WHERE forecasted = true),
+                COUNT(*) FILTER (WHERE recommended = true)
+            FROM datasource_event
+            GROUP BY 1, 2
+        """, name="event_aggregates")
+    except Exception as e:
+        report_error("datasource_event aggregates", e)
+        return None
+
+    counts = {key: 0 for key, _ in EVENT_AGGREGATE_QUERIES}
+    job_id_counts = {}
+    for status, active_job_id, count, oss_done, pkg_done, analyzed_done, forecasted_done, recommended_done in rows:
+        if status in EVENT_STATUS_KEYS:
+            counts[EVENT_STATUS_KEYS[status]] += count
+        if status in ('PROCESSING', 'READY_FOR_PROCESSING', 'READY_FOR_NEXT_PROCESSING'):
+            counts['oss_done'] += oss_done
+            counts['pkg_done'] += pkg_done
+            counts['analyzed_done'] += analyzed_done
+            counts['forecasted_done'] += forecasted_done
+            counts['recommended_done'] += recommended_done
+            if active_job_id is not None:
+                job_id_counts[active_job_id] = job_id_counts.get(active_job_id, 0) + count
+
+    return {
+        'counts': counts,
+        'job_id_counts': dict(sorted(job_id_counts.items(), key=lambda x: x[1], reverse=True)),
+        'from_dq': False
+    }
+
+
+def get_event_aggregates_from_dq():
+    """Fallback for get_event_aggregates - one DQ datasourceEvent query per count, in parallel"""
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(EVENT_AGGREGATE_QUERIES)) as executor:
+        future_to_key = {executor.submit(dq_query, 'datasourceEvent', params, True): key for key, params in EVENT_AGGREGATE_QUERIES}
+        for future in as_completed(future_to_key):
+            key = future_to_key[future]
+            try:
+                _, count = future.result()
+                results[key] = count
+            except Exception as e:
+                report_error(f"query {key}", e)
+                results[key] = 0
+
+    # DQ can't group by job, so active job ids are unknown on this path
+    return {'counts': results, 'job_id_counts': {}, 'from_dq': True}
+
+
+class EventCounter:
+    """In-memory datasource_event counters kept current by NOTIFY deltas, recounted only on (re)connect and periodically"""
+
+    ACTIVE_STATUSES = ('PROCESSING', 'READY_FOR_PROCESSING', 'READY_FOR_NEXT_PROCESSING')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}  # (job_id, status) -> [events, oss, pkg, analyzed, forecasted, recommended]
+        self.job_meta = ()
+        self.dataset_status = {}
+        self.ready = False
+        self.needs_reconcile = True
+        self.last_reconcile = 0.0
+        self.last_dataset_refresh = 0.0
+        self.snapshot = None  # (xmin, xmax, in-progress txids) of the last recount
+        self.error = None
+        self.thread = None
+
+    def start(self):
+        """Start listening on a daemon thread"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.listen, name="notify-listener", daemon=True)
+            self.thread.start()
+
+    def listen(self):
+        """LISTEN on a dedicated connection, applying notifications and reconnecting on failure"""
+        while True:
+            conn = None
+            try:
+                conn = get_db_connection()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Recount after LISTEN so no change is missed - a change the recount already saw is
+                # skipped when its notification arrives, by the txid it carries
+                self.reconcile(conn)
+
+                while True:
+                    if select.select([conn], [], [], 1.0) != ([], [], []):
+                        conn.poll()
+                        while conn.notifies:
+                            self.apply(conn.notifies.pop(0).payload)
+                    if self.needs_reconcile or time.time() - self.last_reconcile > NOTIFY_RECONCILE_INTERVAL:
+                        self.reconcile(conn)
+                    elif time.time() - self.last_dataset_refresh > NOTIFY_DATASET_REFRESH_INTERVAL:
+                        self.refresh_datasets(conn)
+            except Exception as e:
+                # Fall back to polling queries until the listener is back
+                self.ready = False
+                self.needs_reconcile = True
+                self.error = str(e)
+                time.sleep(5)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+    def reconcile(self, conn):
+        """Full recount of datasource_event and job metadata in one snapshot on the listener connection"""
+        def fetch(sql, params=None, one=False, name=None):
+            cur.execute(sql, params)
+            return cur.fetchone() if one else cur.fetchall()
+
+        with conn.cursor() as cur:
+            cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            try:
+                xmin, xmax, in_progress = fetch("SELECT txid_current_snapshot()::text", one=True)[0].split(':')
+                rows = fetch("""
+                    SELECT
+                        job_id,
+                        status,
+                        COUNT(*),
+                        COUNT(*) FILTER (WHERE oss_enriched = true),
+                        COUNT(*) FILTER (WHERE package_index_enriched = true),
+                        COUNT(*) FILTER (WHERE analyzed = true),
+                        COUNT(*) FILTER (WHERE forecasted = true),
+                        COUNT(*) FILTER (WHERE recommended = true)
+                    FROM datasource_event
+                    GROUP BY job_id, status
+                """)
+                job_meta = query_job_info(fetch)
+            finally:
+                cur.execute("COMMIT")
+
+        with self.lock:
+            self.counts = {(row[0], row[1]): list(row[2:]) for row in rows}
+            self.snapshot = (int(xmin), int(xmax), {int(txid) for txid in in_progress.split(',') if txid})
+            self.job_meta = job_meta
+            self.dataset_status = {job['dataset_id']: job['dataset_status'] for job in job_meta}
+            self.needs_reconcile = False
+            self.last_reconcile = self.last_dataset_refresh = time.time()
+            self.ready = True
+            self.error = None
+
+    def refresh_datasets(self, conn):
+        """Re-read updated_at, status and datasource counts of every dataset - none of them moves with an event delta"""
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT d.id, d.updated_at, d.status, s.datasource_counts
+                FROM dataset d
+                LEFT JOIN (
+                    SELECT dataset_id, jsonb_object_agg(status, datasources) AS datasource_counts
+                    FROM (
+                        SELECT dd.dataset_id, ds.status, COUNT(*) AS datasources
+                        FROM datasource ds
+                        JOIN datasource_dataset dd ON dd.datasource_id = ds.id
+                        GROUP BY dd.dataset_id, ds.status
+                    ) per_status
+                    GROUP BY dataset_id
+                ) s ON s.dataset_id = d.id
+            """)
+            rows = cur.fetchall()
+
+        datasets = {}
+        for dataset_id, updated_at, status, datasource_counts in rows:
+            ds_counts = {ds_status: 0 for ds_status in DATASOURCE_STATUSES}
+            ds_counts.update(datasource_counts or {})
+            datasets[dataset_id] = {'updated_at': updated_at, 'dataset_status': status, 'datasource_counts': ds_counts}
+        with self.lock:
+            self.job_meta = tuple({**meta, **datasets.get(meta['dataset_id'], {})} for meta in self.job_meta)
+            self.dataset_status.update({dataset_id: dataset['dataset_status'] for dataset_id, dataset in datasets.items()})
+            self.last_dataset_refresh = time.time()
+
+    def counted(self, txid):
+        """Whether the last recount's snapshot already saw the transaction txid"""
+        if txid is None or self.snapshot is None:
+            return False
+        xmin, xmax, in_progress = self.snapshot
+        return txid < xmin or (txid < xmax and txid not in in_progress)
+
+    def apply(self, payload):
+        """Apply one notification from monitor_notify_triggers.sql"""
+        message = json.loads(payload)
+        with self.lock:
+            if self.counted(message.get('x')):
+                return
+            if message['t'] == 'dse':
+                known_jobs = {job['id'] for job in self.job_meta}
+                for delta in message['d']:
+                    counts = self.counts.setdefault((delta['j'], delta['s']), [0, 0, 0, 0, 0, 0])
+                    for idx, key in enumerate(['n', 'o', 'p', 'a', 'f', 'r']):
+                        counts[idx] += delta[key]
+                    # A job we have no dataset metadata for needs a recount to appear
+                    if delta['j'] is not None and delta['j'] not in known_jobs:
+                        self.needs_reconcile = True
+            elif message['t'] == 'dataset':
+                self.dataset_status[message['id']] = message['s']
+            else:
+                self.needs_reconcile = True
+
+    def jobs(self):
+        """Job rows in the shape of query_job_info with live counts"""
+        with self.lock:
+            jobs = []
+            for meta in self.job_meta:
+                event_counts = {status: 0 for status in DATASOURCE_EVENT_STATUSES}
+                enrichment = [0, 0, 0, 0, 0, 0]
+                for (job_id, status), counts in self.counts.items():
+                    if job_id != meta['id']:
+                        continue
+                    event_counts[status] = counts[0]
+                    if status in self.ACTIVE_STATUSES:
+                        enrichment = [a + b for a, b in zip(enrichment, counts)]
+
+                dataset_status = self.dataset_status.get(meta['dataset_id'], meta['dataset_status'])
+                jobs.append({
+                    **meta,
+                    'status': derive_job_status(dataset_status, event_counts),
+                    'event_count': sum(event_counts.values()),
+                    'dataset_status': dataset_status,
+                    'event_counts': event_counts,
+                    'enrichment': dict(zip(['total', 'oss_done', 'pkg_done', 'analyzed_done', 'forecasted_done', 'recommended_done'], enrichment))
+                })
+
+        # Jobs with active events first, as query_job_info orders them
+        return tuple(sorted(jobs, key=lambda job: not any(job['event_counts'][s] for s in self.ACTIVE_STATUSES)))
+
+    def event_aggregates(self):
+        """Dataset-wide counts in the shape of get_event_aggregates"""
+        counts = {key: 0 for key, _ in EVENT_AGGREGATE_QUERIES}
+        job_id_counts = {}
+        with self.lock:
+            for (job_id, status), (events, oss_done, pkg_done, analyzed_done, forecasted_done, recommended_done) in self.counts.items():
+                if status in EVENT_STATUS_KEYS:
+                    counts[EVENT_STATUS_KEYS[status]] += events
+                if status in self.ACTIVE_STATUSES:
+                    counts['oss_done'] += oss_done
+                    counts['pkg_done'] += pkg_done
+                    counts['analyzed_done'] += analyzed_done
+                    counts['forecasted_done'] += forecasted_done
+                    counts['recommended_done'] += recommended_done
+                    if job_id is not None and events:
+                        job_id_counts[job_id] = job_id_counts.get(job_id, 0) + events
+
+        return {
+            'counts': counts,
+            'job_id_counts': dict(sorted(job_id_counts.items(), key=lambda x: x[1], reverse=True)),
+            'from_dq': False
+        }
+
+
+event_counter = EventCounter()
 
 
 def get_dataset_info():
@@ -280,56 +1106,15 @@ def get_dataset_info():
         dataset_status = dataset['status']
         dataset_updated_at = dataset.get('updatedAt')
 
-        # Query database directly for all active job IDs and their counts
-        try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT job_id, COUNT(*) as count
-                FROM datasource_event
-                WHERE status IN ('PROCESSING', 'READY_FOR_PROCESSING', 'READY_FOR_NEXT_PROCESSING')
-                  AND job_id IS NOT NULL
-                GROUP BY job_id
-                ORDER BY count DESC
-            """)
-            job_id_rows = cur.fetchall()
-            cur.close()
-            conn.close()
-
-            job_id_counts = {row[0]: row[1] for row in job_id_rows}
-            active_job_ids = [row[0] for row in job_id_rows]
-        except Exception as e:
-            console.print(f"[red]Error fetching job IDs: {e}[/red]")
-            job_id_counts = {}
-            active_job_ids = []
-
-        if active_job_ids:
-            # Parallelize all datasourceEvent queries
-            queries = [
-                ('processing', {'status': 'PROCESSING'}),
-                ('ready', {'status': 'READY_FOR_PROCESSING'}),
-                ('ready_next', {'status': 'READY_FOR_NEXT_PROCESSING'}),
-                ('processed', {'status': 'PROCESSED'}),
-                ('error', {'status': 'PROCESSING_ERROR'}),
-                ('oss_done', {'status': 'PROCESSING,READY_FOR_PROCESSING,READY_FOR_NEXT_PROCESSING', 'ossEnriched': 'true'}),
-                ('pkg_done', {'status': 'PROCESSING,READY_FOR_PROCESSING,READY_FOR_NEXT_PROCESSING', 'packageIndexEnriched': 'true'}),
-                ('analyzed_done', {'status': 'PROCESSING,READY_FOR_PROCESSING,READY_FOR_NEXT_PROCESSING', 'analyzed': 'true'}),
-                ('forecasted_done', {'status': 'PROCESSING,READY_FOR_PROCESSING,READY_FOR_NEXT_PROCESSING', 'forecasted': 'true'}),
-                ('recommended_done', {'status': 'PROCESSING,READY_FOR_PROCESSING,READY_FOR_NEXT_PROCESSING', 'recommended': 'true'}),
-            ]
-
-            results = {}
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                future_to_key = {executor.submit(dq_query, 'datasourceEvent', params): key for key, params in queries}
-                for future in as_completed(future_to_key):
-                    key = future_to_key[future]
-                    try:
-                        _, count = future.result()
-                        results[key] = count
-                    except Exception as e:
-                        console.print(f"[red]Error in query {key}: {e}[/red]")
-                        results[key] = 0
+        # One grouped query gives job counts, status counts and enrichment flags - DQ fan-out is the fallback
+        event_aggregates = get_event_aggregates()
+        if event_aggregates is None:
+            event_aggregates = get_event_aggregates_from_dq()
+        results = event_aggregates['counts']
+        job_id_counts = event_aggregates['job_id_counts']
+        active_job_ids = list(job_id_counts)
 
+        if active_job_ids or event_aggregates['from_dq']:
             processing_count = results.get('processing', 0)
             ready_count = results.get('ready', 0)
             ready_next_count = results.get('ready_next', 0)
@@ -369,7 +1154,7 @@ def get_dataset_info():
             error_count = 0
 
         # Get datasource count
-        datasources, total_datasources = dq_query('datasource')
+        datasources, total_datasources = dq_query('datasource', count_only=True)
         datasource_count = total_datasources
 
         # Get findings and package metrics from latest dataset_metrics snapshot
@@ -433,74 +1218,8 @@ def get_dataset_info():
                 'low': low_backlog_30_60 + low_backlog_60_90 + low_backlog_90_plus
             }
             
-            # Get package types from package_indexes
-            try:
-                conn = get_db_connection()
-                cur = conn.cursor()
-                cur.execute("""
-                    WITH latest_metrics AS (
-                        SELECT package_indexes
-                        FROM dataset_metrics 
-                        WHERE is_current = true
-                        ORDER BY commit_date_time DESC 
-                        LIMIT 1
-                    )
-                    SELECT p.type, COUNT(*) as count
-                    FROM latest_metrics,
-                         unnest(package_indexes) AS package_id
-                    JOIN package p ON p.id = package_id
-                    GROUP BY p.type
-                    ORDER BY count DESC
-                """)
-                package_types = {row[0]: row[1] for row in cur.fetchall()}
-                cur.close()
-                conn.close()
-            except Exception as e:
-                console.print(f"[red]Error fetching package types: {e}[/red]")
-                package_types = {}
-            
-            # Get finding instances (not just types) by unnesting package_indexes
-            try:
-                conn = get_db_connection()
-                cur = conn.cursor()
-                cur.execute("""
-                    WITH latest_metrics AS (
-                        SELECT package_indexes
-                        FROM dataset_metrics 
-                        WHERE is_current = true
-                        ORDER BY commit_date_time DESC 
-                        LIMIT 1
-                    )
-                    SELECT 
-                        COUNT(f.id) as total,
-                        COUNT(f.id) FILTER (WHERE fd.severity = 'CRITICAL') as critical,
-                        COUNT(f.id) FILTER (WHERE fd.severity = 'HIGH') as high,
-                        COUNT(f.id) FILTER (WHERE fd.severity = 'MEDIUM') as medium,
-                        COUNT(f.id) FILTER (WHERE fd.severity = 'LOW') as low
-                    FROM latest_metrics,
-                         unnest(package_indexes) AS package_id
-                    JOIN package p ON p.id = package_id
-                    JOIN package_finding pf ON pf.package_id = p.id
-                    JOIN finding f ON f.id = pf.finding_id
-                    JOIN finding_data fd ON fd.finding_id = f.id
-                """)
-                instance_row = cur.fetchone()
-                cur.close()
-                conn.close()
-                
-                if instance_row:
-                    finding_instances = {
-                        'total': instance_row[0] or 0,
-                        'critical': instance_row[1] or 0,
-                        'high': instance_row[2] or 0,
-                        'medium': instance_row[3] or 0,
-                        'low': instance_row[4] or 0
-                    }
-                else:
-                    finding_instances = {'total': 0, 'critical': 0, 'high': 0, 'medium': 0, 'low': 0}
-            except Exception as e:
-                console.print(f"[red]Error fetching finding instances: {e}[/red]")
-                finding_instances = {'total': 0, 'critical': 0, 'high': 0, 'medium': 0, 'low': 0}
+            # Package types and finding instances only change when a new dataset_metrics row lands
+            package_types, finding_instances = get_snapshot_aggregates(metrics_row.get('id'), commit_date_time)
         else:
             # Fallback if no dataset_metrics exist
             critical_finding_count = 0
@@ -555,112 +1274,177 @@ def get_peristalsis_state():
     """Get peristalsis (orchestrate) activation state"""
     try:
         url = f"{ORCHESTRATE_URL}/api/v1/peristalsis"
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        data = response.json()
+        data = http_get_json(url)
         return data.get('data', {}).get('activated', False)
     except Exception as e:
-        console.print(f"[red]Peristalsis API Error: {e}[/red]")
+        report_error("Peristalsis API", e)
         return None
 
 
 def get_postgres_stats():
     """Get postgres connection and query stats"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Get connections grouped by application and state
-        cur.execute("""
+        # Get connections grouped by application and state - the monitor's own pool is excluded
+        conn_by_app = db_fetch("""
             SELECT
                 COALESCE(application_name, 'unknown') as app_name,
                 state,
                 count(*)
             FROM pg_stat_activity
             WHERE datname = 'mrs_db'
+              AND COALESCE(application_name, '') <> %s
             GROUP BY application_name, state
             ORDER BY application_name, state;
-        """)
-        conn_by_app = cur.fetchall()
+        """, (MONITOR_APPLICATION_NAME,), name="pg_connections")
 
-        cur.execute("""
+        active_queries = db_fetch("""
             SELECT COUNT(*)
             FROM pg_stat_activity
-            WHERE datname = 'mrs_db' AND state = 'active' AND pid <> pg_backend_pid();
-        """)
-        active_queries = cur.fetchone()[0]
+            WHERE datname = 'mrs_db' AND state = 'active' AND pid <> pg_backend_pid()
+              AND COALESCE(application_name, '') <> %s;
+        """, (MONITOR_APPLICATION_NAME,), one=True, name="pg_active_queries")[0]
 
-        cur.close()
-        conn.close()
+        active_history = metric_history('pg_active_queries')
+        active_history.add(active_queries)
 
         return {
             'conn_by_app': conn_by_app,
-            'active_queries': active_queries
+            'active_queries': active_queries,
+            'active_sparkline': active_history.sparkline()
         }
     except Exception as e:
         return {'error': str(e)}
 
 
-def get_container_stats():
-    """Get docker container stats"""
-    try:
-        client = docker.from_env()
-        containers = client.containers.list()
-
-        def get_single_container_stats(container):
-            """Get stats for a single container"""
+def container_service_name(container):
+    """Short service name for a compose container"""
+    return container.name.replace('docker-compose-', '').replace('-service-1', '').replace('-1', '')
+
+
+def calculate_container_usage(sample, prev_sample=None):
+    """CPU % and memory from a stats sample, using the previous sample for the CPU delta"""
+    cpu_stats = sample['cpu_stats']
+    pre_stats = prev_sample['cpu_stats'] if prev_sample else sample.get('precpu_stats', {})
+
+    # Calculate CPU percentage
+    cpu_delta = cpu_stats['cpu_usage']['total_usage'] - pre_stats.get('cpu_usage', {}).get('total_usage', 0)
+    system_delta = cpu_stats.get('system_cpu_usage', 0) - pre_stats.get('system_cpu_usage', 0)
+    cpu_percent = 0.0
+    if system_delta > 0 and cpu_delta > 0 and pre_stats.get('system_cpu_usage'):
+        num_cpus = cpu_stats.get('online_cpus')
+        if not num_cpus:
+            num_cpus = len(cpu_stats['cpu_usage'].get('percpu_usage', []))
+        if num_cpus == 0:
+            num_cpus = 1
+        cpu_percent = (cpu_delta / system_delta) * num_cpus * 100
+
+    # Calculate memory usage (exclude page cache like docker stats does)
+    mem_usage = sample['memory_stats'].get('usage', 0)
+    mem_stats = sample['memory_stats'].get('stats', {})
+    # Subtract inactive file cache to match docker stats display
+    inactive_file = mem_stats.get('inactive_file', 0)
+    mem_usage_actual = mem_usage - inactive_file
+    mem_limit = sample['memory_stats'].get('limit', 1)
+    mem_percent = (mem_usage_actual / mem_limit) * 100 if mem_limit > 0 else 0
+
+    return cpu_percent, mem_usage_actual / (1024 * 1024), mem_percent
+
+
+class ContainerStatsCollector:
+    """Keeps one streaming stats subscription per running container so a refresh only reads cached samples"""
+
+    def __init__(self):
+        self.client = None
+        self.lock = threading.Lock()
+        self.samples = {}  # container id -> (previous sample, latest sample)
+        self.stop_events = {}
+        self.errors = {}
+
+    def subscribe(self, container):
+        """Stream stats for one container on a daemon thread until it stops or is unsubscribed (call with lock held)"""
+        stop_event = threading.Event()
+        self.stop_events[container.id] = stop_event
+
+        def stream():
             try:
-                # Call stats twice - first call often returns stale data
-                container.stats(stream=False)
-                container_stats = container.stats(stream=False)
-
-                # Calculate CPU percentage
-                cpu_delta = container_stats['cpu_stats']['cpu_usage']['total_usage'] - \
-                           container_stats['precpu_stats']['cpu_usage']['total_usage']
-                system_delta = container_stats['cpu_stats']['system_cpu_usage'] - \
-                              container_stats['precpu_stats']['system_cpu_usage']
-                cpu_percent = 0.0
-                if system_delta > 0 and cpu_delta > 0:
-                    num_cpus = container_stats['cpu_stats'].get('online_cpus')
-                    if not num_cpus:
-                        num_cpus = len(container_stats['cpu_stats']['cpu_usage'].get('percpu_usage', []))
-                    if num_cpus == 0:
-                        num_cpus = 1
-                    cpu_percent = (cpu_delta / system_delta) * num_cpus * 100
-
-                # Calculate memory usage (exclude page cache like docker stats does)
-                mem_usage = container_stats['memory_stats'].get('usage', 0)
-                mem_stats = container_stats['memory_stats'].get('stats', {})
-                # Subtract inactive file cache to match docker stats display
-                inactive_file = mem_stats.get('inactive_file', 0)
-                mem_usage_actual = mem_usage - inactive_file
-                mem_limit = container_stats['memory_stats'].get('limit', 1)
-                mem_percent = (mem_usage_actual / mem_limit) * 100 if mem_limit > 0 else 0
-
-                service_name = container.name.replace('docker-compose-', '').replace('-service-1', '').replace('-1', '')
-
-                return {
-                    'name': service_name,
+                for sample in container.stats(stream=True, decode=True):
+                    # Checked under the lock unsubscribe holds, so a stopped container never gets a sample back
+                    with self.lock:
+                        if stop_event.is_set():
+                            break
+                        _, latest = self.samples.get(container.id, (None, None))
+                        self.samples[container.id] = (latest, sample)
+                        self.errors.pop(container.id, None)
+            except Exception as e:
+                with self.lock:
+                    if not stop_event.is_set():
+                        self.errors[container.id] = str(e)
+            finally:
+                # Let the next refresh resubscribe if the stream ended while the container still runs
+                with self.lock:
+                    if self.stop_events.get(container.id) is stop_event:
+                        del self.stop_events[container.id]
+
+        threading.Thread(target=stream, name=f"stats-{container.name}", daemon=True).start()
+
+    def unsubscribe(self, container_id):
+        """Stop streaming a container that went away (call with lock held)"""
+        stop_event = self.stop_events.pop(container_id, None)
+        if stop_event:
+            stop_event.set()
+        self.samples.pop(container_id, None)
+        self.errors.pop(container_id, None)
+
+    def collect(self):
+        """Current stats for every running container from the latest streamed samples"""
+        if self.client is None:
+            self.client = docker.from_env()
+        containers = self.client.containers.list()
+
+        with self.lock:
+            running_ids = {c.id for c in containers}
+            for container_id in list(self.stop_events):
+                if container_id not in running_ids:
+                    self.unsubscribe(container_id)
+            for container in containers:
+                if container.id not in self.stop_events:
+                    self.subscribe(container)
+
+        stats = []
+        with self.lock:
+            for container in containers:
+                prev_sample, sample = self.samples.get(container.id, (None, None))
+                if container.id in self.errors:
+                    stats.append({'name': container.name, 'error': self.errors[container.id]})
+                    continue
+                cpu_percent, mem_usage_mb, mem_percent = calculate_container_usage(sample, prev_sample) if sample else (0.0, 0.0, 0.0)
+                stats.append({
+                    'name': container_service_name(container),
                     'status': container.status,
                     'cpu_percent': cpu_percent,
-                    'mem_usage_mb': mem_usage_actual / (1024 * 1024),
+                    'mem_usage_mb': mem_usage_mb,
                     'mem_percent': mem_percent
-                }
-            except Exception as e:
-                return {'name': container.name, 'error': str(e)}
+                })
+        return stats
 
-        # Parallelize container stats collection
-        stats = []
-        with ThreadPoolExecutor(max_workers=len(containers)) as executor:
-            futures = [executor.submit(get_single_container_stats, c) for c in containers]
-            for future in as_completed(futures):
-                try:
-                    stats.append(future.result())
-                except Exception as e:
-                    console.print(f"[red]Error getting container stats: {e}[/red]")
 
-        return stats
+container_stats_collector = ContainerStatsCollector()
+
+
+def get_container_stats():
+    """Get docker container stats"""
+    try:
+        container_stats = container_stats_collector.collect()
+        for stat in container_stats:
+            if 'error' not in stat:
+                cpu_history = metric_history(f"container_cpu:{stat['name']}")
+                cpu_history.add(stat['cpu_percent'])
+                stat['cpu_sparkline'] = cpu_history.sparkline(width=10)
+        prune_metric_histories("container_cpu:", {stat['name'] for stat in container_stats if 'error' not in stat})
+        return container_stats
     except Exception as e:
+        # Drop the client so the next refresh reconnects to the daemon
+        container_stats_collector.client = None
         return [{'error': str(e)}]
 
 
@@ -672,12 +1456,10 @@ def get_host_stats():
         disk = psutil.disk_usage('/')
 
         # Track history for sparklines
-        cpu_history.append(cpu_percent)
-        mem_history.append(mem.percent)
-        if len(cpu_history) > 50:
-            cpu_history.pop(0)
-        if len(mem_history) > 50:
-            mem_history.pop(0)
+        cpu_history = metric_history('host_cpu')
+        mem_history = metric_history('host_mem')
+        cpu_history.add(cpu_percent)
+        mem_history.add(mem.percent)
 
         return {
             'cpu_percent': cpu_percent,
@@ -685,15 +1467,786 @@ def get_host_stats():
             'mem_available_gb': mem.available / (1024**3),
             'disk_percent': disk.percent,
             'disk_free_gb': disk.free / (1024**3),
-            'cpu_sparkline': create_sparkline(cpu_history),
-            'mem_sparkline': create_sparkline(mem_history)
+            'cpu_sparkline': cpu_history.sparkline(),
+            'mem_sparkline': mem_history.sparkline()
+        }
+    except Exception as e:
+        return {'error': str(e)}
+
+
+class ProcedureTimingAnalyzer:
+    """Per-step statistics of stored procedures from procedure_timing, read incrementally past a high-water id"""
+
+    def __init__(self):
+        self.high_water = None
+        self.gaps = {}  # id skipped below the high-water mark -> time first seen missing
+        self.open_calls = {}  # procedure_call_id -> [last cumulative elapsed_ms, last step time, slowest step, slowest step ms, partial]
+        self.steps = {}  # step_name -> {'durations': RingBuffer, 'count', 'total_ms', 'last_seen'}
+        self.recent_calls = deque(maxlen=PROCEDURE_RECENT_CALLS)
+        self.lock = threading.Lock()
+
+    def step(self, name):
+        stats = self.steps.get(name)
+        if stats is None:
+            stats = self.steps[name] = {'durations': RingBuffer(DIAGNOSTICS_SAMPLES), 'count': 0, 'total_ms': 0.0,
+                                        'last_seen': 0.0}
+        return stats
+
+    def finish_call(self, call_id, finished_at):
+        """Move a call from open to the recent-calls list"""
+        total_ms, _, slowest_step, slowest_ms, partial = self.open_calls.pop(call_id)
+        self.recent_calls.append({'call_id': call_id, 'total_ms': total_ms, 'finished_at': finished_at,
+                                  'slowest_step': slowest_step, 'slowest_step_ms': slowest_ms, 'partial': partial})
+
+    def apply(self, rows):
+        """Fold new procedure_timing rows (ordered by id) into the step statistics"""
+        poll_step_ms = {}
+        for row_id, call_id, step_name, elapsed_ms, step_time in rows:
+            self.high_water = max(self.high_water, row_id)
+            elapsed_ms = float(elapsed_ms or 0)
+            # elapsed_ms is cumulative from the start of the call - a step's own time is the gap from the previous one
+            call = self.open_calls.get(call_id)
+            if call is None:
+                call = self.open_calls[call_id] = [0.0, step_time, None, 0.0, elapsed_ms > 0]
+                if elapsed_ms > 0:
+                    # The call started before the rows read (its 0 ms start row predates the backfill) - this
+                    # step's own time is unknown, so it only sets the baseline for the steps after it
+                    call[0], call[1] = elapsed_ms, step_time
+                    if 'END PROC' in (step_name or ''):
+                        self.finish_call(call_id, step_time)
+                    continue
+            step_ms = max(elapsed_ms - call[0], 0.0)
+            call[0], call[1] = elapsed_ms, step_time
+            if step_ms >= call[3]:
+                call[2], call[3] = step_name, step_ms
+
+            stats = self.step(step_name)
+            stats['durations'].append(step_ms)
+            stats['count'] += 1
+            stats['total_ms'] += step_ms
+            stats['last_seen'] = time.time()
+            poll_step_ms.setdefault(step_name, []).append(step_ms)
+
+            if 'END PROC' in (step_name or ''):
+                self.finish_call(call_id, step_time)
+
+        # Calls whose closing step never arrived are closed out once they go quiet
+        if rows:
+            newest = rows[-1][4]
+            for call_id, call in list(self.open_calls.items()):
+                if newest and call[1] and (newest - call[1]).total_seconds() > PROCEDURE_CALL_TIMEOUT:
+                    self.finish_call(call_id, call[1])
+
+        for step_name, durations in poll_step_ms.items():
+            metric_history(f"procedure_step:{step_name}").add(sum(durations) / len(durations))
+
+        # Steps of a procedure that no longer runs (renamed, removed) would otherwise be kept forever
+        now = time.time()
+        for step_name in [name for name, stats in self.steps.items() if now - stats['last_seen'] > PROCEDURE_STEP_EXPIRY]:
+            del self.steps[step_name]
+        prune_metric_histories("procedure_step:", set(self.steps))
+
+    def track_gaps(self, rows):
+        """Note the ids skipped between the high-water mark and the new rows, and forget long-missing ones"""
+        now = time.time()
+        expected = self.high_water + 1
+        for row in rows:
+            if expected < row[0] <= expected + PROCEDURE_TIMING_GAP_MAX:
+                self.gaps.update(dict.fromkeys(range(expected, row[0]), now))
+            expected = row[0] + 1
+        # A gap that never fills is a rolled-back insert (or a sequence value never used)
+        for row_id in [row_id for row_id, seen in self.gaps.items() if now - seen > PROCEDURE_TIMING_GAP_EXPIRY]:
+            del self.gaps[row_id]
+
+    def collect(self):
+        """Read rows past the high-water mark, and late-committed rows below it, and return the current summary"""
+        with self.lock:
+            if self.high_water is None:
+                newest = db_fetch("SELECT COALESCE(MAX(id), 0) FROM procedure_timing", one=True,
+                                  name="procedure_timing_newest")[0]
+                self.high_water = max(newest - PROCEDURE_TIMING_BACKFILL, 0)
+
+            # ids are taken when a row is inserted but only become visible when its call commits, so a call
+            # still running leaves gaps below the rows past it - those ids are re-read until they turn up
+            late_rows = []
+            if self.gaps:
+                late_rows = db_fetch("""
+                    SELECT id, procedure_call_id, step_name, elapsed_ms, "timestamp"
+                    FROM procedure_timing
+                    WHERE id = ANY(%s)
+                    ORDER BY id
+                """, (sorted(self.gaps),), name="procedure_timing_gaps")
+                for row in late_rows:
+                    del self.gaps[row[0]]
+
+            rows = db_fetch("""
+                SELECT id, procedure_call_id, step_name, elapsed_ms, "timestamp"
+                FROM procedure_timing
+                WHERE id > %s
+                ORDER BY id
+                LIMIT %s
+            """, (self.high_water, PROCEDURE_TIMING_BATCH), name="procedure_timing")
+            self.track_gaps(rows)
+            self.apply(late_rows + rows)
+            return self.summary(backlog=len(rows) == PROCEDURE_TIMING_BATCH)
+
+    def summary(self, backlog=False):
+        """Per-step p50/p95/total (ms) with trend sparklines, and the slowest recent calls"""
+        steps = {}
+        for step_name, stats in self.steps.items():
+            durations = sorted(stats['durations'].tail(DIAGNOSTICS_SAMPLES))
+            steps[step_name] = {
+                'count': stats['count'],
+                'total_ms': stats['total_ms'],
+                'p50_ms': percentile(durations, 50),
+                'p95_ms': percentile(durations, 95),
+                'trend': metric_history(f"procedure_step:{step_name}").sparkline(width=12)
+            }
+        slowest = sorted(self.recent_calls, key=lambda call: call['total_ms'], reverse=True)[:5]
+        return {
+            'steps': steps,
+            'slowest_calls': slowest,
+            'open_calls': len(self.open_calls),
+            'high_water': self.high_water,
+            'backlog': backlog
         }
+
+
+procedure_timing_analyzer = ProcedureTimingAnalyzer()
+
+
+def get_procedure_timing():
+    """Get stored-procedure step timings from procedure_timing"""
+    try:
+        return procedure_timing_analyzer.collect()
     except Exception as e:
         return {'error': str(e)}
 
 
-def create_pipeline_status_panel(dataset_info, peristalsis_state=None):
+class PgActivityCollector:
+    """Wait events and lock blocking from pg_stat_activity, plus per-statement rates from consecutive pg_stat_statements samples"""
+
+    def __init__(self):
+        self.previous = None  # (sampled_at, {(queryid, userid): (calls, total_exec_time)})
+        self.query_text = OrderedDict()
+        self.query_services = {}  # queryid -> {application_name: times seen running it}
+        self.statements_checked_at = 0.0
+        self.statements_available = False
+        self.lock = threading.Lock()
+
+    def sample_activity(self):
+        """Backends grouped by service and wait, and every backend that is blocked by another"""
+        sessions = db_fetch("""
+            SELECT
+                COALESCE(NULLIF(application_name, ''), 'unknown'),
+                state,
+                wait_event_type,
+                wait_event,
+                query_id
+            FROM pg_stat_activity
+            WHERE datname = current_database()
+              AND backend_type = 'client backend'
+              AND pid <> pg_backend_pid()
+              AND COALESCE(application_name, '') <> %s
+        """, (MONITOR_APPLICATION_NAME,), name="pg_activity_sessions")
+
+        waits = {}
+        for app_name, state, wait_event_type, wait_event, query_id in sessions:
+            if state == 'active' and wait_event_type:
+                key = (app_name, wait_event_type, wait_event)
+                waits[key] = waits.get(key, 0) + 1
+            # pg_stat_statements has no application_name - attribute statements to whoever is seen running them
+            if query_id is not None and state == 'active':
+                services = self.query_services.setdefault(query_id, {})
+                services[app_name] = services.get(app_name, 0) + 1
+
+        blocked = db_fetch("""
+            SELECT
+                pid,
+                COALESCE(NULLIF(application_name, ''), 'unknown'),
+                pg_blocking_pids(pid),
+                EXTRACT(epoch FROM now() - query_start),
+                wait_event_type,
+                LEFT(query, 120)
+            FROM pg_stat_activity
+            WHERE datname = current_database()
+              AND cardinality(pg_blocking_pids(pid)) > 0
+            ORDER BY query_start
+        """, name="pg_activity_blocked")
+
+        return (
+            sorted(((app, wtype, wevent, count) for (app, wtype, wevent), count in waits.items()), key=lambda w: -w[3]),
+            [{'pid': pid, 'service': app, 'blocked_by': list(blockers), 'waiting_s': float(waiting or 0),
+              'wait_event_type': wait_type, 'query': query} for pid, app, blockers, waiting, wait_type, query in blocked]
+        )
+
+    def statements_installed(self):
+        """Whether pg_stat_statements can be read, re-checked occasionally so installing it later is picked up"""
+        if not self.statements_available and time.time() - self.statements_checked_at > PG_STATEMENTS_RECHECK:
+            self.statements_checked_at = time.time()
+            self.statements_available = bool(db_fetch(
+                "SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'", one=True, name="pg_stat_statements_installed"))
+        return self.statements_available
+
+    def diff_statements(self, rows, now):
+        """Per-statement calls/sec and ms/sec since the previous sample - None on the first sample"""
+        current = {(queryid, userid): (calls, total_ms) for queryid, userid, calls, total_ms in rows}
+        previous, self.previous = self.previous, (now, current)
+        if previous is None:
+            return None
+
+        elapsed = now - previous[0]
+        if elapsed <= 0:
+            return None
+        rates = []
+        for key, (calls, total_ms) in current.items():
+            prev_calls, prev_ms = previous[1].get(key, (0, 0.0))
+            # A statement evicted and re-added, or a pg_stat_statements_reset(), restarts its counters
+            if calls < prev_calls:
+                prev_calls, prev_ms = 0, 0.0
+            if calls == prev_calls:
+                continue
+            delta_calls = calls - prev_calls
+            delta_ms = total_ms - prev_ms
+            rates.append({
+                'queryid': key[0],
+                'calls_per_sec': delta_calls / elapsed,
+                'ms_per_sec': delta_ms / elapsed,
+                'mean_ms': delta_ms / delta_calls
+            })
+        return sorted(rates, key=lambda rate: rate['ms_per_sec'], reverse=True)
+
+    def statement_texts(self, queryids):
+        """Query text of the given statements, read from pg_stat_statements only for ids not seen before"""
+        missing = [queryid for queryid in queryids if queryid not in self.query_text]
+        if missing:
+            for queryid, query in db_fetch("""
+                SELECT queryid, LEFT(regexp_replace(query, '\\s+', ' ', 'g'), 200)
+                FROM pg_stat_statements
+                WHERE queryid = ANY(%s)
+            """, (missing,), name="pg_stat_statements_texts"):
+                self.query_text[queryid] = query
+        for queryid in queryids:
+            if queryid in self.query_text:
+                self.query_text.move_to_end(queryid)
+        while len(self.query_text) > PG_QUERY_TEXT_CACHE:
+            self.query_text.popitem(last=False)
+        return {queryid: self.query_text.get(queryid, '') for queryid in queryids}
+
+    def service_of(self, queryid):
+        services = self.query_services.get(queryid)
+        return max(services, key=services.get) if services else 'unknown'
+
+    def collect(self):
+        """Sample activity and, where available, statement rates"""
+        with self.lock:
+            waits, blocked = self.sample_activity()
+            result = {'waits': waits, 'blocked': blocked, 'statements': None, 'by_service': {},
+                      'statements_available': self.statements_installed()}
+            if not result['statements_available']:
+                return result
+
+            # showtext := false keeps the per-poll read off the query text file
+            rows = db_fetch("""
+                SELECT queryid, userid, calls, total_exec_time
+                FROM pg_stat_statements(false)
+                WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+                  AND queryid IS NOT NULL
+            """, name="pg_stat_statements")
+            rates = self.diff_statements(rows, time.time())
+            if rates is None:
+                return result
+
+            by_service = {}
+            for rate in rates:
+                rate['service'] = self.service_of(rate['queryid'])
+                by_service[rate['service']] = by_service.get(rate['service'], 0.0) + rate['ms_per_sec']
+            top = rates[:PG_TOP_STATEMENTS]
+            texts = self.statement_texts([rate['queryid'] for rate in top])
+            for rate in top:
+                rate['query'] = texts[rate['queryid']]
+
+            result['statements'] = top
+            result['by_service'] = dict(sorted(by_service.items(), key=lambda item: item[1], reverse=True))
+            return result
+
+
+pg_activity_collector = PgActivityCollector()
+
+
+def get_pg_activity():
+    """Get database wait events, blocking and the statements using the most time"""
+    try:
+        return pg_activity_collector.collect()
+    except Exception as e:
+        return {'error': str(e)}
+
+
+class TableHealthCollector:
+    """Tuple counts, vacuum state, scan mix and sizes per table, with scan rates from consecutive samples"""
+
+    def __init__(self):
+        self.previous = None  # (sampled_at, {table: (seq_scan, idx_scan, seq_tup_read)})
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def seq_fraction(seq_scans, idx_scans):
+        total = seq_scans + idx_scans
+        return seq_scans / total if total else None
+
+    def sample_tables(self):
+        """One row per user table - the autovacuum trigger point uses the global settings, as reloptions are not set here"""
+        rows = db_fetch("""
+            SELECT
+                CASE WHEN t.schemaname = 'public' THEN t.relname ELSE t.schemaname || '.' || t.relname END,
+                t.n_live_tup,
+                t.n_dead_tup,
+                t.seq_scan,
+                t.seq_tup_read,
+                COALESCE(t.idx_scan, 0),
+                EXTRACT(epoch FROM now() - t.last_autovacuum),
+                EXTRACT(epoch FROM now() - GREATEST(t.last_autovacuum, t.last_vacuum)),
+                EXTRACT(epoch FROM now() - GREATEST(t.last_autoanalyze, t.last_analyze)),
+                t.autovacuum_count,
+                current_setting('autovacuum_vacuum_threshold')::float8
+                    + current_setting('autovacuum_vacuum_scale_factor')::float8 * GREATEST(c.reltuples, 0),
+                pg_table_size(t.relid),
+                pg_indexes_size(t.relid)
+            FROM pg_stat_user_tables t
+            JOIN pg_class c ON c.oid = t.relid
+        """, name="table_health_tables")
+        return {row[0]: row[1:] for row in rows}
+
+    def sample_unused_indexes(self):
+        """Indexes never scanned since the stats were reset - unique and primary key indexes excluded, they enforce constraints"""
+        rows = db_fetch("""
+            SELECT
+                CASE WHEN s.schemaname = 'public' THEN s.relname ELSE s.schemaname || '.' || s.relname END,
+                s.indexrelname,
+                pg_relation_size(s.indexrelid)
+            FROM pg_stat_user_indexes s
+            JOIN pg_index i ON i.indexrelid = s.indexrelid
+            WHERE s.idx_scan = 0
+              AND NOT i.indisunique
+              AND pg_relation_size(s.indexrelid) >= %s
+            ORDER BY 3 DESC
+        """, (UNUSED_INDEX_MIN_BYTES,), name="table_health_unused_indexes")
+        return [{'table': table, 'index': index, 'bytes': size} for table, index, size in rows]
+
+    def collect(self):
+        """Sample every user table and flag the ones where sequential scans dominate"""
+        with self.lock:
+            now = time.time()
+            current = self.sample_tables()
+            previous, self.previous = self.previous, (now, {
+                table: (row[2], row[4], row[3]) for table, row in current.items()})
+            elapsed = now - previous[0] if previous else 0
+
+            tables = []
+            for table, (live, dead, seq_scan, seq_tup_read, idx_scan, autovacuum_age, vacuum_age, analyze_age,
+                        autovacuum_count, vacuum_trigger, table_bytes, index_bytes) in current.items():
+                entry = {
+                    'table': table,
+                    'hot': table in TABLE_HEALTH_HOT_TABLES,
+                    'live': live,
+                    'dead': dead,
+                    'dead_ratio': dead / (live + dead) if live + dead else 0.0,
+                    # Above 1.0 autovacuum is due but has not got to the table yet
+                    'vacuum_lag': dead / vacuum_trigger if vacuum_trigger else 0.0,
+                    'autovacuum_age_s': float(autovacuum_age) if autovacuum_age is not None else None,
+                    'vacuum_age_s': float(vacuum_age) if vacuum_age is not None else None,
+                    'analyze_age_s': float(analyze_age) if analyze_age is not None else None,
+                    'autovacuum_count': autovacuum_count,
+                    'seq_scan': seq_scan,
+                    'idx_scan': idx_scan,
+                    'seq_fraction': self.seq_fraction(seq_scan, idx_scan),
+                    'recent_seq_fraction': None,
+                    'seq_rows_per_sec': None,
+                    'table_bytes': table_bytes,
+                    'index_bytes': index_bytes
+                }
+
+                # Cumulative counters hide a recent change in access pattern, so prefer the last interval when it had scans
+                if previous and elapsed > 0 and table in previous[1]:
+                    prev_seq, prev_idx, prev_tup_read = previous[1][table]
+                    if seq_scan >= prev_seq and idx_scan >= prev_idx:
+                        entry['recent_seq_fraction'] = self.seq_fraction(seq_scan - prev_seq, idx_scan - prev_idx)
+                        entry['seq_rows_per_sec'] = (seq_tup_read - prev_tup_read) / elapsed
+
+                fraction = entry['recent_seq_fraction'] if entry['recent_seq_fraction'] is not None else entry['seq_fraction']
+                entry['seq_dominant'] = live >= SEQ_SCAN_MIN_ROWS and fraction is not None and fraction >= SEQ_SCAN_DOMINANT_RATIO
+                tables.append(entry)
+
+            tables.sort(key=lambda entry: entry['table_bytes'] + entry['index_bytes'], reverse=True)
+            return {
+                'tables': tables,
+                'unused_indexes': self.sample_unused_indexes(),
+                'interval_s': elapsed or None
+            }
+
+
+table_health_collector = TableHealthCollector()
+
+
+def get_table_health():
+    """Get dead tuples, vacuum lag, scan mix and sizes of the user tables"""
+    try:
+        return table_health_collector.collect()
+    except Exception as e:
+        return {'error': str(e)}
+
+
+class ThroughputTracker:
+    """Per-stage events/min and ETA for the dataset and each job, from successive snapshots"""
+
+    def __init__(self, history=THROUGHPUT_HISTORY, tau=RATE_EWMA_TAU):
+        self.history = history
+        self.tau = tau
+        self.samples = {}  # scope -> deque of (timestamp, completed per stage, total events)
+        self.rates = {}  # scope -> EWMA events/min per stage
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def completed(processed, enrichment):
+        """Events past each stage - PROCESSED events have been through all of them, enrichment flags cover the active ones"""
+        return tuple(processed + enrichment[key] for _, key in THROUGHPUT_STAGES)
+
+    def observe_scope(self, scope, now, completed, total):
+        """Add one sample for a scope and fold its instantaneous rates into the EWMA"""
+        samples = self.samples.get(scope)
+        if samples is None:
+            samples = self.samples[scope] = deque(maxlen=self.history)
+
+        if samples:
+            last_time, last_completed, _ = samples[-1]
+            elapsed = now - last_time
+            if elapsed <= 0:
+                return
+            # Counts going backwards means events were deleted or re-queued - start the scope over
+            if any(curr < prev for curr, prev in zip(completed, last_completed)):
+                samples.clear()
+                self.rates.pop(scope, None)
+            else:
+                # Time-based alpha keeps smoothing consistent under adaptive polling intervals
+                alpha = 1 - math.exp(-elapsed / self.tau)
+                instant = [(curr - prev) / elapsed * 60 for curr, prev in zip(completed, last_completed)]
+                rates = self.rates.get(scope)
+                if rates is None:
+                    self.rates[scope] = instant
+                else:
+                    self.rates[scope] = [rate + alpha * (inst - rate) for rate, inst in zip(rates, instant)]
+
+        samples.append((now, completed, total))
+
+    def stage_rates(self, scope):
+        """Events/min per stage - the EWMA once the scope's samples span tau, until then the mean rate across all of them"""
+        samples = self.samples[scope]
+        first_time, first_completed, _ = samples[0]
+        last_time, last_completed, _ = samples[-1]
+        span = last_time - first_time
+        # A cold EWMA still leans on its first couple of instantaneous rates, the window does not
+        if 0 < span < self.tau:
+            return [(curr - prev) / span * 60 for curr, prev in zip(last_completed, first_completed)]
+        return self.rates.get(scope)
+
+    def observe(self, dataset_info, jobs, now=None):
+        """Sample the dataset and every job in a snapshot"""
+        now = now or time.time()
+        with self.lock:
+            if dataset_info and 'error' not in dataset_info:
+                total_active, *done = dataset_info['progress']
+                processed = dataset_info['all_event_counts'].get('PROCESSED', 0)
+                enrichment = dict(zip([key for _, key in THROUGHPUT_STAGES], done))
+                self.observe_scope('dataset', now, self.completed(processed, enrichment), total_active + processed)
+                rates = self.stage_rates('dataset')
+                if rates:
+                    for (stage, _), rate in zip(THROUGHPUT_STAGES, rates):
+                        metric_history(f"stage_rate:{stage}").add(rate, now)
+
+            seen = {'dataset'}
+            for job in jobs:
+                # Errored events will never complete a stage, so they don't count towards the remaining work
+                event_counts = job['event_counts']
+                self.observe_scope(job['id'], now, self.completed(event_counts.get('PROCESSED', 0), job['enrichment']),
+                                   job['event_count'] - event_counts.get('PROCESSING_ERROR', 0))
+                seen.add(job['id'])
+
+            # Jobs that left the snapshot take their history with them
+            for scope in set(self.samples) - seen:
+                del self.samples[scope]
+                self.rates.pop(scope, None)
+
+    def summary(self):
+        """{scope: {'stages': {stage: {'rate', 'remaining', 'eta'}}, 'eta'}} - eta in seconds, None when stalled"""
+        with self.lock:
+            result = {}
+            for scope, samples in self.samples.items():
+                _, completed, total = samples[-1]
+                rates = self.stage_rates(scope)
+                stages = {}
+                for idx, (stage, _) in enumerate(THROUGHPUT_STAGES):
+                    remaining = max(total - completed[idx], 0)
+                    rate = rates[idx] if rates else None
+                    if remaining == 0:
+                        eta = 0.0
+                    elif rate and rate > 0:
+                        eta = remaining / rate * 60
+                    else:
+                        eta = None
+                    stages[stage] = {'rate': rate, 'remaining': remaining, 'eta': eta}
+                    if scope == 'dataset':
+                        stages[stage]['sparkline'] = metric_history(f"stage_rate:{stage}").sparkline(width=15)
+
+                # A job is done when its slowest stage is
+                etas = [stage['eta'] for stage in stages.values()]
+                result[scope] = {'stages': stages, 'eta': None if None in etas else max(etas)}
+            return result
+
+
+throughput_tracker = ThroughputTracker()
+
+
+def source_failed(value):
+    """Whether a collector result is an error placeholder rather than real data"""
+    if isinstance(value, dict):
+        return 'error' in value
+    if isinstance(value, list):
+        return bool(value) and 'error' in value[0]
+    return value is None
+
+
+class AsyncCollector:
+    """Runs every data source concurrently under its own deadline and keeps the last good value of each"""
+
+    def __init__(self, sources, deadlines=None, tracker=None):
+        self.sources = sources
+        self.deadlines = deadlines or SOURCE_DEADLINES
+        self.tracker = tracker
+        self.inflight = {}
+        self.last_value = {}
+        self.last_good_at = {}
+        self.latency = {}
+        self.stale = set()
+
+    async def collect_source(self, name):
+        """Collect one source, returning True if it produced fresh data before its deadline"""
+        deadline = self.deadlines.get(name, 5.0)
+        task = self.inflight.get(name)
+        if task is not None and task.done():
+            # A call that overran its last deadline has finished since - its result is this pass's value,
+            # otherwise a source that always runs a little late would never update
+            del self.inflight[name]
+            self.latency[name] = deadline
+            try:
+                return self.store(name, task.result())
+            except Exception as e:
+                return self.store(name, {'error': str(e)})
+
+        # A call that overran its deadline keeps running in its thread - reuse it rather than pile up
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(diagnostics.call, 'collector', name, self.sources[name]))
+            self.inflight[name] = task
+
+        start_time = time.time()
+        try:
+            value = await asyncio.wait_for(asyncio.shield(task), deadline)
+        except asyncio.TimeoutError:
+            self.latency[name] = deadline
+            self.stale.add(name)
+            diagnostics.record_error('collector', name, f"missed {deadline:g}s deadline")
+            return False
+        except Exception as e:
+            value = {'error': str(e)}
+        del self.inflight[name]
+        self.latency[name] = time.time() - start_time
+        return self.store(name, value)
+
+    def store(self, name, value):
+        """Keep a source's result, returning whether it was fresh data rather than an error"""
+        fresh = not source_failed(value)
+        if fresh or name not in self.last_good_at:
+            self.last_value[name] = value
+        if fresh:
+            self.last_good_at[name] = time.time()
+            self.stale.discard(name)
+        else:
+            self.stale.add(name)
+        return fresh
+
+    async def collect(self, names=None):
+        """Run one concurrent collection pass over the given sources (default all) and snapshot the result"""
+        names = list(names or self.sources)
+        fresh = await asyncio.gather(*(self.collect_source(name) for name in names))
+
+        # Rates only move on fresh pipeline counts, never on a repeated stale value
+        if self.tracker and any(ok for name, ok in zip(names, fresh) if name in PIPELINE_SOURCES):
+            self.tracker.observe(self.last_value.get('dataset_info'), self.last_value.get('jobs', ()))
+        return self.snapshot()
+
+    def snapshot(self):
+        """Freeze the latest value of every source into a snapshot"""
+        now = time.time()
+        source_ages = {name: now - self.last_good_at[name] if name in self.last_good_at else None for name in self.sources}
+
+        return MonitorSnapshot(
+            dataset_info=self.last_value.get('dataset_info'),
+            jobs=self.last_value.get('jobs', ()),
+            container_stats=self.last_value.get('containers', []),
+            pg_stats=self.last_value.get('postgres', {}),
+            host_stats=self.last_value.get('host', {}),
+            peristalsis_state=self.last_value.get('peristalsis'),
+            procedure_timing=self.last_value.get('procedures', {}),
+            pg_activity=self.last_value.get('pg_activity', {}),
+            table_health=self.last_value.get('table_health', {}),
+            source_ages=source_ages,
+            stale_sources=frozenset(self.stale),
+            throughput=self.tracker.summary() if self.tracker else {},
+            diagnostics=diagnostics.summary()
+        )
+
+
+class PollScheduler:
+    """Decides when each source is next due, adapting intervals to latency, DB load and pipeline state"""
+
+    def __init__(self, intervals=None):
+        self.intervals = intervals or SOURCE_INTERVALS
+        self.backoff = {name: 1.0 for name in self.intervals}
+        self.next_due = {name: 0.0 for name in self.intervals}
+
+    def due_sources(self, now=None):
+        """Names of the sources whose next poll time has passed"""
+        now = now or time.time()
+        return [name for name, due in self.next_due.items() if due <= now]
+
+    def next_due_in(self, now=None):
+        """Seconds until the soonest source is due"""
+        now = now or time.time()
+        return max(0.0, min(self.next_due.values()) - now)
+
+    def pipeline_factor(self, snapshot):
+        """Poll pipeline sources faster while jobs process and slower once the dataset is idle"""
+        if any(job['status'] == 'PROCESSING' for job in snapshot.jobs):
+            return PROCESSING_SPEEDUP
+        dataset_info = snapshot.dataset_info
+        if dataset_info and dataset_info.get('status') == 'IDLE':
+            return IDLE_SLOWDOWN
+        return 1.0
+
+    def reschedule(self, name, latency, snapshot, now=None):
+        """Set the next poll time of a source from its last latency and the latest snapshot"""
+        now = now or time.time()
+        base = self.intervals[name]
+
+        # Double the interval while calls are slow relative to it, halve it back once they recover
+        if latency is not None and latency > base * SLOW_SOURCE_RATIO:
+            self.backoff[name] = min(self.backoff[name] * 2, MAX_BACKOFF)
+        else:
+            self.backoff[name] = max(self.backoff[name] / 2, 1.0)
+
+        factor = self.backoff[name]
+        if name in DB_SOURCES and snapshot.pg_stats.get('active_queries', 0) > DB_BUSY_ACTIVE_QUERIES:
+            factor *= 2
+        if name in PIPELINE_SOURCES:
+            factor *= self.pipeline_factor(snapshot)
+
+        self.next_due[name] = now + base * factor
+
+
+def create_scheduler(push=False):
+    """Create the poll scheduler, with faster job refreshes when push mode feeds them from memory"""
+    if push:
+        return PollScheduler({**SOURCE_INTERVALS, **PUSH_SOURCE_INTERVALS})
+    return PollScheduler()
+
+
+def create_collector():
+    """Create the async collector wired to every monitor data source"""
+    return AsyncCollector({
+        'dataset_info': get_dataset_info,
+        'jobs': get_job_info,
+        'containers': get_container_stats,
+        'postgres': get_postgres_stats,
+        'host': get_host_stats,
+        'peristalsis': get_peristalsis_state,
+        'procedures': get_procedure_timing,
+        'pg_activity': get_pg_activity,
+        'table_health': get_table_health
+    }, tracker=throughput_tracker)
+
+
+def stale_note(snapshot, *sources):
+    """Staleness note for a panel title, or None if all of its sources made the last refresh"""
+    ages = [snapshot.source_ages.get(name) for name in sources if name in snapshot.stale_sources]
+    if not ages:
+        return None
+    known = [age for age in ages if age is not None]
+    return f"stale {max(known):.0f}s" if known else "no data yet"
+
+
+def mark_stale(panel, snapshot, *sources):
+    """Append a staleness note to a panel title if any of its sources missed the last refresh"""
+    note = stale_note(snapshot, *sources)
+    if note:
+        panel.title = f"{panel.title} [dim yellow]({note})[/]"
+    return panel
+
+
+class CachedRenderable:
+    """Renders a panel once per size and replays the rendered lines on every later refresh"""
+
+    def __init__(self, renderable):
+        self.renderable = renderable
+        self.size = None
+        self.lines = None
+
+    def __rich_console__(self, console, options):
+        size = (options.max_width, options.height)
+        if self.size != size:
+            self.lines = console.render_lines(self.renderable, options)
+            self.size = size
+        for line in self.lines:
+            yield from line
+            yield Segment.line()
+
+
+# name -> (inputs, digest, extra, CachedRenderable) of the last build of each panel
+panel_cache = {}
+
+
+def cached_panel(name, inputs, build, extra=()):
+    """Reuse the last build of a panel unless its inputs changed - by identity first, then by content"""
+    cached = panel_cache.get(name)
+    if cached and cached[2] == extra:
+        cached_inputs, digest, _, renderable = cached
+        if all(a is b for a, b in zip(inputs, cached_inputs)):
+            return renderable
+        # Sources re-collected every poll usually come back with identical content
+        new_digest = hash(repr(inputs))
+        if new_digest == digest:
+            panel_cache[name] = (inputs, digest, extra, renderable)
+            return renderable
+    else:
+        new_digest = hash(repr(inputs))
+
+    renderable = CachedRenderable(build())
+    panel_cache[name] = (inputs, new_digest, extra, renderable)
+    return renderable
+
+
+def format_stage_rate(stage_throughput):
+    """Rate and ETA suffix for an enrichment progress row"""
+    if not stage_throughput or stage_throughput['rate'] is None:
+        return ""
+    if stage_throughput['remaining'] == 0:
+        return f"  [dim]{stage_throughput['rate']:,.0f}/min[/]"
+    if stage_throughput['eta'] is None:
+        return "  [red]stalled[/]"
+    return f"  [dim]{stage_throughput['rate']:,.0f}/min · ETA {format_duration(stage_throughput['eta'])}[/]"
+
+
+def create_pipeline_status_panel(dataset_info, jobs=(), peristalsis_state=None, throughput=None):
     """Create comprehensive pipeline status panel organized by jobs"""
+    throughput = throughput or {}
     if not dataset_info or 'error' in dataset_info:
         return Panel(f"⚠️  Unable to fetch dataset info: {dataset_info.get('error', 'Unknown error')}",
                     title="Pipeline Status", border_style="red")
@@ -712,9 +2265,15 @@ def create_pipeline_status_panel(dataset_info, peristalsis_state=None):
         table.add_row("  Peristalsis:", "[dim]Unknown[/]")
     table.add_row("", "")
 
-    # Get all jobs
-    jobs = get_job_info()
-    
+    # Dataset-wide stage rates with their recent history
+    dataset_throughput = throughput.get('dataset')
+    if dataset_throughput and any(stage['rate'] is not None for stage in dataset_throughput['stages'].values()):
+        table.add_row("[bold yellow]═══ THROUGHPUT (events/min) ═══[/]", "")
+        for stage, stage_throughput in dataset_throughput['stages'].items():
+            rate = stage_throughput['rate'] or 0
+            table.add_row(f"  {stage}:", f"[cyan]{rate:>8,.0f}[/]  [dim]{stage_throughput['sparkline']}[/]")
+        table.add_row("", "")
+
     if not jobs:
         table.add_row("[dim]No active jobs[/]", "")
         return Panel(table, title="> Pipeline Status", border_style="green", box=box.ROUNDED)
@@ -738,21 +2297,13 @@ def create_pipeline_status_panel(dataset_info, peristalsis_state=None):
             try:
                 now = datetime.now(updated_at.tzinfo) if updated_at.tzinfo else datetime.now()
                 duration = now - updated_at
-                total_seconds = int(duration.total_seconds())
-                hours = total_seconds // 3600
-                minutes = (total_seconds % 3600) // 60
-                seconds = total_seconds % 60
-                
-                if hours > 0:
-                    duration_str = f"{hours}h {minutes}m {seconds}s"
-                elif minutes > 0:
-                    duration_str = f"{minutes}m {seconds}s"
-                else:
-                    duration_str = f"{seconds}s"
-                
-                table.add_row("    Duration:", f"[yellow]{duration_str}[/]")
+                table.add_row("    Duration:", f"[yellow]{format_duration(duration.total_seconds())}[/]")
             except:
                 pass
+
+        job_throughput = throughput.get(job_id)
+        if job_throughput and job_throughput['eta'] is not None:
+            table.add_row("    ETA:", f"[yellow]{format_duration(job_throughput['eta'])}[/]")
         
         table.add_row("", "")
         
@@ -771,7 +2322,7 @@ def create_pipeline_status_panel(dataset_info, peristalsis_state=None):
         
         # Datasources subsection
         table.add_row("  [bold]Datasources:[/]", "")
-        datasource_counts = get_job_datasource_counts(job_id)
+        datasource_counts = job['datasource_counts']
         for status in DATASOURCE_STATUSES:
             count = datasource_counts.get(status, 0)
             status_color = "yellow" if status == 'PROCESSING' else "cyan" if 'READY' in status else "red" if 'ERROR' in status else "green"
@@ -780,7 +2331,7 @@ def create_pipeline_status_panel(dataset_info, peristalsis_state=None):
         
         # Datasource Events subsection
         table.add_row("  [bold]Datasource Events:[/]", "")
-        event_counts, enrichment = get_job_datasource_event_counts(job_id)
+        event_counts, enrichment = job['event_counts'], job['enrichment']
         
         # Status breakdown
         for status in DATASOURCE_EVENT_STATUSES:
@@ -805,25 +2356,31 @@ def create_pipeline_status_panel(dataset_info, peristalsis_state=None):
             forecasted_pct = (forecasted_done / total * 100)
             recommended_pct = (recommended_done / total * 100)
             
+            stage_throughput = job_throughput['stages'] if job_throughput else {}
             table.add_row(
                 "    🔍 OSS Enriched:",
                 f"[{'green' if oss_pct == 100 else 'yellow'}]{oss_done:,}/{total:,}[/] ({oss_pct:.1f}%)"
+                + format_stage_rate(stage_throughput.get('oss_enriched'))
             )
             table.add_row(
                 "    📦 Package Indexed:",
                 f"[{'green' if pkg_pct == 100 else 'yellow'}]{pkg_done:,}/{total:,}[/] ({pkg_pct:.1f}%)"
+                + format_stage_rate(stage_throughput.get('package_index_enriched'))
             )
             table.add_row(
                 "    🧪 Analyzed:",
                 f"[{'green' if analyzed_pct == 100 else 'yellow'}]{analyzed_done:,}/{total:,}[/] ({analyzed_pct:.1f}%)"
+                + format_stage_rate(stage_throughput.get('analyzed'))
             )
             table.add_row(
                 "    🔮 Forecasted:",
                 f"[{'green' if forecasted_pct == 100 else 'yellow'}]{forecasted_done:,}/{total:,}[/] ({forecasted_pct:.1f}%)"
+                + format_stage_rate(stage_throughput.get('forecasted'))
             )
             table.add_row(
                 "    💡 Recommended:",
                 f"[{'green' if recommended_pct == 100 else 'yellow'}]{recommended_done:,}/{total:,}[/] ({recommended_pct:.1f}%)"
+                + format_stage_rate(stage_throughput.get('recommended'))
             )
         
         # Add spacing between jobs
@@ -937,9 +2494,14 @@ def create_containers_panel(container_stats):
     table.add_column("Status", style="green", width=12)
     table.add_column("CPU %", justify="right", width=10)
     table.add_column("Memory", justify="right", width=20)
+    table.add_column("CPU Trend", width=10)
 
     if container_stats and 'error' not in container_stats[0]:
         for stat in sorted(container_stats, key=lambda x: x['name']):
+            if 'error' in stat:
+                table.add_row(stat['name'], "[red]error[/]", "", f"[dim]{stat['error'][:20]}[/]", "")
+                continue
+
             status_emoji = "✅" if stat['status'] == 'running' else "❌"
 
             cpu_color = "green" if stat['cpu_percent'] < 50 else "yellow" if stat['cpu_percent'] < 80 else "red"
@@ -949,11 +2511,12 @@ def create_containers_panel(container_stats):
                 stat['name'],
                 f"{status_emoji} {stat['status']}",
                 f"[{cpu_color}]{stat['cpu_percent']:.1f}%[/]",
-                f"[{mem_color}]{stat['mem_usage_mb']:,.0f}MB ({stat['mem_percent']:.1f}%)[/]"
+                f"[{mem_color}]{stat['mem_usage_mb']:,.0f}MB ({stat['mem_percent']:.1f}%)[/]",
+                f"[dim]{stat.get('cpu_sparkline', '')}[/]"
             )
     else:
         error_msg = container_stats[0].get('error', 'Unknown error') if container_stats else 'No stats'
-        table.add_row(f"Error: {error_msg}", "", "", "")
+        table.add_row(f"Error: {error_msg}", "", "", "", "")
 
     return Panel(table, title="D Container Stats", border_style="blue", box=box.ROUNDED)
 
@@ -980,7 +2543,7 @@ def create_postgres_panel(pg_stats):
         # Track service breakdown
         if state not in state_services:
             state_services[state] = {}
-        short_name = app_name.replace('-service', '').replace('analyze', 'anl').replace('orchestrate', 'orch').replace('unknown', 'unk')
+        short_name = short_service_name(app_name)
         state_services[state][short_name] = state_services[state].get(short_name, 0) + count
 
     # Display each state with app breakdown
@@ -999,7 +2562,7 @@ def create_postgres_panel(pg_stats):
             table.add_row(f"{state_label}:", "[dim]0[/]")
 
     table.add_row("", "")
-    table.add_row("Active Queries:", f"[cyan]{pg_stats.get('active_queries', 0)}[/]")
+    table.add_row("Active Queries:", f"[cyan]{pg_stats.get('active_queries', 0)}[/] [dim]{pg_stats.get('active_sparkline', '')}[/]")
 
     return Panel(table, title="P PostgreSQL", border_style="magenta", box=box.ROUNDED)
 
@@ -1037,19 +2600,271 @@ def create_host_panel(host_stats):
     return Panel(table, title="H  Host System", border_style="cyan", box=box.ROUNDED)
 
 
-def create_dashboard(next_refresh_in, dataset_info=None, container_stats=None, pg_stats=None, host_stats=None, peristalsis_state=None, updating=False):
-    """Create the main dashboard layout"""
-    # Only fetch data if not provided (i.e., on actual refresh)
-    if dataset_info is None:
-        dataset_info = get_dataset_info()
-    if container_stats is None:
-        container_stats = get_container_stats()
-    if pg_stats is None:
-        pg_stats = get_postgres_stats()
-    if host_stats is None:
-        host_stats = get_host_stats()
-    if peristalsis_state is None:
-        peristalsis_state = get_peristalsis_state()
+def encode_snapshot_value(value):
+    """JSON fallback for the non-JSON values a snapshot holds"""
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Cannot record {type(value).__name__}")
+
+
+def decode_snapshot_value(obj):
+    """json object_hook restoring datetimes"""
+    if len(obj) == 1 and '$dt' in obj:
+        return datetime.fromisoformat(obj['$dt'])
+    return obj
+
+
+class SnapshotRecorder:
+    """Append-only, size-capped recording of snapshots as gzip-compressed JSON lines, one stream per segment file"""
+
+    def __init__(self, directory=RECORD_DIR, segment_bytes=RECORD_SEGMENT_BYTES, max_bytes=RECORD_MAX_BYTES,
+                 interval=RECORD_INTERVAL):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.file = None
+        self.compressor = None
+        self.last_recorded = 0.0
+        self.disabled = False
+        os.makedirs(directory, exist_ok=True)
+
+    def open_segment(self):
+        """Start a new segment and drop the oldest ones past the size cap"""
+        self.close()
+        path = os.path.join(self.directory, f"snapshots-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.jsonl.gz")
+        self.file = open(path, 'ab')
+        # One deflate stream per segment compresses each snapshot against the ones before it
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+        segments = sorted(glob.glob(os.path.join(self.directory, 'snapshots-*.jsonl.gz')), reverse=True)
+        total = 0
+        for segment in segments:
+            total += os.path.getsize(segment)
+            if total > self.max_bytes and segment != path:
+                os.remove(segment)
+
+    def record(self, snapshot):
+        """Append a snapshot, rotating segments as they fill - a failure stops recording, never the monitor"""
+        now = time.time()
+        if self.disabled or now - self.last_recorded < self.interval:
+            return
+        self.last_recorded = now
+
+        try:
+            if self.file is None or self.file.tell() >= self.segment_bytes:
+                self.open_segment()
+            line = json.dumps({f.name: getattr(snapshot, f.name) for f in fields(snapshot)},
+                              default=encode_snapshot_value, separators=(',', ':')) + '\n'
+            # A sync flush per record keeps everything written so far readable if the monitor dies
+            self.file.write(self.compressor.compress(line.encode()) + self.compressor.flush(zlib.Z_SYNC_FLUSH))
+            self.file.flush()
+        except Exception as e:
+            # A full disk or an unserializable value would fail again on every snapshot
+            self.disabled = True
+            report_error("recorder", f"{e} - recording stopped")
+            try:
+                self.close()
+            except OSError:
+                pass
+
+    def close(self):
+        """Finish the current segment"""
+        if self.file is not None:
+            try:
+                self.file.write(self.compressor.flush())
+            finally:
+                self.file.close()
+                self.file = None
+
+
+def read_recording(path):
+    """Yield recorded snapshots, oldest first, from one segment or a directory of them"""
+    if os.path.isdir(path):
+        segments = sorted(glob.glob(os.path.join(path, 'snapshots-*.jsonl.gz')))
+    else:
+        segments = [path]
+
+    for segment in segments:
+        decompressor = zlib.decompressobj(31)
+        buffered = b''
+        with open(segment, 'rb') as f:
+            # Segments cut short by a crash still decompress up to their last sync flush
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                buffered += decompressor.decompress(chunk)
+                *lines, buffered = buffered.split(b'\n')
+                for line in lines:
+                    record = json.loads(line, object_hook=decode_snapshot_value)
+                    record['stale_sources'] = frozenset(record['stale_sources'])
+                    record['jobs'] = tuple(record['jobs'])
+                    yield MonitorSnapshot(**record)
+
+
+def short_service_name(app_name):
+    """Abbreviate a service application_name the way the postgres panel does"""
+    return app_name.replace('-service', '').replace('analyze', 'anl').replace('orchestrate', 'orch').replace('unknown', 'unk')
+
+
+def create_pg_activity_panel(pg_activity):
+    """Create the database load panel - waits, blocked sessions and the statements using the most time"""
+    if 'error' in pg_activity:
+        return Panel(f"[red]Error: {pg_activity['error']}[/]", title="P Database Load", border_style="red")
+
+    table = Table.grid(padding=(0, 1), expand=True)
+    table.add_column(style="cyan", no_wrap=True, width=20)
+    table.add_column(justify="right", no_wrap=True, width=9)
+    table.add_column(style="dim", no_wrap=True, ratio=1)
+
+    waits = pg_activity.get('waits', [])
+    wait_totals = {}
+    for _, wait_type, wait_event, count in waits:
+        wait_totals[f"{wait_type}:{wait_event}"] = wait_totals.get(f"{wait_type}:{wait_event}", 0) + count
+    if wait_totals:
+        for wait, count in sorted(wait_totals.items(), key=lambda item: -item[1])[:3]:
+            services = ', '.join(f"{short_service_name(app)}:{n}" for app, wtype, wevent, n in waits if f"{wtype}:{wevent}" == wait)
+            table.add_row(wait, f"[yellow]{count}[/]", services)
+    else:
+        table.add_row("Waits:", "[green]none[/]", "")
+
+    blocked = pg_activity.get('blocked', [])
+    if blocked:
+        longest = blocked[0]
+        table.add_row("[red]Blocked:[/]", f"[red]{len(blocked)}[/]",
+                      f"{short_service_name(longest['service'])} {longest['waiting_s']:.0f}s on {longest['blocked_by']}")
+
+    statements = pg_activity.get('statements')
+    if not pg_activity.get('statements_available'):
+        table.add_row("[dim]pg_stat_statements not installed[/]", "", "")
+    elif statements is None:
+        table.add_row("[dim]Sampling statements...[/]", "", "")
+    else:
+        by_service = ', '.join(f"{short_service_name(app)}:{ms:,.0f}" for app, ms in list(pg_activity['by_service'].items())[:4])
+        table.add_row("ms/sec by service:", "", by_service)
+        for statement in statements[:4]:
+            table.add_row(f"  {short_service_name(statement['service'])}",
+                          f"[yellow]{statement['ms_per_sec']:,.0f}ms/s[/]",
+                          f"{statement['calls_per_sec']:,.1f}/s {statement['query']}")
+
+    return Panel(table, title="P Database Load", border_style="magenta", box=box.ROUNDED)
+
+
+def create_table_health_panel(table_health):
+    """Create the table health panel - hot tables first, then seq-scan dominated ones, then the largest"""
+    if 'error' in table_health:
+        return Panel(f"[red]Error: {table_health['error']}[/]", title="🧹 Table Health", border_style="red")
+
+    table = Table(box=box.SIMPLE, show_header=True, header_style="bold cyan", padding=(0, 1))
+    table.add_column("Table", style="cyan", no_wrap=True, max_width=20)
+    table.add_column("Live", justify="right", no_wrap=True)
+    table.add_column("Dead", justify="right", no_wrap=True)
+    table.add_column("Vac'd", justify="right", no_wrap=True)
+    table.add_column("Seq%", justify="right", no_wrap=True)
+    table.add_column("Tbl/Idx", justify="right", no_wrap=True)
+
+    tables = table_health.get('tables', [])
+    hot = [entry for entry in tables if entry['hot']]
+    flagged = [entry for entry in tables if not entry['hot'] and entry['seq_dominant']]
+    rest = [entry for entry in tables if not entry['hot'] and not entry['seq_dominant']]
+    for entry in (hot + flagged + rest)[:TABLE_HEALTH_PANEL_ROWS]:
+        # Red once autovacuum is due but has not run, yellow while a large share of the table is dead
+        dead_color = "red" if entry['vacuum_lag'] > 1 else "yellow" if entry['dead_ratio'] > DEAD_TUPLE_WARN_RATIO else "green"
+        vacuumed = format_duration(entry['autovacuum_age_s']).split()[0] if entry['autovacuum_age_s'] is not None else "never"
+        fraction = entry['recent_seq_fraction'] if entry['recent_seq_fraction'] is not None else entry['seq_fraction']
+        seq = f"{fraction * 100:.0f}%" if fraction is not None else "-"
+        if entry['seq_dominant']:
+            seq = f"[red]⚠{seq}[/]"
+        table.add_row(
+            f"[bold]{entry['table']}[/]" if entry['hot'] else entry['table'],
+            format_compact(entry['live']),
+            f"[{dead_color}]{format_compact(entry['dead'])}[/]",
+            vacuumed,
+            seq,
+            f"{format_bytes(entry['table_bytes'])}/{format_bytes(entry['index_bytes'])}"
+        )
+
+    unused = table_health.get('unused_indexes', [])
+    if unused:
+        table.add_row("[dim]Unused indexes[/]", "", "", "", f"[yellow]{len(unused)}[/]",
+                      f"[yellow]{format_bytes(sum(index['bytes'] for index in unused))}[/]")
+
+    return Panel(table, title="🧹 Table Health", border_style="blue", box=box.ROUNDED)
+
+
+def create_procedure_timing_panel(procedure_timing):
+    """Create the stored-procedure step timing panel from procedure_timing"""
+    if 'error' in procedure_timing:
+        return Panel(f"[red]Error: {procedure_timing['error']}[/]", title="⏱ Procedure Steps", border_style="red")
+
+    table = Table(box=box.SIMPLE, show_header=True, header_style="bold cyan", padding=(0, 1))
+    table.add_column("Step", style="cyan", no_wrap=True, max_width=26)
+    table.add_column("p50", justify="right")
+    table.add_column("p95", justify="right")
+    table.add_column("Total", justify="right")
+    table.add_column("Trend")
+
+    # The steps with the most accumulated time are the ones limiting throughput
+    steps = sorted(procedure_timing.get('steps', {}).items(), key=lambda item: item[1]['total_ms'], reverse=True)
+    def ms(value):
+        return f"{value / 1000:,.1f}s" if value >= 1000 else f"{value:,.0f}ms"
+
+    for step_name, stats in steps[:6]:
+        table.add_row(step_name, ms(stats['p50_ms']), ms(stats['p95_ms']),
+                      format_duration(stats['total_ms'] / 1000), f"[dim]{stats['trend']}[/]")
+    if not steps:
+        table.add_row("[dim]No procedure_timing rows yet[/]", "", "", "", "")
+
+    slowest = procedure_timing.get('slowest_calls', [])
+    if slowest:
+        table.add_row("", "", "", "", "")
+        table.add_row("[bold]Slowest calls[/]", "", "", "", "")
+        for call in slowest[:3]:
+            # A partial call started before the backfill, so its slowest step may be the one not seen
+            partial = " [dim yellow]partial[/]" if call.get('partial') else ""
+            table.add_row(f"  {str(call['call_id'])[:8]} [dim]{call['slowest_step'] or ''}[/]{partial}",
+                          f"[yellow]{ms(call['total_ms'])}[/]", "", "", "")
+
+    title = "⏱ Procedure Steps"
+    if procedure_timing.get('backlog'):
+        title += " [dim yellow](catching up)[/]"
+    return Panel(table, title=title, border_style="yellow", box=box.ROUNDED)
+
+
+def create_diagnostics_panel(diagnostics_summary):
+    """Create the monitor self-diagnostics panel - latency and errors of every collector, query and HTTP call"""
+    table = Table(box=box.SIMPLE, show_header=True, header_style="bold cyan", padding=(0, 1))
+    table.add_column("Call", style="cyan", no_wrap=True)
+    table.add_column("Calls", justify="right")
+    table.add_column("Err", justify="right")
+    table.add_column("p50", justify="right")
+    table.add_column("p95", justify="right")
+    table.add_column("Max", justify="right")
+    table.add_column("Last error", style="dim", no_wrap=True)
+
+    def ms(value):
+        return f"{value:,.0f}ms" if value is not None else "-"
+
+    def rank(item):
+        # Recent failures first, then slowest first so the call holding up a refresh is on top
+        stats = item[1]
+        recently_failed = stats['last_error_age'] is not None and stats['last_error_age'] < DIAGNOSTICS_RECENT_ERROR
+        return (not recently_failed, -(stats['p95_ms'] or 0))
+
+    for key, stats in sorted(diagnostics_summary.items(), key=rank):
+        error_color = "red" if stats['errors'] else "dim"
+        last_error = ""
+        if stats['last_error']:
+            last_error = f"{stats['last_error_age']:.0f}s ago: {' '.join(stats['last_error'].split())}"
+        table.add_row(key, f"{stats['calls']:,}", f"[{error_color}]{stats['errors']:,}[/]",
+                      ms(stats['p50_ms']), ms(stats['p95_ms']), ms(stats['max_ms']), last_error[:80])
+
+    return Panel(table, title="? Monitor Diagnostics", border_style="yellow", box=box.ROUNDED)
+
+
+def create_dashboard(next_refresh_in, snapshot, updating=False, replay_speed=None, show_diagnostics=False):
+    """Create the main dashboard layout from an already collected snapshot"""
+    dataset_info = snapshot.dataset_info
 
     layout = Layout()
 
@@ -1057,6 +2872,7 @@ def create_dashboard(next_refresh_in, dataset_info=None, container_stats=None, p
     layout.split_column(
         Layout(name="header", size=3),
         Layout(name="main"),
+        *([Layout(name="diagnostics", size=14)] if show_diagnostics else []),
         Layout(name="footer", size=1)
     )
 
@@ -1074,6 +2890,8 @@ def create_dashboard(next_refresh_in, dataset_info=None, container_stats=None, p
         seconds = int(next_refresh_in)
         milliseconds = int((next_refresh_in - seconds) * 1000)
         countdown = f"[bold cyan]NEXT UPDATE IN: {seconds}.{milliseconds:03d}s[/]"
+    if replay_speed:
+        countdown = f"[bold yellow]REPLAY {replay_speed:g}x[/]  |  {countdown}"
 
     # Update all panels
     layout["header"].update(
@@ -1087,26 +2905,77 @@ def create_dashboard(next_refresh_in, dataset_info=None, container_stats=None, p
         )
     )
 
-    # Left column
-    layout["left"].update(create_pipeline_status_panel(dataset_info, peristalsis_state))
+    # Panel bodies are only rebuilt when their inputs or staleness change; per tick only the header and footer are
+    # Left column - job durations tick every second
+    layout["left"].update(cached_panel(
+        'pipeline', (dataset_info, snapshot.jobs, snapshot.peristalsis_state, snapshot.throughput),
+        lambda: mark_stale(create_pipeline_status_panel(dataset_info, snapshot.jobs, snapshot.peristalsis_state, snapshot.throughput),
+                           snapshot, 'dataset_info', 'jobs', 'peristalsis'),
+        extra=(stale_note(snapshot, 'dataset_info', 'jobs', 'peristalsis'), int(time.time()))
+    ))
 
     # Middle column
-    layout["middle"].update(create_package_health_panel(dataset_info))
+    package_health = cached_panel(
+        'package_health', (dataset_info,),
+        lambda: mark_stale(create_package_health_panel(dataset_info), snapshot, 'dataset_info'),
+        extra=(stale_note(snapshot, 'dataset_info'),)
+    )
+    # Procedure step timings and table health share the middle column once they have anything to show
+    middle = [Layout(package_health, name="package_health")]
+    if snapshot.procedure_timing.get('steps') or 'error' in snapshot.procedure_timing:
+        middle.append(Layout(cached_panel(
+            'procedures', (snapshot.procedure_timing,),
+            lambda: mark_stale(create_procedure_timing_panel(snapshot.procedure_timing), snapshot, 'procedures'),
+            extra=(stale_note(snapshot, 'procedures'),)
+        ), name="procedures", size=16))
+    if snapshot.table_health:
+        middle.append(Layout(cached_panel(
+            'table_health', (snapshot.table_health,),
+            lambda: mark_stale(create_table_health_panel(snapshot.table_health), snapshot, 'table_health'),
+            extra=(stale_note(snapshot, 'table_health'),)
+        ), name="table_health", size=TABLE_HEALTH_PANEL_ROWS + 6))
+    if len(middle) > 1:
+        layout["middle"].split_column(*middle)
+    else:
+        layout["middle"].update(package_health)
 
     # Right column
     layout["right"].split_column(
         Layout(name="containers"),
         Layout(name="postgres", size=10),
+        Layout(name="pg_activity", size=11),
         Layout(name="host", size=8)
     )
 
-    layout["containers"].update(create_containers_panel(container_stats))
-    layout["postgres"].update(create_postgres_panel(pg_stats))
-    layout["host"].update(create_host_panel(host_stats))
+    layout["containers"].update(cached_panel(
+        'containers', (snapshot.container_stats,),
+        lambda: mark_stale(create_containers_panel(snapshot.container_stats), snapshot, 'containers'),
+        extra=(stale_note(snapshot, 'containers'),)
+    ))
+    layout["postgres"].update(cached_panel(
+        'postgres', (snapshot.pg_stats,),
+        lambda: mark_stale(create_postgres_panel(snapshot.pg_stats), snapshot, 'postgres'),
+        extra=(stale_note(snapshot, 'postgres'),)
+    ))
+    layout["pg_activity"].update(cached_panel(
+        'pg_activity', (snapshot.pg_activity,),
+        lambda: mark_stale(create_pg_activity_panel(snapshot.pg_activity), snapshot, 'pg_activity'),
+        extra=(stale_note(snapshot, 'pg_activity'),)
+    ))
+    layout["host"].update(cached_panel(
+        'host', (snapshot.host_stats,),
+        lambda: mark_stale(create_host_panel(snapshot.host_stats), snapshot, 'host'),
+        extra=(stale_note(snapshot, 'host'),)
+    ))
+
+    if show_diagnostics:
+        layout["diagnostics"].update(cached_panel(
+            'diagnostics', (snapshot.diagnostics,), lambda: create_diagnostics_panel(snapshot.diagnostics)
+        ))
 
     layout["footer"].update(
         Panel(
-            Text(f"T {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | ~ Refresh in {next_refresh_in:.1f}s | Press Ctrl+C to exit",
+            Text(f"T {(snapshot.collected_at if replay_speed else datetime.now()).strftime('%Y-%m-%d %H:%M:%S')} | ~ Refresh in {next_refresh_in:.1f}s | d: diagnostics | Press Ctrl+C to exit",
                  style="dim", justify="center"),
             border_style="dim"
         )
@@ -1115,48 +2984,356 @@ def create_dashboard(next_refresh_in, dataset_info=None, container_stats=None, p
     return layout
 
 
-def main():
-    """Main function"""
-    console.print("\n[bold magenta]Starting PatchFox Monitor...[/bold magenta]\n")
-
+async def collection_loop(collector, scheduler, on_snapshot):
+    """Forever collect whichever sources are due and hand each new snapshot to on_snapshot"""
+    while True:
+        # An error must not end the loop - the dashboard would keep redrawing a frozen snapshot
+        try:
+            due = scheduler.due_sources()
+            if due:
+                snapshot = await collector.collect(due)
+                for name in due:
+                    scheduler.reschedule(name, collector.latency.get(name), snapshot)
+                on_snapshot(snapshot)
+            wait = min(max(scheduler.next_due_in(), 0.05), 1.0)
+        except Exception as e:
+            report_error("collection", e)
+            wait = 1.0
+        await asyncio.sleep(wait)
+
+
+def start_key_reader(on_key):
+    """Feed keypresses from a terminal stdin to on_key on the event loop - returns a function restoring the terminal"""
+    if not sys.stdin.isatty():
+        return lambda: None
+
+    fd = sys.stdin.fileno()
+    saved_mode = termios.tcgetattr(fd)
+    # cbreak delivers keys unbuffered but keeps Ctrl+C working
+    tty.setcbreak(fd)
+    loop = asyncio.get_running_loop()
+    loop.add_reader(fd, lambda: on_key(os.read(fd, 32).decode(errors='ignore')))
+
+    def restore():
+        loop.remove_reader(fd)
+        termios.tcsetattr(fd, termios.TCSADRAIN, saved_mode)
+    return restore
+
+
+def toggle_diagnostics(view, keys):
+    """Key handler flipping the diagnostics panel on 'd'"""
+    if 'd' in keys.lower():
+        view['diagnostics'] = not view['diagnostics']
+
+
+async def run_monitor(push=False, recorder=None, show_diagnostics=False):
+    """Drive the countdown while sources are collected on their own adaptive intervals"""
+    global live_display
+    update_rate = 10  # updates per second for smooth countdown
+    collector = create_collector()
+    scheduler = create_scheduler(push)
+    latest = {}
+    view = {'diagnostics': show_diagnostics}
+
+    def publish(snapshot):
+        latest['snapshot'] = snapshot
+        if recorder:
+            recorder.record(snapshot)
+
+    # Fetch initial data
+    publish(await collector.collect())
+    for name in collector.sources:
+        scheduler.reschedule(name, collector.latency.get(name), latest['snapshot'])
+
+    # Collection runs in the background; redraws only ever read the latest snapshot
+    collecting = asyncio.ensure_future(collection_loop(collector, scheduler, publish))
+    restore_terminal = start_key_reader(lambda keys: toggle_diagnostics(view, keys))
+    live_display = True
     try:
-        refresh_interval = 2.0  # seconds
-        update_rate = 10  # updates per second for smooth countdown
-
-        # Fetch initial data
-        dataset_info = get_dataset_info()
-        container_stats = get_container_stats()
-        pg_stats = get_postgres_stats()
-        host_stats = get_host_stats()
-        peristalsis_state = get_peristalsis_state()
-
-        with Live(create_dashboard(refresh_interval, dataset_info, container_stats, pg_stats, host_stats, peristalsis_state, updating=False),
+        with Live(create_dashboard(scheduler.next_due_in(), latest['snapshot'], updating=False, show_diagnostics=view['diagnostics']),
                   refresh_per_second=update_rate, console=console, screen=True) as live:
             while True:
-                start_time = time.time()
-
                 # Update countdown every 0.1 seconds WITHOUT fetching new data
-                while time.time() - start_time < refresh_interval:
-                    elapsed = time.time() - start_time
-                    remaining = refresh_interval - elapsed
-                    live.update(create_dashboard(remaining, dataset_info, container_stats, pg_stats, host_stats, peristalsis_state, updating=False))
-                    time.sleep(0.1)
+                live.update(create_dashboard(scheduler.next_due_in(), latest['snapshot'], updating=False,
+                                             show_diagnostics=view['diagnostics']))
+                await asyncio.sleep(0.1)
+    finally:
+        live_display = False
+        restore_terminal()
+        collecting.cancel()
+
+
+async def run_replay(path, speed=REPLAY_SPEED):
+    """Play a recording back through the dashboard, speed times faster than it was captured"""
+    snapshots = read_recording(path)
+    snapshot = next(snapshots, None)
+    if snapshot is None:
+        console.print(f"[red]No recorded snapshots in {path}[/red]")
+        return
+
+    view = {'diagnostics': False}
+    restore_terminal = start_key_reader(lambda keys: toggle_diagnostics(view, keys))
+    try:
+        with Live(create_dashboard(0, snapshot, replay_speed=speed),
+                  refresh_per_second=10, console=console, screen=True) as live:
+            for next_snapshot in snapshots:
+                due = time.time() + max((next_snapshot.collected_at - snapshot.collected_at).total_seconds(), 0) / speed
+                while (remaining := due - time.time()) > 0:
+                    live.update(create_dashboard(remaining, snapshot, replay_speed=speed, show_diagnostics=view['diagnostics']))
+                    await asyncio.sleep(min(remaining, 0.1))
+                snapshot = next_snapshot
+                live.update(create_dashboard(0, snapshot, replay_speed=speed, show_diagnostics=view['diagnostics']))
+
+            # Hold the last frame until Ctrl+C
+            while True:
+                live.update(create_dashboard(0, snapshot, replay_speed=speed, show_diagnostics=view['diagnostics']))
+                await asyncio.sleep(0.1)
+    finally:
+        restore_terminal()
+
+
+def prometheus_escape(value):
+    """Escape a Prometheus label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus_metrics(snapshot):
+    """Render a snapshot in Prometheus text exposition format"""
+    families = {}
+
+    def metric(name, help_text, value, metric_type='gauge', **labels):
+        if value is None:
+            return
+        family = families.setdefault(name, (help_text, metric_type, []))
+        label_str = ','.join(f'{key}="{prometheus_escape(val)}"' for key, val in labels.items())
+        family[2].append(f"{name}{{{label_str}}} {float(value)}" if label_str else f"{name} {float(value)}")
+
+    dataset_info = snapshot.dataset_info
+    if dataset_info and 'error' not in dataset_info:
+        for status in DATASET_STATUSES:
+            metric('patchfox_dataset_status', 'Current dataset status (1 for the active status)',
+                   1 if dataset_info['status'] == status else 0, dataset=dataset_info['name'], status=status)
+        for status, count in dataset_info['all_event_counts'].items():
+            metric('patchfox_datasource_events', 'datasource_event rows by status', count, status=status)
+        total_active, oss_done, pkg_done, analyzed_done, forecasted_done, recommended_done = dataset_info['progress']
+        metric('patchfox_active_events', 'datasource_events in PROCESSING or READY states', total_active)
+        for stage, done in [('oss_enriched', oss_done), ('package_index_enriched', pkg_done), ('analyzed', analyzed_done),
+                            ('forecasted', forecasted_done), ('recommended', recommended_done)]:
+            metric('patchfox_enrichment_done', 'Active datasource_events that completed a pipeline stage', done, stage=stage)
+        for job_id, count in dataset_info['job_id_counts'].items():
+            metric('patchfox_job_active_events', 'Active datasource_events per job', count, job_id=job_id)
+        metric('patchfox_datasources', 'Datasources known to data-service', dataset_info['datasource_count'])
+        for kind, counts in [('type', dataset_info['findings']), ('instance', dataset_info['finding_instances']),
+                             ('backlog', dataset_info['finding_backlog'])]:
+            for severity in ['critical', 'high', 'medium', 'low']:
+                metric('patchfox_findings', 'Findings in the current dataset_metrics snapshot', counts[severity], kind=kind, severity=severity)
+        total_packages, downlevel_packages, major_behind, minor_behind, patch_behind, stale_packages = dataset_info['package_metrics']
+        metric('patchfox_packages', 'Packages in the current dataset_metrics snapshot', total_packages)
+        for behind, count in [('any', downlevel_packages), ('major', major_behind), ('minor', minor_behind), ('patch', patch_behind)]:
+            metric('patchfox_downlevel_packages', 'Packages behind their latest version', count, behind=behind)
+        metric('patchfox_stale_packages', 'Packages not updated in over two years', stale_packages)
+        for pkg_type, count in dataset_info['package_types'].items():
+            metric('patchfox_package_types', 'Packages by type in the current snapshot', count, type=pkg_type)
+        metric('patchfox_rps_score', 'Dataset RPS score', dataset_info['rps_score'])
+        metric('patchfox_pes_score', 'Dataset patch efficacy score', dataset_info['pes_score'])
+
+    for job in snapshot.jobs:
+        for status, count in job['event_counts'].items():
+            metric('patchfox_job_events', 'datasource_events per job and status', count, job_id=job['id'], status=status)
+
+    for scope, scope_throughput in snapshot.throughput.items():
+        for stage, stage_throughput in scope_throughput['stages'].items():
+            metric('patchfox_stage_rate_per_minute', 'Smoothed events per minute completing a pipeline stage',
+                   stage_throughput['rate'], scope=scope, stage=stage)
+            metric('patchfox_stage_eta_seconds', 'Estimated seconds until every event has completed a pipeline stage',
+                   stage_throughput['eta'], scope=scope, stage=stage)
+        metric('patchfox_eta_seconds', 'Estimated seconds until every pipeline stage completes', scope_throughput['eta'], scope=scope)
+
+    for stat in snapshot.container_stats:
+        if 'error' in stat:
+            continue
+        metric('patchfox_container_cpu_percent', 'Container CPU usage', stat['cpu_percent'], service=stat['name'])
+        metric('patchfox_container_memory_bytes', 'Container memory usage excluding page cache',
+               stat['mem_usage_mb'] * 1024 * 1024, service=stat['name'])
+        metric('patchfox_container_memory_percent', 'Container memory usage of its limit', stat['mem_percent'], service=stat['name'])
+
+    if 'error' not in snapshot.pg_stats:
+        for app_name, state, count in snapshot.pg_stats.get('conn_by_app', []):
+            metric('patchfox_pg_connections', 'Postgres connections by application and state (monitor excluded)',
+                   count, application=app_name, state=state or 'unknown')
+        metric('patchfox_pg_active_queries', 'Active Postgres queries (monitor excluded)', snapshot.pg_stats.get('active_queries'))
+
+    host_stats = snapshot.host_stats
+    if host_stats and 'error' not in host_stats:
+        metric('patchfox_host_cpu_percent', 'Host CPU usage', host_stats['cpu_percent'])
+        metric('patchfox_host_memory_percent', 'Host memory usage', host_stats['mem_percent'])
+        metric('patchfox_host_disk_percent', 'Host root disk usage', host_stats['disk_percent'])
+
+    if snapshot.peristalsis_state is not None:
+        metric('patchfox_peristalsis_activated', 'Whether orchestrate peristalsis is on', 1 if snapshot.peristalsis_state else 0)
+
+    pg_activity = snapshot.pg_activity
+    if pg_activity and 'error' not in pg_activity:
+        wait_totals = {}
+        for _, wait_type, wait_event, count in pg_activity['waits']:
+            wait_totals[(wait_type, wait_event)] = wait_totals.get((wait_type, wait_event), 0) + count
+        for (wait_type, wait_event), count in wait_totals.items():
+            metric('patchfox_pg_wait_sessions', 'Active backends waiting, by wait event (monitor excluded)',
+                   count, wait_event_type=wait_type, wait_event=wait_event)
+        metric('patchfox_pg_blocked_sessions', 'Backends blocked by another backend', len(pg_activity['blocked']))
+        for service, ms_per_sec in pg_activity['by_service'].items():
+            metric('patchfox_pg_service_exec_ms_per_second', 'pg_stat_statements execution time per second by service',
+                   ms_per_sec, service=service)
+        for statement in pg_activity['statements'] or []:
+            metric('patchfox_pg_statement_exec_ms_per_second', 'Execution time per second of the top pg_stat_statements entries',
+                   statement['ms_per_sec'], queryid=statement['queryid'], service=statement['service'])
+
+    table_health = snapshot.table_health
+    if table_health and 'error' not in table_health:
+        for entry in table_health['tables']:
+            labels = {'table': entry['table']}
+            metric('patchfox_pg_table_live_tuples', 'Estimated live tuples', entry['live'], **labels)
+            metric('patchfox_pg_table_dead_tuples', 'Estimated dead tuples', entry['dead'], **labels)
+            metric('patchfox_pg_table_vacuum_lag_ratio', 'Dead tuples over the autovacuum trigger point', entry['vacuum_lag'], **labels)
+            if entry['autovacuum_age_s'] is not None:
+                metric('patchfox_pg_table_autovacuum_age_seconds', 'Seconds since the last autovacuum', entry['autovacuum_age_s'], **labels)
+            metric('patchfox_pg_table_seq_scans_total', 'Sequential scans', entry['seq_scan'], 'counter', **labels)
+            metric('patchfox_pg_table_idx_scans_total', 'Index scans', entry['idx_scan'], 'counter', **labels)
+            metric('patchfox_pg_table_seq_scan_dominant', 'Whether sequential scans dominate on a large table',
+                   1 if entry['seq_dominant'] else 0, **labels)
+            metric('patchfox_pg_table_size_bytes', 'Table size including TOAST', entry['table_bytes'], **labels)
+            metric('patchfox_pg_table_index_size_bytes', 'Total size of the table indexes', entry['index_bytes'], **labels)
+        for index in table_health['unused_indexes']:
+            metric('patchfox_pg_unused_index_size_bytes', 'Size of non-unique indexes never scanned since the stats reset',
+                   index['bytes'], table=index['table'], index=index['index'])
+
+    for step_name, stats in snapshot.procedure_timing.get('steps', {}).items():
+        for quantile, value in [('0.5', stats['p50_ms']), ('0.95', stats['p95_ms'])]:
+            metric('patchfox_procedure_step_seconds', 'Recent stored-procedure step durations from procedure_timing',
+                   value / 1000, step=step_name, quantile=quantile)
+        metric('patchfox_procedure_step_seconds_total', 'Stored-procedure step time seen since the monitor started',
+               stats['total_ms'] / 1000, 'counter', step=step_name)
+
+    for key, stats in snapshot.diagnostics.items():
+        kind, name = key.split(':', 1)
+        metric('patchfox_monitor_calls_total', 'Instrumented monitor calls', stats['calls'], 'counter', kind=kind, call=name)
+        metric('patchfox_monitor_call_errors_total', 'Failed instrumented monitor calls', stats['errors'], 'counter', kind=kind, call=name)
+        for quantile, value in [('0.5', stats['p50_ms']), ('0.95', stats['p95_ms']), ('1', stats['max_ms'])]:
+            if value is not None:
+                metric('patchfox_monitor_call_seconds', 'Latency of recent monitor calls (quantile 1 is the lifetime max)',
+                       value / 1000, kind=kind, call=name, quantile=quantile)
+
+    for source, age in snapshot.source_ages.items():
+        metric('patchfox_monitor_source_age_seconds', 'Seconds since a source last returned fresh data', age, source=source)
+        metric('patchfox_monitor_source_stale', 'Whether a source missed its last collection', 1 if source in snapshot.stale_sources else 0, source=source)
+
+    lines = []
+    for name, (help_text, metric_type, samples) in families.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+def start_exporter_server(host, port, latest):
+    """Serve latest['metrics'] on /metrics, and the monitor's own call diagnostics as JSON on /diagnostics, from a background thread"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path == '/diagnostics':
+                body = json.dumps(diagnostics.summary(), indent=2).encode()
+                content_type = 'application/json'
+            elif path in ('/metrics', '/'):
+                body = latest.get('metrics', '').encode()
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200 if body else 503)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+    return server
+
+
+async def run_exporter(host=EXPORTER_HOST, port=EXPORTER_PORT, push=False, recorder=None):
+    """Headless mode - one collection loop feeding a Prometheus /metrics endpoint"""
+    collector = create_collector()
+    scheduler = create_scheduler(push)
+    latest = {}
+
+    def publish(snapshot):
+        latest['metrics'] = render_prometheus_metrics(snapshot)
+        if recorder:
+            recorder.record(snapshot)
+
+    server = start_exporter_server(host, port, latest)
+    console.print(f"[bold magenta]Serving metrics on http://{host}:{port}/metrics[/bold magenta]")
+    try:
+        await collection_loop(collector, scheduler, publish)
+    finally:
+        server.shutdown()
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    arg_parser = argparse.ArgumentParser(description="PatchFox pipeline monitor")
+    arg_parser.add_argument('--export', action='store_true',
+                            help="run headless and serve metrics in Prometheus text format instead of the TUI")
+    arg_parser.add_argument('--push', action='store_true',
+                            help="follow datasource_event changes over LISTEN/NOTIFY (needs monitor_notify_triggers.sql)")
+    arg_parser.add_argument('--listen-host', default=EXPORTER_HOST, help="exporter bind address")
+    arg_parser.add_argument('--listen-port', type=int, default=EXPORTER_PORT, help="exporter port")
+    arg_parser.add_argument('--history-resolution', choices=['raw', *HISTORY_ROLLUPS], default=SPARKLINE_RESOLUTION,
+                            help="draw sparklines from raw samples or from the 1m / 15m rollups")
+    arg_parser.add_argument('--diagnostics', action='store_true',
+                            help="start with the self-diagnostics panel open (toggle with 'd')")
+    arg_parser.add_argument('--diagnostics-file', metavar='PATH',
+                            help="write the collector / SQL / HTTP call diagnostics as JSON to PATH on exit")
+    arg_parser.add_argument('--record', nargs='?', const=RECORD_DIR, metavar='DIR',
+                            help=f"append every snapshot to size-capped segment files in DIR (default {RECORD_DIR})")
+    arg_parser.add_argument('--replay', metavar='PATH',
+                            help="play back a recording directory or segment file instead of collecting")
+    arg_parser.add_argument('--speed', type=float, default=REPLAY_SPEED, help="replay speed multiplier")
+    return arg_parser.parse_args(argv)
 
-                # Show UPDATING message
-                live.update(create_dashboard(0, dataset_info, container_stats, pg_stats, host_stats, peristalsis_state, updating=True))
 
-                # Fetch fresh data after countdown completes
-                dataset_info = get_dataset_info()
-                container_stats = get_container_stats()
-                pg_stats = get_postgres_stats()
-                host_stats = get_host_stats()
-                peristalsis_state = get_peristalsis_state()
+def main():
+    """Main function"""
+    global SPARKLINE_RESOLUTION
+    args = parse_args()
+    SPARKLINE_RESOLUTION = args.history_resolution
+    console.print("\n[bold magenta]Starting PatchFox Monitor...[/bold magenta]\n")
 
-                # Display with refreshed data and reset timer to full interval
-                live.update(create_dashboard(refresh_interval, dataset_info, container_stats, pg_stats, host_stats, peristalsis_state, updating=False))
+    recorder = SnapshotRecorder(args.record) if args.record else None
 
+    try:
+        if args.replay:
+            asyncio.run(run_replay(args.replay, args.speed))
+            return
+        if args.push:
+            event_counter.start()
+        if args.export:
+            asyncio.run(run_exporter(args.listen_host, args.listen_port, args.push, recorder))
+        else:
+            asyncio.run(run_monitor(args.push, recorder, args.diagnostics))
     except KeyboardInterrupt:
         console.print("\n\n[bold yellow]👋 Shutting down monitor...[/bold yellow]\n")
+    finally:
+        if recorder:
+            recorder.close()
+        if args.diagnostics_file:
+            with open(args.diagnostics_file, 'w') as f:
+                json.dump(diagnostics.summary(), f, indent=2)
+        close_db_pool()
 
 
 if __name__ == "__main__":
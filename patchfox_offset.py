@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+PatchFox Offset
+Shifts every PatchFox id by a common offset in committed batches - replaces offset_patchfox_ids.sql
+
+The offset is worked out from the largest id or sequence value of the tables
+it shifts, optionally of a second database as well (--against-dbname, the one
+this database will be merged into), and rounded up. An --offset given by hand
+must clear them too, unless --force is passed. Each table is rewritten
+once: its own id, its foreign key columns and its package_indexes array move
+in the same UPDATE, batch by batch over ranges of heap pages, each batch
+committed on its own under session_replication_role = replica.
+
+Because the offset is past every existing id, a value still to be shifted is
+one below the offset. Every batch only touches those, so re-running after an
+interruption carries on with the offset recorded in public.patchfox_offset
+and never shifts a value twice - offset_benchmark.py checks exactly that.
+Sequences are reset and the references checked once every table is done.
+
+    python3 patchfox_offset.py --dry-run
+    python3 patchfox_offset.py --against-dbname mrs_db --workers 4
+    python3 patchfox_offset.py --offset 1000000
+"""
+
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import psycopg2
+from rich.console import Console
+from rich.progress import BarColumn, Progress, TaskProgressColumn, TextColumn, TimeElapsedColumn
+from rich.table import Table
+from rich import box
+
+import patchfox_common as common
+from patchfox_merge import CHILD_TABLES, SEQUENCE_TABLES
+
+console = Console()
+
+# Configuration
+OFFSET_APPLICATION_NAME = "patchfox-offset"
+DEFAULT_WORKERS = 4
+BATCH_ROWS = 50_000  # rows rewritten per committed batch, going by the table's rows per page
+OFFSET_ROUNDING = 1_000_000  # the offset is the next multiple of this past the largest id
+STATE_TABLE = "public.patchfox_offset"
+
+# finding_reporter is merged by name, its ids are kept - as in offset_patchfox_ids.sql
+OFFSET_EXCLUDED = {'finding_reporter'}
+OFFSET_TABLES = [table for table in SEQUENCE_TABLES if table not in OFFSET_EXCLUDED]
+# package_indexes arrays hold package ids
+PACKAGE_INDEX_TABLES = ['datasource', 'dataset_metrics']
+
+
+@dataclass
+class TableOffset:
+    """What moves in one table - its id, the foreign key columns into shifted tables, its package_indexes"""
+    table: str
+    shift_id: bool
+    columns: list
+    package_indexes: bool
+    rows: int = 0
+    pages: int = 0
+    done: int = 0
+    seconds: float = 0.0
+    sample_rate: float = None
+
+    @property
+    def rewrites(self):
+        """Rewritten columns as shown in the plan"""
+        return (['id'] if self.shift_id else []) + self.columns + (['package_indexes'] if self.package_indexes else [])
+
+
+def plan_tables():
+    """Every table with something to shift, in the order the merge knows them"""
+    plans = []
+    for table in dict.fromkeys(OFFSET_TABLES + list(CHILD_TABLES)):
+        columns = [column for column, target in CHILD_TABLES.get(table, {}).get('remap', {}).items()
+                   if target in OFFSET_TABLES]
+        plan = TableOffset(table, table in OFFSET_TABLES, columns, table in PACKAGE_INDEX_TABLES)
+        if plan.shift_id or plan.columns:
+            plans.append(plan)
+    return plans
+
+
+def shifted_values(plan):
+    """column -> its shifted value, and the condition selecting the rows not yet shifted
+
+    A row whose id moves moves whole in one statement, so id below the offset marks it as not
+    shifted yet. A join table has no id, and a NULL reference says nothing about its row, so there
+    each column is checked and shifted on its own.
+    """
+    if plan.shift_id:
+        values = {column: f"{column} + %(offset)s" for column in ['id'] + plan.columns}
+        pending = "id < %(offset)s"
+    else:
+        values = {column: f"CASE WHEN {column} < %(offset)s THEN {column} + %(offset)s ELSE {column} END"
+                  for column in plan.columns}
+        pending = ' OR '.join(f"{column} < %(offset)s" for column in plan.columns)
+    if plan.package_indexes:
+        values['package_indexes'] = """CASE WHEN package_indexes IS NULL THEN NULL ELSE ARRAY(
+            SELECT u.x + %(offset)s FROM unnest(package_indexes) WITH ORDINALITY AS u(x, ord) ORDER BY u.ord) END"""
+    return values, pending
+
+
+def offset_batch_sql(plan):
+    """UPDATE shifting the not yet shifted rows of one page range"""
+    values, pending = shifted_values(plan)
+    return f"""
+        UPDATE public.{plan.table}
+        SET {', '.join(f"{column} = {value}" for column, value in values.items())}
+        WHERE ctid >= %(low)s::tid AND ctid < %(high)s::tid
+          AND ({pending})
+    """
+
+
+def sample_batch_sql(plan):
+    """SELECT working out the shifted values of one page range without writing them - the number of rows"""
+    values, pending = shifted_values(plan)
+    return f"""
+        WITH batch AS MATERIALIZED (
+            SELECT {', '.join(f"{value} AS {column}" for column, value in values.items())}
+            FROM public.{plan.table}
+            WHERE ctid >= %(low)s::tid AND ctid < %(high)s::tid
+              AND ({pending})
+        )
+        SELECT count(*) FROM batch
+    """
+
+
+def largest_ids(cur):
+    """table -> the larger of its max(id) and its sequence position"""
+    largest = {}
+    for table in OFFSET_TABLES:
+        cur.execute(f"""
+            SELECT GREATEST((SELECT max(id) FROM public.{table}),
+                            pg_sequence_last_value(pg_get_serial_sequence('public.{table}', 'id')::regclass))
+        """)
+        largest[table] = cur.fetchone()[0] or 0
+    return largest
+
+
+def compute_offset(largest):
+    """Next multiple of OFFSET_ROUNDING past every id"""
+    return (max(largest.values(), default=0) // OFFSET_ROUNDING + 1) * OFFSET_ROUNDING
+
+
+def load_state(cur):
+    """Offset of an interrupted earlier run, or None"""
+    cur.execute(f"SELECT to_regclass('{STATE_TABLE}') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute(f"SELECT id_offset FROM {STATE_TABLE}")
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def save_state(cur, offset):
+    """Record the offset being applied, so an interrupted run can be finished with it"""
+    cur.execute(f"CREATE TABLE {STATE_TABLE} (id_offset bigint NOT NULL, started_at timestamptz NOT NULL DEFAULT now())")
+    cur.execute(f"INSERT INTO {STATE_TABLE} (id_offset) VALUES (%s)", (offset,))
+
+
+def measure_table(cur, plan):
+    """Fill in the row estimate and page count of plan"""
+    cur.execute("""
+        SELECT c.reltuples::bigint, pg_relation_size(c.oid) / current_setting('block_size')::int
+        FROM pg_class c
+        WHERE c.oid = %s::regclass
+    """, (f"public.{plan.table}",))
+    reltuples, plan.pages = cur.fetchone()
+    if reltuples < 0:
+        cur.execute(f"SELECT count(*) FROM public.{plan.table}")
+        reltuples = cur.fetchone()[0]
+    plan.rows = reltuples
+
+
+def page_ranges(plan):
+    """Page ranges of about BATCH_ROWS rows each - [(low tid, high tid)]"""
+    rows_per_page = plan.rows / plan.pages if plan.pages else 1
+    step = max(1, int(BATCH_ROWS / max(rows_per_page, 1)))
+    return [(f"({low},0)", f"({low + step},0)") for low in range(0, plan.pages, step)]
+
+
+def sample_rate(connect, plan, offset):
+    """Rows per second of reading and shifting the table's first batch, without writing it - None when it has no rows to shift"""
+    ranges = page_ranges(plan)
+    if not ranges:
+        return None
+    conn = connect()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("SET TRANSACTION READ ONLY")
+            start_time = time.time()
+            cur.execute(sample_batch_sql(plan), {'offset': offset, 'low': ranges[0][0], 'high': ranges[0][1]})
+            rows = cur.fetchone()[0]
+            seconds = time.time() - start_time
+        # A first batch already shifted by an interrupted run says nothing about the rest
+        return rows / seconds if rows and seconds else None
+    finally:
+        conn.close()
+
+
+def offset_table(connect, plan, offset, on_batch=None):
+    """Shift one table batch by batch, each batch committed - returns plan with done and seconds filled in"""
+    sql = offset_batch_sql(plan)
+    conn = connect()
+    try:
+        start_time = time.time()
+        for low, high in page_ranges(plan):
+            with conn, conn.cursor() as cur:
+                cur.execute("SET LOCAL session_replication_role = 'replica'")
+                cur.execute(sql, {'offset': offset, 'low': low, 'high': high})
+                plan.done += cur.rowcount
+            plan.seconds = time.time() - start_time
+            if on_batch:
+                on_batch(plan)
+        with conn, conn.cursor() as cur:
+            cur.execute(f"ANALYZE public.{plan.table}")
+        return plan
+    finally:
+        conn.close()
+
+
+def reset_sequences(cur):
+    """Every shifted id sequence continues after the largest id"""
+    for table in OFFSET_TABLES:
+        cur.execute(f"""
+            SELECT setval(pg_get_serial_sequence('public.{table}', 'id'),
+                          COALESCE((SELECT MAX(id) FROM public.{table}), 1), true)
+        """)
+
+
+def orphan_checks():
+    """(label, sql) counting the rows whose reference no longer resolves - every foreign key into a shifted table"""
+    checks = []
+    for table, spec in CHILD_TABLES.items():
+        for column, target in spec.get('remap', {}).items():
+            if target in OFFSET_TABLES:
+                checks.append((f"{table}.{column} → {target}.id", f"""
+                    SELECT count(*) FROM public.{table} c
+                    WHERE c.{column} IS NOT NULL
+                      AND NOT EXISTS (SELECT 1 FROM public.{target} t WHERE t.id = c.{column})
+                """))
+    return checks
+
+
+def validate(connect, workers):
+    """Run the orphan checks in parallel - [(label, orphaned rows)] of the failing ones"""
+    def run(check):
+        label, sql = check
+        conn = connect()
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute(sql)
+                return label, cur.fetchone()[0]
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [(label, count) for label, count in pool.map(run, orphan_checks()) if count]
+
+
+def print_plan(plans, offset, largest, against):
+    """Dry run - per table what moves, how many rows and how long it should take"""
+    source = max(largest, key=largest.get)
+    console.print(f"[bold]Offset +{offset:,}[/] - largest id {largest[source]:,} in {source}"
+                  + (f" (including {against})" if against else ""))
+    table = Table(title="Planned rewrites", box=box.SIMPLE, header_style="bold cyan")
+    table.add_column("Table", style="cyan", no_wrap=True)
+    table.add_column("Columns")
+    table.add_column("Est. rows", justify="right")
+    table.add_column("Batches", justify="right")
+    table.add_column("Rows/sec", justify="right")
+    table.add_column("Est. time", justify="right")
+    total_seconds = 0.0
+    untimed = 0
+    for plan in sorted(plans, key=lambda plan: plan.rows, reverse=True):
+        if plan.sample_rate:
+            seconds = plan.rows / plan.sample_rate
+            total_seconds += seconds
+        else:
+            untimed += bool(plan.rows)
+        table.add_row(plan.table, ', '.join(plan.rewrites), f"{plan.rows:,}", f"{len(page_ranges(plan)):,}",
+                      f"{plan.sample_rate:,.0f}" if plan.sample_rate else "[dim]-[/]",
+                      format_seconds(seconds) if plan.sample_rate else "[dim]unknown[/]" if plan.rows else "-")
+    console.print(table)
+    console.print(f"[bold]Estimated:[/] at least {format_seconds(total_seconds)} of rewriting"
+                  + (f", plus {untimed} tables not timed" if untimed else "")
+                  + " [dim](rates from computing one batch per table without writing it - "
+                    "the writes, WAL and index updates add to it)[/]")
+
+
+def format_seconds(seconds):
+    """Short runs to a tenth of a second, long ones as e.g. 2h 5m 3s"""
+    return f"{seconds:.1f}s" if seconds < 60 else common.format_duration(seconds)
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    arg_parser = argparse.ArgumentParser(description="Shift every PatchFox id by a common offset, in committed batches")
+    arg_parser.add_argument('--offset', type=int, help="offset to add (default: worked out from the largest ids)")
+    arg_parser.add_argument('--against-dbname', help="database on the same server whose ids the offset must also clear")
+    arg_parser.add_argument('--force', action='store_true',
+                            help="use an --offset that does not clear the ids of --against-dbname")
+    arg_parser.add_argument('--dry-run', action='store_true', help="print the offset, rows and estimated time per table")
+    arg_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="tables rewritten at once")
+    arg_parser.add_argument('--host', default=common.POSTGRES_HOST)
+    arg_parser.add_argument('--port', type=int, default=common.POSTGRES_PORT)
+    arg_parser.add_argument('--user', default=common.POSTGRES_USER)
+    arg_parser.add_argument('--password', default=common.POSTGRES_PASSWORD)
+    arg_parser.add_argument('--dbname', default=common.POSTGRES_DB)
+    return arg_parser.parse_args(argv)
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+
+    def connect(dbname=args.dbname):
+        return psycopg2.connect(host=args.host, port=args.port, dbname=dbname, user=args.user,
+                                password=args.password, application_name=OFFSET_APPLICATION_NAME)
+
+    plans = plan_tables()
+    conn = connect()
+    try:
+        with conn, conn.cursor() as cur:
+            resumed_offset = load_state(cur)
+            own_largest = largest_ids(cur)
+            for plan in plans:
+                measure_table(cur, plan)
+    finally:
+        conn.close()
+
+    largest = dict(own_largest)
+    if args.against_dbname:
+        conn = connect(args.against_dbname)
+        try:
+            with conn, conn.cursor() as cur:
+                for table, value in largest_ids(cur).items():
+                    largest[table] = max(largest[table], value)
+        finally:
+            conn.close()
+
+    if resumed_offset:
+        if args.offset and args.offset != resumed_offset:
+            console.print(f"[red]An earlier run was shifting by +{resumed_offset:,}[/] - re-run without --offset to finish it")
+            sys.exit(1)
+        offset = resumed_offset
+        console.print(f"[bold]Resuming[/bold] - shifting the rows still below +{offset:,}")
+    else:
+        offset = args.offset or compute_offset(largest)
+        # Batching relies on every shifted id landing past every id not yet shifted
+        if offset <= max(own_largest.values(), default=0):
+            console.print(f"[red]Offset +{offset:,} does not clear the largest id {max(own_largest.values()):,}[/] - "
+                          f"shifted rows would collide with rows not yet shifted")
+            sys.exit(1)
+        if offset <= max(largest.values(), default=0) and not args.force:
+            console.print(f"[red]Offset +{offset:,} does not clear the largest id {max(largest.values()):,} of "
+                          f"{args.against_dbname}[/] - shifted ids would collide with its ids in the merge; "
+                          f"pass --force to use it anyway")
+            sys.exit(1)
+
+    if args.dry_run:
+        with console.status("Timing one batch per table..."):
+            for plan in plans:
+                plan.sample_rate = sample_rate(connect, plan, offset)
+        print_plan(plans, offset, largest, args.against_dbname)
+        return
+
+    if not resumed_offset:
+        conn = connect()
+        try:
+            with conn, conn.cursor() as cur:
+                save_state(cur, offset)
+        finally:
+            conn.close()
+
+    progress = Progress(
+        TextColumn("{task.description:<28}"), BarColumn(), TaskProgressColumn(),
+        TextColumn("{task.fields[done]:>12,} rows {task.fields[rate]:>10,.0f}/s"), TimeElapsedColumn(),
+        console=console, transient=True
+    )
+    tasks = {}
+    tasks_lock = threading.Lock()
+
+    def on_batch(plan):
+        with tasks_lock:
+            if plan.table not in tasks:
+                tasks[plan.table] = progress.add_task(plan.table, total=plan.rows, done=0, rate=0)
+        progress.update(tasks[plan.table], completed=plan.done, done=plan.done,
+                        rate=plan.done / plan.seconds if plan.seconds else 0)
+
+    def run(plan):
+        offset_table(connect, plan, offset, on_batch)
+        with tasks_lock:
+            task = tasks.pop(plan.table, None)
+        if task is not None:
+            progress.remove_task(task)
+        progress.console.print(f"[green]✓[/] {plan.table:<28} {plan.done:>12,} rows {format_seconds(plan.seconds):>8} "
+                               f"[dim]{', '.join(plan.rewrites)}[/]")
+
+    start_time = time.time()
+    try:
+        with progress, ThreadPoolExecutor(max_workers=args.workers) as pool:
+            # Largest first, so the biggest table is not the one left running alone at the end
+            list(pool.map(run, sorted(plans, key=lambda plan: plan.rows, reverse=True)))
+    except psycopg2.Error as e:
+        console.print(f"[red]Offset failed:[/] {' '.join(str(e).split())} - re-run to carry on with +{offset:,}")
+        sys.exit(1)
+
+    with console.status("Checking references..."):
+        orphans = validate(connect, args.workers)
+    if orphans:
+        for label, count in orphans:
+            console.print(f"[red]✗ {label}: {count:,} orphaned rows[/]")
+        console.print(f"[red]References broken[/] - the offset state is kept in {STATE_TABLE}")
+        sys.exit(1)
+
+    conn = connect()
+    try:
+        with conn, conn.cursor() as cur:
+            reset_sequences(cur)
+            cur.execute(f"DROP TABLE {STATE_TABLE}")
+    finally:
+        conn.close()
+    rows = sum(plan.done for plan in plans)
+    console.print(f"[bold]Shifted by +{offset:,}:[/] {rows:,} rows in {format_seconds(time.time() - start_time)}, "
+                  f"references valid, sequences reset")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+PatchFox Remap
+Rewrites package_indexes arrays through a staging -> public package id map in committed batches
+
+Replaces the per-row correlated unnest / array_agg of update_package_indexes_arr.sql.
+Rows are walked in primary key order in batches bounded by their total number of
+array elements. Each batch is unnested once, joined to the indexed map in a single
+set-based pass, and only the rows that actually contain a remapped id are written.
+Every batch commits together with its position in staging.remap_progress, so an
+interrupted run resumes where it stopped and never remaps a row twice.
+
+The map is staging.map_package (staging_id PRIMARY KEY, public_id), as built by
+patchfox_merge.py.
+
+    python3 patchfox_remap.py datasource
+    python3 patchfox_remap.py dataset_metrics --where "t.id IN (SELECT public_id FROM staging.map_dataset_metrics)"
+"""
+
+import argparse
+import sys
+import time
+import psycopg2
+from rich.console import Console
+from rich.progress import BarColumn, Progress, TaskProgressColumn, TextColumn, TimeElapsedColumn
+
+import patchfox_common as common
+
+console = Console()
+
+# Configuration
+REMAP_APPLICATION_NAME = "patchfox-remap"
+DEFAULT_MAP_TABLE = "staging.map_package"
+DEFAULT_PROGRESS_TABLE = "staging.remap_progress"
+BATCH_ELEMENTS = 200_000  # array elements rewritten per committed batch
+BATCH_MAX_ROWS = 5_000  # rows per batch however short their arrays
+
+
+def remap_batch_sql(table, map_table):
+    """UPDATE for one batch of ids - only the arrays holding an id that actually changes are rebuilt and written
+
+    The whole batch is joined to the map at once rather than probed row by row, so an id
+    shared by many arrays (a popular package) is looked up once per batch.
+    """
+    return f"""
+        WITH touched AS (
+            SELECT DISTINCT t.id
+            FROM public.{table} t
+            CROSS JOIN LATERAL unnest(t.package_indexes) AS u(x)
+            JOIN {map_table} m ON m.staging_id = u.x AND m.public_id <> u.x
+            WHERE t.id = ANY(%(ids)s)
+        ),
+        rewritten AS (
+            SELECT t.id, array_agg(COALESCE(m.public_id, u.x) ORDER BY u.ord) AS package_indexes
+            FROM touched tt
+            JOIN public.{table} t ON t.id = tt.id
+            CROSS JOIN LATERAL unnest(t.package_indexes) WITH ORDINALITY AS u(x, ord)
+            LEFT JOIN {map_table} m ON m.staging_id = u.x
+            GROUP BY t.id
+        )
+        UPDATE public.{table} t
+        SET package_indexes = r.package_indexes
+        FROM rewritten r
+        WHERE t.id = r.id
+          AND t.id = ANY(%(ids)s)
+    """
+
+
+def remap_package_indexes(connect, table, map_table=DEFAULT_MAP_TABLE, where='true', batch_elements=BATCH_ELEMENTS,
+                          progress_table=DEFAULT_PROGRESS_TABLE, on_batch=None):
+    """Remap public.<table>.package_indexes for the rows matching where - returns the totals, including earlier runs"""
+    conn = connect()
+    try:
+        with conn, conn.cursor() as cur:
+            # Concurrent remaps of other tables would otherwise race on creating the progress table
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (progress_table,))
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {progress_table} (
+                    target text PRIMARY KEY,
+                    last_id bigint NOT NULL,
+                    rows_scanned bigint NOT NULL DEFAULT 0,
+                    rows_updated bigint NOT NULL DEFAULT 0,
+                    elements bigint NOT NULL DEFAULT 0,
+                    finished boolean NOT NULL DEFAULT false
+                )
+            """)
+            cur.execute(f"SELECT last_id, rows_scanned, rows_updated, elements, finished FROM {progress_table} WHERE target = %s",
+                        (table,))
+            last_id, rows_scanned, rows_updated, elements, finished = cur.fetchone() or (0, 0, 0, 0, False)
+            cur.execute(f"SELECT count(*) FROM public.{table} t WHERE t.package_indexes IS NOT NULL AND ({where})")
+            total_rows = cur.fetchone()[0]
+
+        result = {'table': table, 'rows': total_rows, 'rows_scanned': rows_scanned, 'rows_updated': rows_updated,
+                  'elements': elements, 'batches': 0, 'seconds': 0.0, 'resumed_from': last_id, 'finished_earlier': finished}
+        start_time = time.time()
+        update_sql = remap_batch_sql(table, map_table)
+        while not finished:
+            with conn, conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT t.id, cardinality(t.package_indexes)
+                    FROM public.{table} t
+                    WHERE t.id > %s
+                      AND t.package_indexes IS NOT NULL
+                      AND ({where})
+                    ORDER BY t.id
+                    LIMIT %s
+                """, (last_id, BATCH_MAX_ROWS))
+                candidates = cur.fetchall()
+
+                # Cut the batch where it passes batch_elements - always at least one row, however long its array
+                ids, batch_size = [], 0
+                for row_id, cardinality in candidates:
+                    if ids and batch_size + cardinality > batch_elements:
+                        break
+                    ids.append(row_id)
+                    batch_size += cardinality
+
+                if ids:
+                    cur.execute(update_sql, {'ids': ids})
+                    rows_updated += cur.rowcount
+                    rows_scanned += len(ids)
+                    elements += batch_size
+                    last_id = ids[-1]
+                finished = not ids
+                cur.execute(f"""
+                    INSERT INTO {progress_table} (target, last_id, rows_scanned, rows_updated, elements, finished)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (target) DO UPDATE
+                    SET last_id = EXCLUDED.last_id, rows_scanned = EXCLUDED.rows_scanned,
+                        rows_updated = EXCLUDED.rows_updated, elements = EXCLUDED.elements, finished = EXCLUDED.finished
+                """, (table, last_id, rows_scanned, rows_updated, elements, finished))
+
+            result.update(rows_scanned=rows_scanned, rows_updated=rows_updated, elements=elements,
+                          seconds=time.time() - start_time)
+            if ids:
+                result['batches'] += 1
+                if on_batch:
+                    on_batch(result)
+        return result
+    finally:
+        conn.close()
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    arg_parser = argparse.ArgumentParser(description="Remap package_indexes arrays through the staging -> public package map")
+    arg_parser.add_argument('table', choices=['datasource', 'dataset_metrics'], help="table whose package_indexes are remapped")
+    arg_parser.add_argument('--map', default=DEFAULT_MAP_TABLE, help="map table with staging_id (indexed) and public_id")
+    arg_parser.add_argument('--where', default='true', help="SQL condition on the rows to remap (alias t)")
+    arg_parser.add_argument('--batch-elements', type=int, default=BATCH_ELEMENTS, help="array elements per committed batch")
+    arg_parser.add_argument('--host', default=common.POSTGRES_HOST)
+    arg_parser.add_argument('--port', type=int, default=common.POSTGRES_PORT)
+    arg_parser.add_argument('--user', default=common.POSTGRES_USER)
+    arg_parser.add_argument('--password', default=common.POSTGRES_PASSWORD)
+    arg_parser.add_argument('--dbname', default=common.POSTGRES_DB)
+    return arg_parser.parse_args(argv)
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+
+    def connect():
+        return psycopg2.connect(host=args.host, port=args.port, dbname=args.dbname, user=args.user,
+                                password=args.password, application_name=REMAP_APPLICATION_NAME)
+
+    progress = Progress(
+        TextColumn("{task.description}"), BarColumn(), TaskProgressColumn(),
+        TextColumn("{task.fields[updated]:>12,} updated {task.fields[rate]:>10,.0f} elements/s"), TimeElapsedColumn(),
+        console=console, transient=True
+    )
+    task = progress.add_task(f"{args.table}.package_indexes", total=None, updated=0, rate=0)
+
+    def on_batch(result):
+        progress.update(task, total=result['rows'], completed=result['rows_scanned'], updated=result['rows_updated'],
+                        rate=result['elements'] / result['seconds'] if result['seconds'] else 0)
+
+    try:
+        with progress:
+            result = remap_package_indexes(connect, args.table, args.map, args.where, args.batch_elements,
+                                           on_batch=on_batch)
+    except psycopg2.Error as e:
+        console.print(f"[red]Remap failed:[/] {' '.join(str(e).split())} - re-run to resume")
+        sys.exit(1)
+
+    if result['finished_earlier']:
+        console.print("[dim]Already finished by an earlier run - nothing to do[/]")
+    elif result['resumed_from']:
+        console.print(f"[dim]Resumed after id {result['resumed_from']:,}[/]")
+    console.print(f"[bold]{args.table}:[/] {result['rows_updated']:,} of {result['rows_scanned']:,} arrays rewritten, "
+                  f"{result['elements']:,} elements in {result['batches']:,} batches, "
+                  f"{result['seconds']:.1f}s this run")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+PatchFox Verify
+Checks package_indexes integrity after a merge - in full over parallel id ranges, or on a random sample
+
+Runs the checks of verify_package_indexes.sql:
+
+    public_only_datasource   ids in public-only datasource arrays all resolve to public.package
+    dataset_metrics          imported dataset_metrics arrays resolve to the staging purls, in the same order
+    datasource               overlapping datasource arrays resolve to the staging purls, in the same order
+
+Each check is split by id range of the table it walks and the ranges run on
+separate connections. With --sample only a random sample of rows is checked
+and the offending share is reported with a confidence interval, scaled to an
+estimate of the offending rows overall. Either way the first offending rows
+are printed with the first purl that differs, and the exit status is 1
+when any check found one.
+
+    python3 patchfox_verify.py --workers 8
+    python3 patchfox_verify.py --sample 20000 --confidence 0.99
+    python3 patchfox_verify.py --checks dataset_metrics --first 50
+"""
+
+import argparse
+import math
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+import psycopg2
+from rich.console import Console
+from rich.progress import BarColumn, Progress, TaskProgressColumn, TextColumn, TimeElapsedColumn
+from rich.table import Table
+from rich import box
+
+import patchfox_common as common
+
+console = Console()
+
+# Configuration
+VERIFY_APPLICATION_NAME = "patchfox-verify"
+DEFAULT_WORKERS = 4
+RANGES_PER_WORKER = 4  # id ranges per worker, so one dense range does not leave the rest idle
+DEFAULT_FIRST = 20  # offending rows shown per check
+DEFAULT_CONFIDENCE = 0.95
+
+# Compares the purls of paired staging / public arrays as verify_package_indexes.sql does: each array is resolved
+# through its package table, ids missing from it dropped, and the resolved purl lists must match in order. The
+# elements of the whole range are joined at once, so a package shared by many arrays is looked up once.
+PURL_COMPARISON = """
+    WITH pairs AS MATERIALIZED ({rows}),
+    staging_purls AS (
+        SELECT pr.key, array_agg(sp.purl ORDER BY u.ord) AS purls
+        FROM pairs pr
+        CROSS JOIN LATERAL unnest(pr.staging_ids) WITH ORDINALITY AS u(id, ord)
+        JOIN staging.package sp ON sp.id = u.id
+        GROUP BY pr.key
+    ),
+    public_purls AS (
+        SELECT pr.key, array_agg(pp.purl ORDER BY u.ord) AS purls
+        FROM pairs pr
+        CROSS JOIN LATERAL unnest(pr.public_ids) WITH ORDINALITY AS u(id, ord)
+        JOIN public.package pp ON pp.id = u.id
+        GROUP BY pr.key
+    )
+    SELECT pr.key, pr.label,
+           CASE WHEN s.purls IS DISTINCT FROM p.purls THEN (
+               SELECT format('purl %%s: staging %%s, public %%s', i, COALESCE(s.purls[i], '-'), COALESCE(p.purls[i], '-'))
+               FROM generate_series(1, greatest(cardinality(s.purls), cardinality(p.purls))) AS i
+               WHERE s.purls[i] IS DISTINCT FROM p.purls[i]
+               ORDER BY i
+               LIMIT 1
+           ) END AS problem
+    FROM pairs pr
+    JOIN staging_purls s ON s.key = pr.key
+    JOIN public_purls p ON p.key = pr.key
+"""
+
+
+@dataclass(frozen=True)
+class Check:
+    """One integrity check of the rows of table in an id range
+
+    rows selects the rows checked for ids %(low)s to %(high)s, with {sample} following the alias of table - it
+    becomes the TABLESAMPLE clause when sampling. sql selects key, label and problem (NULL when fine) from {rows}.
+    """
+    name: str
+    table: str
+    rows: str
+    sql: str
+
+
+@dataclass
+class CheckResult:
+    """Totals of one check over all its ranges"""
+    check: Check
+    ranges: int = 0
+    ranges_done: int = 0
+    checked: int = 0
+    offending: int = 0
+    rows: list = field(default_factory=list)
+    percent: float = 100.0
+    seconds: float = 0.0
+
+
+def build_checks(cur):
+    """The checks - dataset_metrics pairs by staging.map_dataset_metrics when patchfox_merge.py left one, else by txid"""
+    cur.execute("SELECT to_regclass('staging.map_dataset_metrics') IS NOT NULL")
+    if cur.fetchone()[0]:
+        metrics_pairs = """
+            JOIN staging.map_dataset_metrics m ON m.staging_id = s.id
+            JOIN public.dataset_metrics p ON p.id = m.public_id
+        """
+    else:
+        metrics_pairs = "JOIN public.dataset_metrics p ON p.txid = s.txid"
+
+    checks = [
+        Check('public_only_datasource', 'public.datasource', """
+            SELECT d.id AS key, d.purl AS label, d.package_indexes AS ids
+            FROM public.datasource d {sample}
+            WHERE d.id BETWEEN %(low)s AND %(high)s
+              AND d.package_indexes IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM staging.datasource s WHERE s.purl = d.purl)
+        """, """
+            WITH arrays AS MATERIALIZED ({rows}),
+            missing AS (
+                SELECT a.key, count(*) AS ids, (array_agg(u.x ORDER BY u.ord))[1:5] AS first_ids
+                FROM arrays a
+                CROSS JOIN LATERAL unnest(a.ids) WITH ORDINALITY AS u(x, ord)
+                LEFT JOIN public.package pk ON pk.id = u.x
+                WHERE pk.id IS NULL
+                GROUP BY a.key
+            )
+            SELECT a.key, a.label,
+                   CASE WHEN mi.key IS NOT NULL THEN
+                       format('%%s ids not in public.package, first %%s', mi.ids, mi.first_ids)
+                   END AS problem
+            FROM arrays a
+            LEFT JOIN missing mi ON mi.key = a.key
+        """),
+        Check('dataset_metrics', 'staging.dataset_metrics', f"""
+            SELECT s.id AS key, format('public id %%s, txid %%s', p.id, s.txid) AS label,
+                   s.package_indexes AS staging_ids, p.package_indexes AS public_ids
+            FROM staging.dataset_metrics s {{sample}}
+            {metrics_pairs}
+            WHERE s.id BETWEEN %(low)s AND %(high)s
+              AND s.package_indexes IS NOT NULL
+              AND p.package_indexes IS NOT NULL
+        """, PURL_COMPARISON),
+        Check('datasource', 'staging.datasource', """
+            SELECT s.id AS key, format('%%s (public id %%s)', s.purl, p.id) AS label,
+                   s.package_indexes AS staging_ids, p.package_indexes AS public_ids
+            FROM staging.datasource s {sample}
+            JOIN public.datasource p ON p.purl = s.purl
+            WHERE s.id BETWEEN %(low)s AND %(high)s
+              AND s.package_indexes IS NOT NULL
+              AND p.package_indexes IS NOT NULL
+        """, PURL_COMPARISON)
+    ]
+    return {check.name: check for check in checks}
+
+
+def plan_ranges(cur, check, count):
+    """Split the check's table into up to count id ranges of equal width - [(low, high)]"""
+    cur.execute(f"SELECT min(id), max(id) FROM {check.table}")
+    low, high = cur.fetchone()
+    if low is None:
+        return []
+    width = max(1, math.ceil((high - low + 1) / count))
+    return [(start, min(start + width - 1, high)) for start in range(low, high + 1, width)]
+
+
+def sample_percent(cur, check, sample, low, high):
+    """TABLESAMPLE percentage that draws about sample of the rows the check keeps between ids low and high"""
+    # The check's joins and filters keep only part of its table, so the rate is taken from the rows they keep
+    cur.execute(f"SELECT count(*) FROM ({check.rows.format(sample='')}) eligible", {'low': low, 'high': high})
+    rows = cur.fetchone()[0]
+    return min(100.0, 100.0 * sample / rows) if rows else 100.0
+
+
+def check_range(connect, check, low, high, first, percent=100.0, seed=0):
+    """Run one check over one id range - (checked, offending, first offending rows)"""
+    sample = '' if percent >= 100 else "TABLESAMPLE BERNOULLI (%(percent)s) REPEATABLE (%(seed)s)"
+    conn = connect()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("SET TRANSACTION READ ONLY")
+            cur.execute(f"""
+                WITH checked AS MATERIALIZED ({check.sql.format(rows=check.rows.format(sample=sample))})
+                SELECT totals.checked, totals.offending, o.key, o.label, o.problem
+                FROM (SELECT count(*) AS checked, count(problem) AS offending FROM checked) totals
+                LEFT JOIN LATERAL (
+                    SELECT key, label, problem FROM checked WHERE problem IS NOT NULL ORDER BY key LIMIT %(first)s
+                ) o ON true
+            """, {'low': low, 'high': high, 'first': first, 'percent': percent, 'seed': seed})
+            rows = cur.fetchall()
+        checked, offending = rows[0][:2]
+        return checked, offending, [row[2:] for row in rows if row[2] is not None]
+    finally:
+        conn.close()
+
+
+def verify(connect, workers=DEFAULT_WORKERS, first=DEFAULT_FIRST, sample=None, seed=0, checks=None, on_range=None):
+    """Run the checks - check name -> CheckResult; with sample only about that many rows per check are read"""
+    conn = connect()
+    try:
+        with conn, conn.cursor() as cur:
+            available = build_checks(cur)
+            selected = [available[name] for name in (checks or available)]
+            results = {check.name: CheckResult(check) for check in selected}
+            tasks = []
+            for check in selected:
+                ranges = plan_ranges(cur, check, workers * RANGES_PER_WORKER)
+                if sample and ranges:
+                    results[check.name].percent = sample_percent(cur, check, sample, ranges[0][0], ranges[-1][1])
+                results[check.name].ranges = len(ranges)
+                tasks.extend((check, low, high) for low, high in ranges)
+    finally:
+        conn.close()
+
+    start_times = {name: time.time() for name in results}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(check_range, connect, check, low, high, first, results[check.name].percent, seed): check
+                   for check, low, high in tasks}
+        for future in as_completed(futures):
+            check = futures[future]
+            checked, offending, rows = future.result()
+            result = results[check.name]
+            result.ranges_done += 1
+            result.checked += checked
+            result.offending += offending
+            result.rows = sorted(result.rows + rows)[:first]
+            result.seconds = time.time() - start_times[check.name]
+            if on_range:
+                on_range(result)
+    return results
+
+
+def confidence_interval(offending, checked, confidence=DEFAULT_CONFIDENCE):
+    """Wilson score interval for the offending share - (low, high)"""
+    if not checked:
+        return 0.0, 1.0
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    rate = offending / checked
+    center = (rate + z * z / (2 * checked)) / (1 + z * z / checked)
+    margin = z * math.sqrt(rate * (1 - rate) / checked + z * z / (4 * checked * checked)) / (1 + z * z / checked)
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def print_report(results, confidence=DEFAULT_CONFIDENCE):
+    """Totals per check, then the first offending rows of each failing check"""
+    sampled = any(result.percent < 100 for result in results.values())
+    table = Table(title="package_indexes integrity" + (" (sample)" if sampled else ""), box=box.SIMPLE,
+                  header_style="bold cyan")
+    table.add_column("Check", style="cyan", no_wrap=True)
+    table.add_column("Checked", justify="right")
+    table.add_column("Offending", justify="right")
+    if sampled:
+        table.add_column(f"Share ({confidence:.0%})", justify="right")
+        table.add_column("Est. rows", justify="right")
+    table.add_column("Time", justify="right")
+    for result in results.values():
+        row = [result.check.name, f"{result.checked:,}",
+               f"[red]{result.offending:,}[/]" if result.offending else "[green]0[/]"]
+        if sampled and result.checked:
+            low, high = confidence_interval(result.offending, result.checked, confidence)
+            population = result.checked * 100 / result.percent
+            row += [f"{low:.3%} - {high:.3%}", f"{low * population:,.0f} - {high * population:,.0f}"]
+        elif sampled:
+            row += ["[dim]-[/]", "[dim]-[/]"]
+        row.append(f"{result.seconds:.1f}s")
+        table.add_row(*row)
+    console.print(table)
+
+    for result in results.values():
+        if not result.rows:
+            continue
+        offenders = Table(title=f"{result.check.name} - first {len(result.rows)} of {result.offending:,}", box=box.SIMPLE,
+                          header_style="bold red")
+        offenders.add_column(f"{result.check.table}.id", justify="right")
+        offenders.add_column("Row")
+        offenders.add_column("Problem")
+        for key, label, problem in result.rows:
+            offenders.add_row(str(key), label, problem)
+        console.print(offenders)
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    arg_parser = argparse.ArgumentParser(description="Verify package_indexes after a merge, in full or on a random sample")
+    arg_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="id ranges checked at once")
+    arg_parser.add_argument('--sample', type=int, help="check about this many random rows per check instead of all")
+    arg_parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE, help="confidence level of the sample bounds")
+    arg_parser.add_argument('--seed', type=int, default=0, help="sample seed - the same seed draws the same rows")
+    arg_parser.add_argument('--first', type=int, default=DEFAULT_FIRST, help="offending rows shown per check")
+    arg_parser.add_argument('--checks', help="comma-separated checks to run (default all)")
+    arg_parser.add_argument('--host', default=common.POSTGRES_HOST)
+    arg_parser.add_argument('--port', type=int, default=common.POSTGRES_PORT)
+    arg_parser.add_argument('--user', default=common.POSTGRES_USER)
+    arg_parser.add_argument('--password', default=common.POSTGRES_PASSWORD)
+    arg_parser.add_argument('--dbname', default=common.POSTGRES_DB)
+    return arg_parser.parse_args(argv)
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+
+    def connect():
+        return psycopg2.connect(host=args.host, port=args.port, dbname=args.dbname, user=args.user,
+                                password=args.password, application_name=VERIFY_APPLICATION_NAME)
+
+    progress = Progress(
+        TextColumn("{task.description:<24}"), BarColumn(), TaskProgressColumn(),
+        TextColumn("{task.fields[checked]:>12,} checked {task.fields[offending]:>8,} offending"), TimeElapsedColumn(),
+        console=console, transient=True
+    )
+    tasks = {}
+
+    def on_range(result):
+        if result.check.name not in tasks:
+            tasks[result.check.name] = progress.add_task(result.check.name, total=result.ranges, checked=0, offending=0)
+        progress.update(tasks[result.check.name], completed=result.ranges_done, checked=result.checked,
+                        offending=result.offending)
+
+    try:
+        with progress:
+            results = verify(connect, args.workers, args.first, args.sample, args.seed,
+                             args.checks.split(',') if args.checks else None, on_range)
+    except KeyError as e:
+        console.print(f"[red]Unknown check:[/] {e.args[0]}")
+        sys.exit(2)
+    except psycopg2.Error as e:
+        console.print(f"[red]Verify failed:[/] {' '.join(str(e).split())}")
+        sys.exit(2)
+    print_report(results, args.confidence)
+    if any(result.offending for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+PatchFox Remap Benchmark
+Times the package_indexes remap of update_package_indexes_arr.sql against patchfox_remap.py
+
+Builds a scratch database holding a synthetic datasource table whose
+package_indexes arrays draw from public package ids, with a share of the rows
+also carrying staging package ids, and a staging.map_package for those ids.
+Each variant runs on a fresh copy of the same rows:
+
+    script         the correlated UPDATE of update_package_indexes_arr.sql over its unindexed temp map
+    script+index   the same UPDATE with the map's primary key
+    batched        patchfox_remap.remap_package_indexes
+
+and every result is checked against the first, so a speedup never comes from
+a different answer.
+
+    python3 remap_benchmark.py
+    python3 remap_benchmark.py --rows 100000 --array-length 500 --remapped 0.05 --skip-script
+"""
+
+import argparse
+import random
+import sys
+import time
+import psycopg2
+from rich.console import Console
+from rich.table import Table
+from rich import box
+
+import patchfox_common as common
+import patchfox_remap
+
+console = Console()
+
+# Configuration
+BENCH_DB = "patchfox_remap_bench"
+ADMIN_DB = "postgres"
+DEFAULT_ROWS = 20_000
+DEFAULT_ARRAY_LENGTH = 200
+DEFAULT_PACKAGES = 20_000
+DEFAULT_REMAPPED = 0.10  # share of rows carrying staging package ids
+STAGING_IDS_PER_ROW = 5  # staging ids mixed into each remapped row
+
+# update_package_indexes_arr.sql - the datasource statement, map_package being a temp table
+SCRIPT_REMAP_SQL = """
+    UPDATE public.datasource d
+    SET package_indexes = (
+      SELECT COALESCE(
+               array_agg(COALESCE(mp.public_id, x) ORDER BY ord),
+               '{}'::bigint[]
+             )
+      FROM unnest(d.package_indexes) WITH ORDINALITY AS u(x, ord)
+      LEFT JOIN map_package mp ON mp.staging_id = x
+    )
+    WHERE d.package_indexes IS NOT NULL
+      AND EXISTS (
+        SELECT 1
+        FROM unnest(d.package_indexes) AS x
+        JOIN map_package mp ON mp.staging_id = x
+      )
+"""
+
+
+def admin_connect(args, dbname):
+    """Autocommit connection for CREATE / DROP DATABASE"""
+    conn = psycopg2.connect(host=args.host, port=args.port, dbname=dbname, user=args.user, password=args.password)
+    conn.autocommit = True
+    return conn
+
+
+def connect(args):
+    """Connection to the benchmark database"""
+    return psycopg2.connect(host=args.host, port=args.port, dbname=args.dbname, user=args.user, password=args.password,
+                            application_name=patchfox_remap.REMAP_APPLICATION_NAME)
+
+
+def build_database(args):
+    """Create the scratch database with the synthetic arrays in remap_bench.source and the staging map"""
+    conn = admin_connect(args, ADMIN_DB)
+    with conn.cursor() as cur:
+        cur.execute(f"DROP DATABASE IF EXISTS {args.dbname}")
+        cur.execute(f"CREATE DATABASE {args.dbname}")
+    conn.close()
+
+    # Public package ids are 1..packages, staging ids follow and map back onto a random public id
+    rng = random.Random(args.seed)
+    conn = connect(args)
+    with conn, conn.cursor() as cur:
+        cur.execute("CREATE SCHEMA staging")
+        cur.execute("CREATE SCHEMA remap_bench")
+        cur.execute("CREATE TABLE public.datasource (id bigint PRIMARY KEY, package_indexes bigint[])")
+        cur.execute("CREATE TABLE remap_bench.source (id bigint PRIMARY KEY, package_indexes bigint[])")
+        cur.execute("CREATE TABLE staging.map_package (staging_id bigint PRIMARY KEY, public_id bigint NOT NULL)")
+        cur.execute("""
+            INSERT INTO staging.map_package (staging_id, public_id)
+            SELECT %(packages)s + g, 1 + (hashint8(g) & 2147483647) %% %(packages)s
+            FROM generate_series(1, %(packages)s) g
+        """, {'packages': args.packages})
+
+        rows = []
+        for row_id in range(1, args.rows + 1):
+            indexes = rng.sample(range(1, args.packages + 1), min(args.array_length, args.packages))
+            if rng.random() < args.remapped:
+                for position in rng.sample(range(len(indexes)), min(STAGING_IDS_PER_ROW, len(indexes))):
+                    indexes[position] = args.packages + rng.randint(1, args.packages)
+            rows.append((row_id, indexes))
+            if len(rows) == 1000:
+                cur.executemany("INSERT INTO remap_bench.source VALUES (%s, %s)", rows)
+                rows = []
+        if rows:
+            cur.executemany("INSERT INTO remap_bench.source VALUES (%s, %s)", rows)
+        cur.execute("ANALYZE remap_bench.source")
+        cur.execute("ANALYZE staging.map_package")
+    conn.close()
+
+
+def reset_rows(args):
+    """Copy the pristine arrays back into public.datasource and forget any remap progress"""
+    conn = connect(args)
+    with conn, conn.cursor() as cur:
+        cur.execute("TRUNCATE public.datasource")
+        cur.execute("INSERT INTO public.datasource SELECT * FROM remap_bench.source")
+        cur.execute("DROP TABLE IF EXISTS staging.remap_progress")
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("VACUUM ANALYZE public.datasource")
+    conn.close()
+
+
+def fingerprint(args):
+    """md5 over every array in id order"""
+    conn = connect(args)
+    with conn, conn.cursor() as cur:
+        cur.execute("SELECT md5(string_agg(id || ':' || package_indexes::text, '|' ORDER BY id)) FROM public.datasource")
+        result = cur.fetchone()[0]
+    conn.close()
+    return result
+
+
+def run_script(args, indexed):
+    """update_package_indexes_arr.sql as one transaction - returns the updated row count"""
+    conn = connect(args)
+    with conn, conn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE map_package AS SELECT staging_id, public_id FROM staging.map_package")
+        if indexed:
+            cur.execute("ALTER TABLE map_package ADD PRIMARY KEY (staging_id)")
+        cur.execute("ANALYZE map_package")
+        cur.execute(SCRIPT_REMAP_SQL)
+        updated = cur.rowcount
+    conn.close()
+    return updated
+
+
+def run_batched(args):
+    """patchfox_remap over the indexed staging map - returns the updated row count"""
+    result = patchfox_remap.remap_package_indexes(lambda: connect(args), 'datasource', batch_elements=args.batch_elements)
+    return result['rows_updated']
+
+
+def benchmark(args):
+    """Time each variant on a fresh copy of the rows - name -> {'seconds', 'rows', 'fingerprint'}"""
+    variants = [('batched', run_batched), ('script+index', lambda a: run_script(a, indexed=True))]
+    if not args.skip_script:
+        variants.append(('script', lambda a: run_script(a, indexed=False)))
+
+    results = {}
+    for name, run in variants:
+        reset_rows(args)
+        with console.status(f"{name}..."):
+            start_time = time.time()
+            updated = run(args)
+            seconds = time.time() - start_time
+        results[name] = {'seconds': seconds, 'rows': updated, 'fingerprint': fingerprint(args)}
+    return results
+
+
+def print_report(args, results):
+    """Timings relative to the script, mismatching results marked"""
+    elements = args.rows * args.array_length
+    baseline = results.get('script', results['script+index'])
+    expected = results['batched']['fingerprint']
+
+    table = Table(title=f"package_indexes remap - {args.rows:,} rows x {args.array_length:,} ids, "
+                        f"{args.remapped:.0%} remapped, {args.packages:,} mapped packages", box=box.SIMPLE)
+    table.add_column("Variant")
+    table.add_column("Seconds", justify="right")
+    table.add_column("Elements/s", justify="right")
+    table.add_column("Updated", justify="right")
+    table.add_column("Speedup", justify="right")
+    table.add_column("Result")
+    for name, result in results.items():
+        matches = result['fingerprint'] == expected
+        table.add_row(name, f"{result['seconds']:.2f}", f"{elements / result['seconds']:,.0f}", f"{result['rows']:,}",
+                      f"{baseline['seconds'] / result['seconds']:.1f}x",
+                      "[green]same[/]" if matches else "[red]DIFFERENT[/]")
+    console.print(table)
+    return all(result['fingerprint'] == expected for result in results.values())
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    arg_parser = argparse.ArgumentParser(description="Benchmark the package_indexes remap over synthetic arrays")
+    arg_parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help="rows with a package_indexes array")
+    arg_parser.add_argument('--array-length', type=int, default=DEFAULT_ARRAY_LENGTH, help="package ids per array")
+    arg_parser.add_argument('--packages', type=int, default=DEFAULT_PACKAGES, help="public packages, each with a staging twin")
+    arg_parser.add_argument('--remapped', type=float, default=DEFAULT_REMAPPED, help="share of rows holding staging ids")
+    arg_parser.add_argument('--batch-elements', type=int, default=patchfox_remap.BATCH_ELEMENTS,
+                            help="array elements per batch for patchfox_remap")
+    arg_parser.add_argument('--skip-script', action='store_true', help="skip the unindexed script - slow at scale")
+    arg_parser.add_argument('--seed', type=int, default=1)
+    arg_parser.add_argument('--host', default=common.POSTGRES_HOST)
+    arg_parser.add_argument('--port', type=int, default=common.POSTGRES_PORT)
+    arg_parser.add_argument('--user', default=common.POSTGRES_USER)
+    arg_parser.add_argument('--password', default=common.POSTGRES_PASSWORD)
+    arg_parser.add_argument('--dbname', default=BENCH_DB, help="scratch database - dropped and recreated")
+    return arg_parser.parse_args(argv)
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+    with console.status("Building synthetic arrays..."):
+        build_database(args)
+    results = benchmark(args)
+    if not print_report(args, results):
+        console.print("[red]Variants disagree - the remap is wrong, not just slow[/]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()